@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Score analytics: the distribution of the scores, durations and powerups of
+every game played, kept in constant memory.
+
+Each distribution is held in a KLL sketch (Karnin, Lang and Liberty, "Optimal
+Quantile Approximation in Streams", 2016). A sketch is a stack of compactors:
+values go into the bottom one, and when a compactor is full it is sorted and
+every other value (starting from the first or the second, at random) is
+promoted to the one above, where each value stands for twice as many. The
+compactors shrink geometrically towards the bottom, so the sketch holds
+about 3k values however many are added, and the rank of any value is within
+about 1.7/k of the true rank (around 1% for the default k of 200).
+
+Sketches of the same size can be merged by pooling their compactors, so the
+analytics from many cabinets, or from batch runs, can be combined into one.
+
+The ScoreAnalytics are saved to the file given to the game with --analytics
+(such as analytics.json, next to the hi-score table). To see the percentiles,
+merging the files from several cabinets:
+
+    python analytics.py cabinet1/analytics.json cabinet2/analytics.json
+
+and add '--output merged.json' to save the merged analytics.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+from bisect import bisect_left, bisect_right
+
+class KLLSketch(object):
+    """
+    A mergeable sketch of the distribution of a stream of numbers.
+    """
+
+    def __init__(self, k = 200, c = 2.0 / 3.0, seed = None):
+        """
+        Params:
+            k    : the size of the top compactor, which sets the accuracy
+            c    : the ratio between the sizes of neighbouring compactors
+            seed : seed for the coin flips when compacting (the sketch has its
+                   own generator, so the game's random numbers are untouched)
+        """
+        self.k = k
+        self.c = c
+        self.random = random.Random(seed)
+        self.compactors = [[]]
+        self.count = 0
+        self.size = 0
+        self.max_size = 0
+        self.cumulative = None
+        self.grow_limits()
+
+    def __len__(self):
+        return self.count
+
+    def capacity(self, level):
+        """
+        Returns the number of values which the compactor at the specified
+        level can hold before it is compacted.
+        """
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil(self.k * self.c ** depth)) + 1
+
+    def grow_limits(self):
+        self.max_size = sum([self.capacity(level) for level in range(0, len(self.compactors))])
+
+    def add(self, value):
+        """
+        Adds a value to the sketch.
+        """
+        self.compactors[0].append(value)
+        self.count = self.count + 1
+        self.size = self.size + 1
+        self.cumulative = None
+        if self.size >= self.max_size:
+            self.compress()
+
+    def compress(self):
+        """
+        Compacts the lowest full compactor, promoting half its values.
+        """
+        for level in range(0, len(self.compactors)):
+            compactor = self.compactors[level]
+            if len(compactor) >= self.capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append([])
+                    self.grow_limits()
+                compactor.sort()
+                # Keep the odd one out (if any) at this level
+                if len(compactor) % 2:
+                    leftover = [compactor.pop()]
+                else:
+                    leftover = []
+                offset = self.random.randint(0, 1)
+                self.compactors[level + 1].extend(compactor[offset::2])
+                self.compactors[level] = leftover
+                self.size = sum([len(values) for values in self.compactors])
+                if self.size < self.max_size:
+                    break
+
+    def merge(self, other):
+        """
+        Adds the values summarised by another sketch (which must have the same
+        k and c) to this one.
+        """
+        if other.k != self.k or other.c != self.c:
+            raise ValueError("Only sketches of the same size can be merged")
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append([])
+        self.grow_limits()
+        for level, values in enumerate(other.compactors):
+            self.compactors[level].extend(values)
+        self.count = self.count + other.count
+        self.size = sum([len(values) for values in self.compactors])
+        self.cumulative = None
+        while self.size >= self.max_size:
+            self.compress()
+
+    def prepare(self):
+        """
+        Builds the sorted values and their cumulative weights, which rank()
+        and quantile() search. This is only redone after the sketch changes.
+        """
+        if self.cumulative is None:
+            weighted = []
+            for level, values in enumerate(self.compactors):
+                weight = 1 << level
+                weighted.extend([(value, weight) for value in values])
+            weighted.sort()
+            total = 0
+            cumulative = []
+            for value, weight in weighted:
+                total = total + weight
+                cumulative.append(total)
+            self.values = [value for value, weight in weighted]
+            self.cumulative = cumulative
+        return self.cumulative
+
+    def rank(self, value, inclusive = False):
+        """
+        Returns the (approximate) fraction of the values which are less than
+        the specified value (or less than or equal to it, if 'inclusive').
+        """
+        cumulative = self.prepare()
+        if not cumulative:
+            return 0.0
+        if inclusive:
+            index = bisect_right(self.values, value)
+        else:
+            index = bisect_left(self.values, value)
+        if index == 0:
+            return 0.0
+        return cumulative[index - 1] / float(cumulative[-1])
+
+    def quantile(self, fraction):
+        """
+        Returns the (approximate) value below which the specified fraction of
+        the values lie, or None if the sketch is empty.
+        """
+        cumulative = self.prepare()
+        if not cumulative:
+            return None
+        index = bisect_left(cumulative, fraction * cumulative[-1])
+        return self.values[min(index, len(self.values) - 1)]
+
+    def to_dict(self):
+        return {"k": self.k, "c": self.c, "count": self.count, "compactors": self.compactors}
+
+    @classmethod
+    def from_dict(cls, data):
+        sketch = cls(data["k"], data["c"])
+        sketch.compactors = [list(values) for values in data["compactors"]] or [[]]
+        sketch.count = data["count"]
+        sketch.size = sum([len(values) for values in sketch.compactors])
+        sketch.grow_limits()
+        return sketch
+
+class ScoreAnalytics(object):
+    """
+    The distributions of the score, duration (in seconds) and powerups
+    collected in every finished game.
+    """
+
+    # The measures recorded for each game
+    MEASURES = ["score", "duration", "powerups"]
+
+    # The percentiles shown by report()
+    PERCENTILES = [10, 25, 50, 75, 90, 99]
+
+    def __init__(self, k = 200):
+        self.k = k
+        self.sketches = dict([(name, KLLSketch(k)) for name in self.MEASURES])
+
+    def __len__(self):
+        return len(self.sketches["score"])
+
+    def add(self, score, duration, powerups):
+        """
+        Records a finished game.
+        """
+        self.sketches["score"].add(score)
+        self.sketches["duration"].add(round(duration, 1))
+        self.sketches["powerups"].add(powerups)
+
+    def score_rank(self, score):
+        """
+        Returns the fraction of the recorded games with a lower score.
+        """
+        return self.sketches["score"].rank(score)
+
+    def merge(self, other):
+        """
+        Adds the games recorded by another ScoreAnalytics to these.
+        """
+        for name in self.MEASURES:
+            self.sketches[name].merge(other.sketches[name])
+
+    def read(self, filename):
+        """
+        Reads the analytics saved by write(), adding them to these. Returns
+        False if the file does not exist.
+        """
+        if not os.path.exists(filename):
+            return False
+        f = open(filename, "r")
+        try:
+            data = json.load(f)
+        finally:
+            f.close()
+        other = ScoreAnalytics(self.k)
+        for name in self.MEASURES:
+            other.sketches[name] = KLLSketch.from_dict(data[name])
+        self.merge(other)
+        return True
+
+    def write(self, filename):
+        fo = open(filename, "w")
+        json.dump(dict([(name, sketch.to_dict()) for name, sketch in self.sketches.items()]), fo, separators = (",", ":"))
+        fo.close()
+
+    def report(self):
+        """
+        Returns a table of the percentiles of each measure, as a list of lines
+        of text.
+        """
+        lines = ["%d games" % len(self), "%-10s" % "" + "".join(["%10s" % ("p%d" % p) for p in self.PERCENTILES])]
+        for name in self.MEASURES:
+            sketch = self.sketches[name]
+            values = [sketch.quantile(p / 100.0) for p in self.PERCENTILES]
+            lines.append("%-10s" % name + "".join(["%10s" % ("-" if value is None else "%g" % value) for value in values]))
+        return lines
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Shows the percentiles of the score analytics, merging the files given.")
+    parser.add_argument("files", nargs = "+", help = "analytics files (analytics.json) to merge")
+    parser.add_argument("--output", help = "file to write the merged analytics to")
+    args = parser.parse_args()
+    analytics = ScoreAnalytics()
+    for filename in args.files:
+        if not analytics.read(filename):
+            parser.error("%s does not exist" % filename)
+    for line in analytics.report():
+        print line
+    if args.output:
+        analytics.write(args.output)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+The asset import step, which chooses the fastest surface format for each
+graphic.
+
+Blitting an image with per-pixel alpha blends every pixel, even when the image
+is fully opaque or each pixel is either fully opaque or fully transparent. So
+each graphic is given one of the IMAGE_FORMATS, according to its alpha
+channel:
+
+    opaque   - no transparent pixels, so the image is converted to the
+               display's format without alpha and blitted as a plain copy
+    colorkey - every pixel is either fully opaque or fully transparent, so the
+               transparent pixels are set to a colour which the image does not
+               otherwise use, and that colour is made the colorkey. The image
+               is run-length encoded (RLEACCEL), so the blitter skips the
+               transparent runs instead of testing each pixel.
+    alpha    - partly transparent pixels, which need per-pixel alpha
+
+Run this from the command-line after adding or changing any graphics:
+
+    python assets.py
+
+It writes the chosen formats to the manifest (graphics/manifest.txt), which the
+GraphicStore reads. Graphics which are not in the manifest keep their
+per-pixel alpha.
+"""
+
+import os
+import re
+import glob
+import struct
+
+import pygame
+from pygame.locals import *
+
+# The surface formats, from fastest to slowest to blit
+IMAGE_FORMATS = ["opaque", "colorkey", "alpha"]
+
+# The name of the manifest, in the graphics directory
+MANIFEST = "manifest.txt"
+
+# The colours tried as the colorkey, in order. The first one which the image
+# does not use is chosen.
+KEY_COLOURS = [(255, 0, 255), (0, 255, 255), (255, 255, 0), (1, 2, 3)]
+
+# A run of fully transparent pixels, in a string of alpha values
+TRANSPARENT_RUN = re.compile(b"\x00+")
+
+def colour_used(pixels, colour):
+    """
+    Returns True if any opaque pixel in the RGBA data is the specified colour.
+    """
+    needle = struct.pack("BBBB", colour[0], colour[1], colour[2], 255)
+    offset = pixels.find(needle)
+    while offset != -1:
+        if offset % 4 == 0:
+            return True
+        offset = pixels.find(needle, offset + 1)
+    return False
+
+def choose_format(image):
+    """
+    Returns the best format (one of IMAGE_FORMATS) for the image, and the
+    colorkey to use for it (or None).
+    """
+    pixels = pygame.image.tostring(image, "RGBA")
+    levels = set(pixels[3::4])
+    if levels == set([b"\xff"]):
+        return ("opaque", None)
+    if levels <= set([b"\x00", b"\xff"]):
+        for colour in KEY_COLOURS:
+            if not colour_used(pixels, colour):
+                return ("colorkey", colour)
+    return ("alpha", None)
+
+def convert_image(image, image_format = None, colorkey = None):
+    """
+    Converts a loaded image to the display's format, as the specified format.
+    Images without a format keep their per-pixel alpha.
+    """
+    if image_format == "opaque":
+        return image.convert()
+    if image_format == "colorkey":
+        # Blitting the image onto the colorkey would blend it (which is not
+        # exact for opaque pixels in pygame 1.9), so instead the transparent
+        # runs of each row are filled with the colorkey
+        converted = image.convert()
+        width = image.get_width()
+        alpha = pygame.image.tostring(image, "RGBA")[3::4]
+        for run in TRANSPARENT_RUN.finditer(alpha):
+            start, end = run.span()
+            while start < end:
+                y, x = divmod(start, width)
+                length = min(end - start, width - x)
+                converted.fill(colorkey, (x, y, length, 1))
+                start = start + length
+        converted.set_colorkey(colorkey, RLEACCEL)
+        return converted
+    return image.convert_alpha()
+
+def with_alpha(image):
+    """
+    Returns the image with per-pixel alpha if it has a colorkey. Transforms
+    which blend neighbouring pixels (rotozoom and smoothscale) would otherwise
+    blend the colorkey into the edges of the image.
+    """
+    if image.get_colorkey() is not None:
+        return image.convert_alpha()
+    return image
+
+def read_manifest(path):
+    """
+    Reads the manifest in the graphics directory, and returns a dictionary
+    of (format, colorkey) tuples keyed on the name of the graphic. Returns an
+    empty dictionary if there is no manifest.
+    """
+    formats = {}
+    filename = os.path.join(path, MANIFEST)
+    if not os.path.exists(filename):
+        return formats
+    f = open(filename, "r")
+    data = f.readlines()
+    f.close()
+    for line in data:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split("=")
+        if len(parts) <> 2:
+            continue
+        values = parts[1].split()
+        if not values or values[0] not in IMAGE_FORMATS:
+            continue
+        colorkey = None
+        if values[0] == "colorkey":
+            colorkey = tuple([int(value) for value in values[1].split(",")])
+        formats[parts[0]] = (values[0], colorkey)
+    return formats
+
+def write_manifest(path, formats):
+    """
+    Writes the manifest for the formats (as returned by read_manifest()).
+    """
+    fo = open(os.path.join(path, MANIFEST), "w")
+    fo.write("# The surface format for each graphic, written by assets.py\n")
+    for key in sorted(formats):
+        image_format, colorkey = formats[key]
+        if colorkey is None:
+            fo.write("%s=%s\n" % (key, image_format))
+        else:
+            fo.write("%s=%s %d,%d,%d\n" % (key, image_format, colorkey[0], colorkey[1], colorkey[2]))
+    fo.close()
+
+def import_graphics(path):
+    """
+    Chooses the format for each of the graphics in the path, and writes them
+    to the manifest. Returns the formats.
+    """
+    formats = {}
+    for imagefile in glob.glob(os.path.join(path, "*.png")):
+        key, ext = os.path.splitext(os.path.basename(imagefile))
+        formats[key] = choose_format(pygame.image.load(imagefile))
+    write_manifest(path, formats)
+    return formats
+
+if __name__ == "__main__":
+    # The game expects to be run from its own directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    formats = import_graphics("graphics")
+    for key in sorted(formats):
+        print "%-32s %s" % (key, formats[key][0])
+    print "Written to %s" % os.path.join("graphics", MANIFEST)
@@ -0,0 +1,838 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Performance benchmarks for the game components.
+
+Run this from the command-line, passing the names of the benchmarks to run (or
+nothing, to run all of them):
+
+    python benchmark.py effects
+
+Add --headless to run without opening a window or a sound device (this uses
+SDL's 'dummy' video and audio drivers, so the results are only indicative of
+the software blitting cost). The display is always 32 bits deep, as the dummy
+driver would otherwise give an 8-bit palettized one, which is far slower to
+draw on.
+"""
+
+import os
+import random
+import argparse
+from timeit import default_timer as timer
+
+# The frame budget for 60 frames per second, in milliseconds
+FRAME_BUDGET = 1000.0 / 60
+
+# The number of simulated frames for each measurement
+FRAMES = 180
+
+def setup(headless):
+    """
+    Prepares pygame and loads the graphics, ready for the benchmarks.
+    """
+    if headless:
+        # The sound driver too, as some benchmarks create a Game, which loads
+        # the sounds
+        os.environ["SDL_VIDEODRIVER"] = "dummy"
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+    # The game expects to be run from its own directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    import pygame
+    pygame.display.init()
+    pygame.font.init()
+    display = pygame.display.set_mode((800, 800), 0, 32)
+    from game import g_store
+    g_store.load("graphics")
+    return display
+
+def report(title, headings, rows):
+    """
+    Prints a simple table of results.
+    """
+    print
+    print title
+    print "-" * 80
+    print "".join(["%16s" % heading for heading in headings])
+    for row in rows:
+        print "".join(["%16s" % value for value in row])
+
+# ==============================================================================
+# Benchmarks
+# ==============================================================================
+
+def bench_effects(display):
+    """
+    Compares the sprite-based Explosions class with the ParticleEngine, adding
+    a fixed number of explosions every frame and measuring the time taken to
+    update and draw them. An implementation can sustain a given rate if the
+    average frame fits within the 60 FPS budget.
+    """
+    from game import Scheduler, Explosions, ParticleEngine, ParticleEffect, g_store
+    from pygame import Rect
+
+    def run_explosions(rate):
+        scheduler = Scheduler()
+        explosions = Explosions(scheduler)
+        current_time = 0
+        update_time = 0
+        draw_time = 0
+        for frame in range(0, FRAMES):
+            current_time = current_time + 16
+            start = timer()
+            for i in range(0, rate):
+                explosions.add(Rect(random.randint(0, 736), random.randint(0, 736), 64, 64))
+            scheduler.run(current_time)
+            update_time = update_time + timer() - start
+            start = timer()
+            explosions.draw(display)
+            draw_time = draw_time + timer() - start
+        return update_time * 1000.0 / FRAMES, draw_time * 1000.0 / FRAMES
+
+    def run_particles(rate):
+        effects = ParticleEngine()
+        effects.register("explosion", ParticleEffect(g_store["explosion_frames_01"], 10))
+        current_time = 0
+        update_time = 0
+        draw_time = 0
+        for frame in range(0, FRAMES):
+            current_time = current_time + 16
+            start = timer()
+            for i in range(0, rate):
+                effects.emit("explosion", random.randint(0, 736), random.randint(0, 736))
+            effects.update(current_time)
+            update_time = update_time + timer() - start
+            start = timer()
+            effects.draw(display)
+            draw_time = draw_time + timer() - start
+        return update_time * 1000.0 / FRAMES, draw_time * 1000.0 / FRAMES
+
+    rows = []
+    best = {"Explosions": 0, "ParticleEngine": 0}
+    for rate in (1, 2, 4, 8, 16, 32, 64):
+        row = [rate * 60]
+        for name, run in (("Explosions", run_explosions), ("ParticleEngine", run_particles)):
+            random.seed(rate)
+            update_time, draw_time = run(rate)
+            row.extend(["%.2f ms" % update_time, "%.2f ms" % draw_time])
+            if update_time + draw_time <= FRAME_BUDGET:
+                best[name] = rate * 60
+        rows.append(row)
+
+    report("Effects per second at 60 FPS (time per frame)", ["effects/sec", "Burst update", "Burst draw", "Particle update", "Particle draw"], rows)
+    print
+    for name in ("Explosions", "ParticleEngine"):
+        print "%s sustains %d effects per second within the frame budget" % (name, best[name])
+
+def bench_rotation(display):
+    """
+    Measures the time and memory taken to build the RotationCache for all the
+    asteroid images at various numbers of steps, and compares the per-frame
+    cost of drawing spinning asteroids from the cache with rotating them on
+    the fly.
+    """
+    import pygame
+    from game import RotationCache, ASTEROID_IMAGES, g_store
+
+    images = [g_store[name] for name in ASTEROID_IMAGES]
+    rows = []
+    for steps in (16, 32, 64, 128):
+        cache = RotationCache(steps, 64 * 1024 * 1024)
+        cache.prebuild(images)
+        rows.append([steps, len(cache.items), "%.1f ms" % (cache.build_time * 1000.0), "%.1f KB" % (cache.bytes / 1024.0)])
+    report("Rotation cache build (all asteroid types)", ["steps", "frames", "build time", "memory"], rows)
+
+    cache = RotationCache(32)
+    cache.prebuild(images)
+    rows = []
+    for count in (20, 100, 500):
+        roids = [(random.choice(images), random.uniform(0, 360), random.randint(0, 736), random.randint(0, 736)) for i in range(0, count)]
+        start = timer()
+        for frame in range(0, FRAMES):
+            for image, angle, x, y in roids:
+                display.blit(pygame.transform.rotozoom(image, angle + frame, 1), (x, y))
+        direct = (timer() - start) * 1000.0 / FRAMES
+        start = timer()
+        for frame in range(0, FRAMES):
+            for image, angle, x, y in roids:
+                display.blit(cache.get(image, 0, cache.step(angle + frame))[0], (x, y))
+        cached = (timer() - start) * 1000.0 / FRAMES
+        rows.append([count, "%.2f ms" % direct, "%.2f ms" % cached])
+    report("Spinning asteroids, time per frame (32 steps)", ["asteroids", "rotozoom", "cached"], rows)
+
+def bench_renderers(display):
+    """
+    Draws the same scenes with each of the render backends: the intro screen
+    (background, logo and overlay), and the main game with increasing numbers
+    of asteroids and explosions. The surface backend is also measured at
+    lower render scales.
+    """
+    import render
+    from game import ParallaxScroller, Label, ParticleEngine, ParticleEffect, RotationCache, ASTEROID_IMAGES, g_store
+
+    def intro_scene(renderer, scrollers, frame):
+        target = renderer.target
+        for scroller in scrollers:
+            scroller.update()
+            scroller.render(target)
+        target.blit(g_store["logo"], [0, 0])
+        renderer.finish_world()
+        renderer.hud.blit(g_store["screen_01"], [0, 0])
+
+    def game_scene(count):
+        cache = RotationCache(32)
+        effects = ParticleEngine()
+        effects.register("explosion", ParticleEffect(g_store["explosion_frames_01"], 10))
+        labels = [Label("%d" % i, 170, 717 + i * 16) for i in range(0, 4)]
+        images = [g_store[name] for name in ASTEROID_IMAGES]
+        roids = [(random.choice(images), random.randint(0, 32), random.randint(0, 736), random.randint(0, 736)) for i in range(0, count)]
+        for i in range(0, count // 4):
+            effects.emit("explosion", random.randint(0, 736), random.randint(0, 736))
+        effects.update(300)
+
+        def draw(renderer, scrollers, frame):
+            target = renderer.target
+            for scroller in scrollers:
+                scroller.update()
+                scroller.render(target)
+            for image, step, x, y in roids:
+                target.blit(cache.get(image, 0, (step + frame) % 32)[0], (x, y))
+            effects.draw(target)
+            renderer.finish_world()
+            renderer.hud.blit(g_store["screen_01"], [0, 0])
+            for label in labels:
+                label.text = "%d" % frame
+                label.draw(renderer.hud)
+        return draw
+
+    scenes = [("intro", intro_scene)]
+    for count in (20, 100, 400):
+        scenes.append(("game (%d)" % count, game_scene(count)))
+
+    backends = [("surface", render.SurfaceRenderer, {})]
+    for render_scale in (0.75, 0.5):
+        for scale_filter in ("smooth", "nearest"):
+            backends.append(("%g %s" % (render_scale, scale_filter), render.SurfaceRenderer, {"render_scale": render_scale, "scale_filter": scale_filter}))
+    if render.sdl2_video is not None:
+        backends.append(("texture", render.TextureRenderer, {}))
+    else:
+        print
+        print "The texture renderer requires pygame 2, and will not be benchmarked"
+
+    results = {}
+    for name, backend, options in backends:
+        renderer = backend((800, 800), "Jangam benchmark", **options)
+        print
+        print "%s: %s renderer" % (name, renderer.name)
+        scrollers = [ParallaxScroller(g_store["starfield_01a"], 0, 0, 0.1), ParallaxScroller(g_store["starfield_01b"], 0, 0, 0.2), ParallaxScroller(g_store["starfield_01c"], 0, 0, 0.3)]
+        for scene_name, scene in scenes:
+            # Draw one frame first, so that any textures are already uploaded
+            scene(renderer, scrollers, 0)
+            renderer.present()
+            start = timer()
+            for frame in range(0, FRAMES):
+                scene(renderer, scrollers, frame)
+                renderer.present()
+            results[(name, scene_name)] = (timer() - start) * 1000.0 / FRAMES
+
+    rows = []
+    for scene_name, scene in scenes:
+        rows.append([scene_name] + ["%.2f ms" % results[(name, scene_name)] for name, backend, options in backends])
+    report("Time per frame by render backend", ["scene"] + [name for name, backend, options in backends], rows)
+
+def bench_snapshots(display):
+    """
+    Measures the time taken to snapshot the game world and to restore it, with
+    increasing numbers of asteroids (a quarter of them being mined) and
+    explosions, and the bytes per snapshot, both raw and as stored in the
+    SnapshotRing (where most snapshots are delta-encoded against the one
+    before). A snapshot is taken every frame, so the stored size is the best
+    case; the game takes them less often.
+    """
+    from pygame import Rect
+    from game import Game, Settings, Asteroid, Mine, s_store
+    from snapshot import SnapshotRing
+
+    game = Game(Settings(snapshot_file = None))
+    game.startup()
+    # As in the game, the sounds are loaded before play starts, rather than
+    # by the first restore
+    s_store.preload()
+    rows = []
+    current_time = 0
+    for count in (20, 100, 400):
+        random.seed(count)
+        game.reset()
+        for i in range(0, count):
+            roid = Asteroid(random.randint(1, 4), game.asteroids.on_roid_die)
+            roid.rect.topleft = (random.randint(0, 736), random.randint(0, 600))
+            game.asteroids.add(roid)
+            if i % 4 == 0:
+                roid.being_mined = True
+                mine = Mine(game.ship, game.mines.on_mine_remove, game.effects)
+                mine.rect = Rect(roid.rect.left + 20, roid.rect.bottom - 8, 24, 24)
+                mine.asteroid = roid
+                game.mines.add(mine)
+                mine.start_mining()
+        game.ship.mining_units = 0
+        game.ship.total_mining_units = len(game.mines.mines)
+        for i in range(0, count // 4):
+            game.explode(Rect(random.randint(0, 736), random.randint(0, 736), 64, 64), current_time)
+
+        ring = SnapshotRing(16 * 1024 * 1024)
+        take_time = 0
+        push_time = 0
+        for frame in range(0, FRAMES):
+            current_time = current_time + 16
+            game.scheduler.run(current_time)
+            game.effects.update(current_time)
+            start = timer()
+            snapshot = game.take_snapshot(current_time)
+            take_time = take_time + timer() - start
+            start = timer()
+            ring.push(snapshot)
+            push_time = push_time + timer() - start
+
+        get_time = 0
+        restore_time = 0
+        for i in range(0, 20):
+            start = timer()
+            snapshot = ring.get(-1)
+            get_time = get_time + timer() - start
+            start = timer()
+            game.restore_snapshot(snapshot, current_time)
+            restore_time = restore_time + timer() - start
+
+        rows.append([count, "%.0f" % (float(ring.raw_bytes) / ring.pushed), "%.0f" % (float(ring.stored_bytes) / ring.pushed), "%.3f ms" % (take_time * 1000.0 / FRAMES), "%.3f ms" % (push_time * 1000.0 / FRAMES), "%.3f ms" % (get_time * 1000.0 / 20), "%.3f ms" % (restore_time * 1000.0 / 20)])
+    report("Game snapshots (bytes per snapshot, time per snapshot)", ["asteroids", "raw bytes", "stored bytes", "take", "store", "decode", "restore"], rows)
+
+def bench_network(display):
+    """
+    Runs the host's side of the two-player mode over localhost, with a client
+    which sends a command every frame and decodes the states, and measures the
+    bandwidth to and from the client and the round-trip time. The asteroid
+    field is kept topped up to a fixed size. This runs in real time (three
+    seconds for each row), at the two-player frame rate.
+    """
+    import time
+    from pygame import Rect
+    from game import Game, Settings, Asteroid
+    from network import NetHost, NetClient
+
+    game = Game(Settings(snapshot_file = None))
+    game.startup()
+    rows = []
+    current_time = 0
+    for count in (20, 40):
+        for latency, loss in ((0, 0.0), (50, 0.05)):
+            random.seed(count)
+            game.reset()
+            game.mode = game.MODE_GAME
+            host = NetHost(0, latency, loss)
+            client = NetClient(("127.0.0.1", host.link.port), latency, loss)
+            frame_time = 1.0 / game.net_frame_rate
+            next_state = 0
+            for frame in range(0, FRAMES):
+                start = time.time()
+                current_time = current_time + int(frame_time * 1000)
+                while len(game.asteroids.roids) < count:
+                    roid = Asteroid(random.randint(1, 4), game.asteroids.on_roid_die)
+                    roid.rect.top = random.randint(-64, 600)
+                    game.asteroids.add(roid)
+                if frame % 30 == 0:
+                    game.explode(Rect(random.randint(0, 736), random.randint(0, 600), 64, 64), current_time)
+                client.send_command(random.randint(0, 3))
+                host.poll()
+                game.scheduler.run(current_time)
+                game.effects.update(current_time)
+                if current_time >= next_state:
+                    host.send_state(game.encode_world(current_time))
+                    next_state = current_time + 1000 // Settings.net_rate
+                for state in client.poll():
+                    game.decode_world(state)
+                time.sleep(max(frame_time - (time.time() - start), 0))
+            elapsed = host.link.elapsed()
+            rows.append([count, "%d ms, %d%%" % (latency, loss * 100), "%.0f" % (float(host.link.bytes_sent) / max(host.link.packets_sent, 1)), "%.2f KB/s" % (host.link.bytes_sent / 1024.0 / elapsed), "%.2f KB/s" % (host.link.bytes_received / 1024.0 / elapsed), "%.1f ms" % client.rtt.average()])
+            host.close()
+            client.close()
+    report("Two-player network traffic (%d states per second)" % Settings.net_rate, ["asteroids", "latency, loss", "bytes/state", "to client", "from client", "round trip"], rows)
+
+# The script for bench_startup, which is run in a fresh interpreter each time
+STARTUP_SCRIPT = """
+import os, time
+started = time.time()
+from game import Game, Settings
+game = Game(Settings(started = started, eager_init = %s, snapshot_file = None,
+                     headless = os.environ.get("SDL_VIDEODRIVER") == "dummy"))
+game.startup()
+game.timeline.mark("setup")
+game.update()
+game.draw()
+game.timeline.mark("first frame")
+print repr(game.timeline.stages)
+"""
+
+def bench_startup(display):
+    """
+    Measures the time from starting the program to the first frame being on
+    screen, when every pygame module is started and every asset loaded up
+    front ('eager'), and when each is left until it is first used ('lazy').
+    Each run is in a fresh interpreter, so that nothing is already loaded.
+    The interpreter's own start-up is not included.
+    """
+    import subprocess
+    import sys
+
+    runs = 5
+    rows = []
+    for eager in [True, False]:
+        totals = None
+        for run in range(0, runs):
+            output = subprocess.check_output([sys.executable, "-c", STARTUP_SCRIPT % eager])
+            stages = eval(output.strip().splitlines()[-1])
+            if totals is None:
+                totals = [0.0] * len(stages)
+            for i in range(0, len(stages)):
+                totals[i] = totals[i] + stages[i][1]
+        averages = [total / runs for total in totals]
+        rows.append([eager and "eager" or "lazy"] + ["%.1f ms" % average for average in averages] + ["%.1f ms" % sum(averages)])
+    report("Start-up time, average of %d runs" % runs, ["init"] + [name for name, duration in stages] + ["total"], rows)
+
+def bench_collisions(display):
+    """
+    Compares the rect-only collision test (the bounds of the visible pixels)
+    with the pixel-accurate one (the bounds, then the masks of the sprites
+    which pass) for the ship and eight mines against increasing numbers of
+    asteroids. The asteroids are scattered over the bottom of the screen, so
+    that many are close to the ship and mines. Both tests are run on the same
+    frames, and the hits per frame show how many of the rect hits are real.
+    """
+    import pygame
+    from pygame import Rect
+    from game import Asteroid, Ship, Mine, ParticleEngine, SHIP_Y, collide_bounds, collide_pixels
+    from entity import EntityGroup
+
+    ship = Ship(400 - 32, SHIP_Y, Rect(0, SHIP_Y, 800 - 64, 64))
+    mines = []
+    for i in range(0, 8):
+        ship.mining_units = 1
+        mine = Mine(ship, None, ParticleEngine())
+        mines.append(mine)
+    rows = []
+    for count in (20, 100, 400, 1000):
+        random.seed(count)
+        roids = EntityGroup()
+        for i in range(0, count):
+            roid = Asteroid(random.randint(1, 7), None)
+            roid.rect.topleft = (random.randint(0, 736), random.randint(SHIP_Y - 400, SHIP_Y))
+            roid.speed = 0
+            roids.add(roid)
+        times = [0.0, 0.0]
+        hits = [0, 0]
+        current_time = 0
+        for frame in range(0, FRAMES):
+            current_time = current_time + 16
+            for roid in roids:
+                roid.tick(current_time)
+            ship.rect.left = (frame * 4) % 736
+            for i in range(0, len(mines)):
+                mines[i].rect.topleft = (40 + i * 90, SHIP_Y - (frame * 2) % 400)
+            for i, test in enumerate([collide_bounds, collide_pixels]):
+                start = timer()
+                hits[i] = hits[i] + len(roids.collide(ship, test))
+                for mine in mines:
+                    hits[i] = hits[i] + len(roids.collide(mine, test))
+                times[i] = times[i] + timer() - start
+        rows.append([count] + ["%.3f ms" % (elapsed * 1000.0 / FRAMES) for elapsed in times] + ["%.2f" % (float(total) / FRAMES) for total in hits])
+    report("Collision tests per frame (ship and 8 mines)", ["asteroids", "rect", "pixel", "rect hits", "pixel hits"], rows)
+
+# The script for bench_threading, which runs the game for a few seconds in a
+# fresh interpreter (as the game shuts pygame down when it finishes)
+THREADING_SCRIPT = """
+import os, random, threading
+from game import Game, Settings, Asteroids, pygame, KEYDOWN, K_SPACE
+Asteroids.max_asteroids = %d
+random.seed(1)
+game = Game(Settings(snapshot_file = None, threaded = %s, sim_rate = %d,
+                     headless = os.environ.get("SDL_VIDEODRIVER") == "dummy"))
+startup = game.startup
+def start():
+    startup()
+    # Keep the ship going for the whole run
+    game.ship.hull = 30000
+game.startup = start
+pygame.event.post(pygame.event.Event(KEYDOWN, key = K_SPACE, mod = 0))
+threading.Timer(%f, setattr, (game, "running", False)).start()
+game.run()
+for times in (game.frame_times, game.step_times):
+    print repr((times.rate(), times.total * 1000.0 / max(times.count, 1), times.jitter() * 1000.0, times.longest * 1000.0))
+"""
+
+def bench_threading(display):
+    """
+    Compares the single-threaded game loop with the threaded mode, where the
+    simulation runs on its own thread and the main thread draws what it
+    publishes. The threaded mode is run with the simulation at 60 steps a
+    second, and as fast as it will go. The single-threaded loop always runs
+    as fast as it will go. Shows the frames drawn and simulation steps per
+    second, and the average gap between frames, its jitter (standard
+    deviation) and the longest gap.
+    """
+    import subprocess
+    import sys
+
+    seconds = 3.0
+    rows = []
+    for count in (20, 200):
+        for name, threaded, rate in [("single", False, 0), ("threaded 60", True, 60), ("threaded max", True, 0)]:
+            output = subprocess.check_output([sys.executable, "-c", THREADING_SCRIPT % (count, threaded, rate, seconds)])
+            frames, steps = [eval(line) for line in output.strip().splitlines()[-2:]]
+            rows.append([count, name, "%.1f" % frames[0], "%.1f" % steps[0], "%.2f ms" % frames[1], "%.2f ms" % frames[2], "%.2f ms" % frames[3]])
+    report("Game loop, %g seconds of play" % seconds, ["asteroids", "loop", "frames/s", "steps/s", "frame gap", "jitter", "longest gap"], rows)
+
+def bench_formats(display):
+    """
+    Times blitting each graphic onto the display in the surface format chosen
+    for it by the asset import step (see assets.py), against per-pixel alpha
+    (which every graphic used before). The first blit of a colorkey image
+    run-length encodes it, so one blit is made before the timing starts.
+    """
+    import pygame
+    from assets import read_manifest, convert_image
+
+    formats = read_manifest("graphics")
+    rows = []
+    for key in sorted(formats):
+        image_format, colorkey = formats[key]
+        image = pygame.image.load(os.path.join("graphics", key + ".png"))
+        # Blit the smaller images more times, so that each measurement takes
+        # about as long
+        blits = max(20, 4000000 // (image.get_width() * image.get_height()))
+        times = []
+        for surface in (image.convert_alpha(), convert_image(image, image_format, colorkey)):
+            display.blit(surface, (0, 0))
+            start = timer()
+            for i in range(0, blits):
+                display.blit(surface, (0, 0))
+            times.append((timer() - start) * 1000000.0 / blits)
+        rows.append([key, "%dx%d" % image.get_size(), image_format, "%.1f us" % times[0], "%.1f us" % times[1], "%.1fx" % (times[0] / times[1])])
+    report("Time per blit, by surface format", ["graphic", "size", "format", "alpha", "chosen", "speedup"], rows)
+
+def bench_hud(display):
+    """
+    Times drawing the HUD: the overlay and the four status labels blitted
+    separately, with the labels rendered every frame (as they were before
+    the HudLayer) and only when their text changes, against the HudLayer
+    with the status bars as well. The values change every few frames, as they
+    do in play.
+
+    The HudLayer is also drawn onto a 1200x1200 window through a ScaledTarget
+    (as with --window 1200x1200), which caches a scaled copy of each surface,
+    so the layer has to copy on write; a check that the status fields still
+    change on screen is printed after the table.
+    """
+    import pygame
+    from game import g_store, Label, Progressbar, HudLayer, SPEEDBAR_X, SPEEDBAR_Y, STATUS_AREA, STATUS_WIDTH, STATUS_BAR_X, STATUS_BAR_WIDTH
+    from render import ScaledTarget
+
+    overlay = g_store["screen_01"]
+    labels = [Label("", SPEEDBAR_X, SPEEDBAR_Y + 16 * row) for row in range(0, 4)]
+
+    def make_layer(copy_on_write):
+        layer = HudLayer(overlay, STATUS_AREA, copy_on_write)
+        # The layer's fields are positioned within its area
+        x = SPEEDBAR_X - STATUS_AREA.left
+        bar_x = STATUS_BAR_X - STATUS_AREA.left
+        for row in range(0, 4):
+            y = SPEEDBAR_Y - STATUS_AREA.top + 16 * row
+            layer.add(row, Label("", x, y), (x, y, STATUS_WIDTH, 16), "")
+            layer.add(("bar", row), Progressbar(pygame.Rect(bar_x, y + 5, 0, 6)), (bar_x, y + 5, STATUS_BAR_WIDTH, 6), 0)
+        return layer
+
+    layer = make_layer(False)
+    scaled_layer = make_layer(True)
+    window = pygame.Surface((1200, 1200)).convert()
+    scaled = ScaledTarget(window, 1.5)
+
+    def values(frame):
+        # The score changes most often, and the others now and then
+        return ["%d" % (frame // 4 * 10), "%d" % (frame // 60), "%d %%" % (100 - frame // 30), "%d" % (frame // 45)]
+
+    def separate(frame, render):
+        display.blit(overlay, (0, 0))
+        for label, value in zip(labels, values(frame)):
+            label.text = value
+            if render:
+                label._image = None
+            label.draw(display)
+
+    def composited(layer, target, frame):
+        for row, value in enumerate(values(frame)):
+            layer.set(row, value)
+            layer.set(("bar", row), (frame // (15 * (row + 1))) % STATUS_BAR_WIDTH)
+        layer.draw(target)
+
+    rows = []
+    for name, draw in [("rendered", lambda frame: separate(frame, True)),
+                       ("cached", lambda frame: separate(frame, False)),
+                       ("layer", lambda frame: composited(layer, display, frame)),
+                       ("layer, scaled", lambda frame: composited(scaled_layer, scaled, frame))]:
+        draw(0)
+        start = timer()
+        for frame in range(1, FRAMES + 1):
+            draw(frame)
+        elapsed = (timer() - start) * 1000.0 / FRAMES
+        rows.append([name, "%.3f ms" % elapsed, "%.1f%%" % (elapsed * 100.0 / FRAME_BUDGET)])
+    report("HUD drawing time per frame", ["method", "time", "of budget"], rows)
+
+    # The fields drawn at the first and last frames must differ on screen
+    status = scaled.scaled_rect(STATUS_AREA)
+    composited(scaled_layer, scaled, 0)
+    first = pygame.image.tostring(window.subsurface(status), "RGB")
+    composited(scaled_layer, scaled, FRAMES)
+    last = pygame.image.tostring(window.subsurface(status), "RGB")
+    print
+    print "Scaled HUD shows the changed fields: %s" % ("yes" if first != last else "NO")
+
+def bench_screen(display):
+    """
+    Times the screen effects (see screenfx.py) drawn over an 800x800 world:
+    the shield glow, the glows of five mining units, the damage flash and the
+    shake, on their own and all together, against tinting the whole screen
+    (which is what a full-screen post effect would cost at the least).
+    """
+    import pygame
+    from pygame.locals import BLEND_RGB_ADD
+    from game import SCREEN_LEFT, SCREEN_TOP, SCREEN_RIGHT, SCREEN_BOTTOM
+    from screenfx import ScreenEffects, GLOW_LEVELS, FLASH_FADE, SHAKES
+
+    effects = ScreenEffects(pygame.Rect(SCREEN_LEFT, SCREEN_TOP, SCREEN_RIGHT - SCREEN_LEFT, SCREEN_BOTTOM - SCREEN_TOP))
+    effects.prepare(display, 1.0)
+    whole = display.subsurface(display.get_rect())
+    display.fill((20, 20, 40))
+
+    def glows(frame, mining):
+        level = frame % (GLOW_LEVELS - 1) + 1
+        shields = [("shield", level, (400, 700))]
+        return shields + [("mining", level, (100 + 150 * i, 200 + 20 * i)) for i in range(0, mining)]
+
+    def flash(frame):
+        return ("damage", frame % len(FLASH_FADE))
+
+    def shake(frame):
+        return SHAKES["damage"][frame % len(SHAKES["damage"])]
+
+    scenarios = [
+        ("shield glow", lambda frame: (glows(frame, 0), None, None)),
+        ("mining glows", lambda frame: (glows(frame, 5)[1:], None, None)),
+        ("damage flash", lambda frame: ([], flash(frame), None)),
+        ("shake", lambda frame: ([], None, shake(frame))),
+        ("everything", lambda frame: (glows(frame, 5), flash(frame), shake(frame))),
+    ]
+    rows = []
+    for name, frame_effects in scenarios:
+        start = timer()
+        for frame in range(0, FRAMES):
+            effects.apply(display, 1.0, frame_effects(frame))
+        elapsed = (timer() - start) * 1000.0 / FRAMES
+        rows.append([name, "%.3f ms" % elapsed, "%.1f%%" % (elapsed * 100.0 / FRAME_BUDGET)])
+    start = timer()
+    for frame in range(0, FRAMES):
+        whole.fill((frame % 8, 0, 0), None, BLEND_RGB_ADD)
+    elapsed = (timer() - start) * 1000.0 / FRAMES
+    rows.append(["full-screen tint", "%.3f ms" % elapsed, "%.1f%%" % (elapsed * 100.0 / FRAME_BUDGET)])
+    report("Screen effects per frame, %dx%d" % display.get_size(), ["effects", "time", "of budget"], rows)
+
+# The script for bench_entities, which runs in a fresh interpreter so that the
+# memory measurements are not thrown out by memory freed by other benchmarks
+ENTITIES_SCRIPT = """
+import gc, random, sys
+from timeit import default_timer as timer
+import pygame
+pygame.display.init()
+display = pygame.display.set_mode((800, 800), 0, 32)
+from game import g_store, r_cache, Asteroid, Asteroids, Mine, MineController, Ship, Scheduler, ParticleEngine, ASTEROID_IMAGES, SHIP_Y
+from memprofile import resident_bytes
+g_store.load("graphics")
+r_cache.prebuild([g_store[name] for name in ASTEROID_IMAGES])
+random.seed(1)
+count = %d
+frames = %d
+scheduler = Scheduler()
+asteroids = Asteroids(scheduler)
+ship = Ship(400, SHIP_Y, pygame.Rect(0, SHIP_Y, 736, 64))
+mines = MineController(ship, scheduler, ParticleEngine())
+
+def measure(create):
+    gc.collect()
+    before = resident_bytes()
+    start = timer()
+    for i in range(0, count):
+        create()
+    elapsed = timer() - start
+    gc.collect()
+    return ((resident_bytes() - before) / float(count), elapsed)
+
+def create_mine():
+    ship.mining_units = 1
+    mines.add(Mine(ship, mines.on_mine_remove, mines.effects))
+
+roid_bytes, add_time = measure(lambda: asteroids.add(Asteroid(random.randint(1, 7), asteroids.on_roid_die)))
+mine_bytes, mine_time = measure(create_mine)
+roid = list(asteroids.roids)[0]
+shallow = sys.getsizeof(roid) + sys.getsizeof(roid.animation)
+for obj in (roid, roid.animation):
+    if hasattr(obj, "__dict__"):
+        shallow = shallow + sys.getsizeof(obj.__dict__)
+
+# Keep the asteroids on screen for the whole run
+for roid in asteroids.roids:
+    roid.rect.top = random.randint(0, 400)
+current_time = 0
+start = timer()
+for frame in range(0, frames):
+    current_time = current_time + 16
+    scheduler.run(current_time)
+update_time = (timer() - start) / frames
+start = timer()
+for frame in range(0, frames):
+    asteroids.draw(display)
+draw_time = (timer() - start) / frames
+start = timer()
+for roid in list(asteroids.roids):
+    roid.remove()
+remove_time = timer() - start
+print repr((roid_bytes, mine_bytes, shallow, add_time, update_time, draw_time, remove_time))
+"""
+
+def bench_entities(display):
+    """
+    Measures the memory used by each asteroid and mine (the growth in the
+    resident set size per entity, including its animation and scheduler
+    entries, and the size of the asteroid and animation objects themselves),
+    and the time to add, update (through the scheduler), draw and remove
+    large numbers of asteroids. Runs in a fresh interpreter for each count.
+    """
+    import subprocess
+    import sys
+
+    frames = 30
+    rows = []
+    for count in (1000, 10000):
+        output = subprocess.check_output([sys.executable, "-c", ENTITIES_SCRIPT % (count, frames)])
+        roid_bytes, mine_bytes, shallow, add_time, update_time, draw_time, remove_time = eval(output.strip().splitlines()[-1])
+        rows.append([count, "%.0f" % roid_bytes, "%.0f" % mine_bytes, shallow, "%.2f ms" % (add_time * 1000.0), "%.2f ms" % (update_time * 1000.0), "%.0f" % (count / update_time), "%.2f ms" % (draw_time * 1000.0), "%.2f ms" % (remove_time * 1000.0)])
+    report("Entities: bytes each, and time to add, update (per frame), draw (per frame) and remove them all", ["entities", "roid bytes", "mine bytes", "roid object", "add", "update", "updates/s", "draw", "remove"], rows)
+
+# The script for bench_latency, which plays the game for a few seconds in a
+# fresh interpreter, with a thread pressing and releasing keys at irregular
+# intervals (as a player would, out of step with the frames)
+LATENCY_SCRIPT = """
+import os, random, threading, time
+from game import Game, Settings, pygame, KEYDOWN, KEYUP, K_SPACE, K_LEFT, K_RIGHT
+random.seed(1)
+game = Game(Settings(snapshot_file = None, threaded = %s, sim_rate = %d, target_fps = 0,
+                     headless = os.environ.get("SDL_VIDEODRIVER") == "dummy"))
+seconds = %f
+def press():
+    keys = random.Random(2)
+    end = time.time() + seconds
+    while time.time() < end:
+        key = keys.choice([K_LEFT, K_RIGHT])
+        pygame.event.post(pygame.event.Event(KEYDOWN, key = key, mod = 0))
+        time.sleep(keys.uniform(0.02, 0.08))
+        pygame.event.post(pygame.event.Event(KEYUP, key = key, mod = 0))
+        time.sleep(keys.uniform(0.02, 0.08))
+    game.running = False
+startup = game.startup
+def start():
+    startup()
+    # Keep the ship going for the whole run
+    game.ship.hull = 30000
+    threading.Thread(target = press).start()
+game.startup = start
+pygame.event.post(pygame.event.Event(KEYDOWN, key = K_SPACE, mod = 0))
+game.run()
+latency = game.input.latency
+print repr((game.frame_times.rate(), game.input.events_seen, latency.quantile(0.5), latency.quantile(0.9), latency.quantile(0.99), game.input.longest * 1000.0))
+"""
+
+def bench_latency(display):
+    """
+    Measures the input latency (from a key event being taken from SDL to the
+    first frame showing its effect being put on screen, see inputs.py) in
+    each frame pacing configuration: the single-threaded loop, and the
+    threaded mode with the simulation at 60 and 30 steps a second, and as
+    fast as it will go. The keys are pressed by another thread while the game
+    runs, at random times.
+    """
+    import subprocess
+    import sys
+
+    seconds = 4.0
+    rows = []
+    for name, threaded, rate in [("single", False, 0), ("threaded 60", True, 60), ("threaded 30", True, 30), ("threaded max", True, 0)]:
+        output = subprocess.check_output([sys.executable, "-c", LATENCY_SCRIPT % (threaded, rate, seconds)])
+        fps, events, p50, p90, p99, longest = eval(output.strip().splitlines()[-1])
+        rows.append([name, "%.1f" % fps, events, "%.2f ms" % p50, "%.2f ms" % p90, "%.2f ms" % p99, "%.2f ms" % longest])
+    report("Input latency, %g seconds of play" % seconds, ["loop", "frames/s", "key events", "p50", "p90", "p99", "longest"], rows)
+
+def bench_events(display):
+    """
+    Times recording gameplay events in the event log (see eventlog.py), with
+    the log closed (as it is without --event-log), and open, where the time
+    includes handing each full block to the writer. The time for close() to
+    write the rest is shown separately, with the size of the file.
+    """
+    import tempfile
+    from eventlog import EventLog, EVENT_SPAWN, BLOCK_SIZE
+
+    events = 200000
+    rows = []
+    for name, opened in [("closed", False), ("open", True)]:
+        event_log = EventLog()
+        f, filename = tempfile.mkstemp(".bin")
+        os.close(f)
+        if opened:
+            event_log.open(filename)
+        log = event_log.log
+        start = timer()
+        for i in range(0, events):
+            event_log.time = i
+            log(EVENT_SPAWN, i & 511, -128, 1)
+        elapsed = timer() - start
+        start = timer()
+        event_log.close()
+        closing = timer() - start
+        size = os.path.getsize(filename)
+        os.remove(filename)
+        rows.append([name, "%.2f us" % (elapsed * 1000000.0 / events), "%.1f ms" % (closing * 1000.0), "%.1f KB" % (size / 1024.0), "%.1f B" % (float(size) / events)])
+    report("Event log, %d events (blocks of %d bytes)" % (events, BLOCK_SIZE), ["log", "per event", "close", "file", "per event"], rows)
+
+BENCHMARKS = [
+    ("effects", bench_effects),
+    ("rotation", bench_rotation),
+    ("renderers", bench_renderers),
+    ("snapshots", bench_snapshots),
+    ("network", bench_network),
+    ("startup", bench_startup),
+    ("collisions", bench_collisions),
+    ("threading", bench_threading),
+    ("formats", bench_formats),
+    ("entities", bench_entities),
+    ("hud", bench_hud),
+    ("screen", bench_screen),
+    ("latency", bench_latency),
+    ("events", bench_events),
+]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Jangam benchmarks")
+    parser.add_argument("names", nargs = "*", help = "benchmarks to run (default: all)")
+    parser.add_argument("--headless", action = "store_true", help = "run without opening a window")
+    args = parser.parse_args()
+
+    display = setup(args.headless)
+    for name, benchmark in BENCHMARKS:
+        if not args.names or name in args.names:
+            benchmark(display)
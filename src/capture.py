@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Frame capture, for recording gameplay.
+
+The FrameCapture class copies each finished frame into one of a fixed number
+of pre-allocated buffers (the 'ring'), and a worker thread encodes the frames
+from the ring to disk. The copy is made straight from the surface's pixel
+buffer, without any intermediate objects, so capturing costs the game loop a
+single memory copy per frame.
+
+If the worker falls behind and the ring is full, the frame is dropped (and
+counted) rather than making the game wait.
+
+The frames can be written as:
+
+    png - a numbered sequence of PNG images in the output directory
+    raw - a single stream of raw pixels (see the .txt file written alongside
+          it for the format and an ffmpeg command to convert it)
+    y4m - a single YUV4MPEG2 stream, which most video tools can read directly
+          (this requires numpy)
+"""
+
+import os
+import struct
+import threading
+import zlib
+import Queue
+from collections import deque
+
+# numpy is only needed for y4m, and takes a while to import, so it is imported
+# when a y4m capture is started (see FrameCapture.__init__)
+numpy = None
+
+# The supported output formats
+CAPTURE_FORMATS = ["png", "raw", "y4m"]
+
+class FrameCapture(object):
+    """
+    Captures frames into a ring of buffers, and writes them to disk from a
+    worker thread.
+    """
+
+    def __init__(self, path, output_format = "png", ring_size = 16, fps = 60):
+        """
+        Params:
+            path          : output directory (png) or file (raw, y4m)
+            output_format : one of CAPTURE_FORMATS
+            ring_size     : number of frames which can be waiting to be written
+            fps           : frame rate recorded in the y4m header
+        """
+        if output_format == "y4m":
+            global numpy
+            try:
+                import numpy
+            except ImportError:
+                raise RuntimeError("Capturing to y4m requires numpy")
+        self.path = path
+        self.output_format = output_format
+        self.ring_size = ring_size
+        self.fps = fps
+
+        self.captured = 0
+        self.dropped = 0
+        self.written = 0
+
+        # The buffers are allocated when the first frame arrives, once the
+        # size and format of the frames is known.
+        self.free = deque()
+        self.ready = Queue.Queue()
+        self.size = None
+        self.output = None
+
+        self.worker = threading.Thread(target = self.run, name = "capture")
+        self.worker.daemon = True
+        self.worker.start()
+
+    def prepare(self, surface):
+        """
+        Allocates the ring of buffers for frames the size of the surface, and
+        records the layout of the pixels.
+        """
+        self.size = surface.get_size()
+        self.pitch = surface.get_pitch()
+        self.bytesize = surface.get_bytesize()
+        # The position of each of the red, green and blue bytes within a
+        # pixel (this assumes a little-endian machine).
+        self.offsets = [shift // 8 for shift in surface.get_shifts()[0:3]]
+        self.length = self.pitch * self.size[1]
+        for i in range(0, self.ring_size):
+            self.free.append(bytearray(self.length))
+
+    def capture(self, surface):
+        """
+        Copies the surface into the next free buffer, and queues it for
+        writing. The surface should be 24 or 32 bits per pixel. Call this
+        once the frame is complete.
+        """
+        if self.size is None:
+            self.prepare(surface)
+        try:
+            frame = self.free.popleft()
+        except IndexError:
+            # The worker has not caught up, so drop this frame
+            self.dropped = self.dropped + 1
+            return
+        buffer_proxy = surface.get_buffer()
+        try:
+            # Copy directly from the pixels into the buffer, through a
+            # read-only view of them
+            frame[:] = buffer(buffer_proxy)
+        except TypeError:
+            # Older versions of pygame do not support the buffer interface, so
+            # this has to go via a copy of the pixels
+            frame[:] = buffer_proxy.raw
+        # The buffer keeps the surface locked, so release it straight away
+        del buffer_proxy
+        self.captured = self.captured + 1
+        self.ready.put(frame)
+
+    def close(self):
+        """
+        Waits for the queued frames to be written, and closes the output.
+        """
+        self.ready.put(None)
+        self.worker.join()
+        if self.output:
+            self.output.close()
+            self.output = None
+
+    def report(self):
+        """
+        Returns a summary of the capture.
+        """
+        return "Capture: %d frames captured, %d written, %d dropped" % (self.captured, self.written, self.dropped)
+
+    # --------------------------------------------------------------------------
+    # Worker thread
+    # --------------------------------------------------------------------------
+
+    def run(self):
+        while True:
+            frame = self.ready.get()
+            if frame is None:
+                break
+            try:
+                if self.output_format == "png":
+                    self.write_png(frame)
+                elif self.output_format == "raw":
+                    self.write_raw(frame)
+                else:
+                    self.write_y4m(frame)
+                self.written = self.written + 1
+            finally:
+                # Hand the buffer back to the game
+                self.free.append(frame)
+
+    def rows(self, frame):
+        """
+        Returns the pixel data of the frame without any padding at the end of
+        each row.
+        """
+        width, height = self.size
+        row_length = width * self.bytesize
+        if row_length == self.pitch:
+            return frame
+        return bytearray().join([frame[y * self.pitch:(y * self.pitch) + row_length] for y in range(0, height)])
+
+    def rgb(self, frame):
+        """
+        Returns the pixel data of the frame as packed RGB bytes.
+        """
+        pixels = self.rows(frame)
+        width, height = self.size
+        rgb = bytearray(width * height * 3)
+        for channel in range(0, 3):
+            rgb[channel::3] = pixels[self.offsets[channel]::self.bytesize]
+        return rgb
+
+    def write_png(self, frame):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        width, height = self.size
+        rgb = self.rgb(frame)
+        # Each row of a PNG image starts with a filter type (0 for none)
+        row_length = width * 3
+        data = bytearray().join([b"\x00" + rgb[y * row_length:(y + 1) * row_length] for y in range(0, height)])
+
+        def chunk(kind, body):
+            return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body) & 0xffffffff)
+
+        filename = os.path.join(self.path, "frame_%06d.png" % self.written)
+        with open(filename, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+            f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+            f.write(chunk(b"IDAT", zlib.compress(bytes(data), 1)))
+            f.write(chunk(b"IEND", b""))
+
+    def write_raw(self, frame):
+        if self.output is None:
+            width, height = self.size
+            self.output = open(self.path, "wb")
+            # Describe the format, so that the stream can be converted
+            order = ["?"] * self.bytesize
+            for channel, name in enumerate("rgb"):
+                order[self.offsets[channel]] = name
+            pix_fmt = "".join(order).replace("?", "0")
+            with open(self.path + ".txt", "w") as f:
+                f.write("%dx%d %s %d fps\n" % (width, height, pix_fmt, self.fps))
+                f.write("ffmpeg -f rawvideo -pix_fmt %s -s %dx%d -r %d -i %s out.mp4\n" % (pix_fmt, width, height, self.fps, self.path))
+        self.output.write(self.rows(frame))
+
+    def write_y4m(self, frame):
+        width, height = self.size
+        if self.output is None:
+            self.output = open(self.path, "wb")
+            self.output.write("YUV4MPEG2 W%d H%d F%d:1 Ip A1:1 C444\n" % (width, height, self.fps))
+        pixels = numpy.frombuffer(self.rows(frame), numpy.uint8).reshape((height, width, self.bytesize)).astype(numpy.float32)
+        r = pixels[:, :, self.offsets[0]]
+        g = pixels[:, :, self.offsets[1]]
+        b = pixels[:, :, self.offsets[2]]
+        # BT.601 conversion to studio-range YCbCr
+        y = 16 + (0.257 * r) + (0.504 * g) + (0.098 * b)
+        u = 128 - (0.148 * r) - (0.291 * g) + (0.439 * b)
+        v = 128 + (0.439 * r) - (0.368 * g) - (0.071 * b)
+        self.output.write("FRAME\n")
+        for plane in (y, u, v):
+            self.output.write(numpy.clip(plane, 0, 255).astype(numpy.uint8).tobytes())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compact entities, and the groups which hold them.
+
+The game's sprites (see FrameSprite in game.py) are built on Entity rather
+than pygame.sprite.Sprite. A pygame Sprite carries an instance dictionary and
+a dictionary of the groups it belongs to, and each Group keeps a dictionary of
+its sprites, which adds up to well over a kilobyte per sprite. An Entity keeps
+its attributes in __slots__ (so the subclasses must declare theirs too), and
+belongs to at most one EntityGroup, which it records along with its position
+in the group.
+
+An EntityGroup keeps its entities in a list, in the order they were added.
+Removing an entity leaves a hole (None) in its place, so removing is O(1) and
+an entity can be removed while the group is being iterated over. The holes are
+squeezed out once they make up half the list, but never while the group is
+being iterated over. Entities added during iteration are included in it.
+
+An EntityGroup can be passed to pygame.sprite.spritecollide(), but collide()
+does the same job without building a copy of the group first.
+"""
+
+class Entity(object):
+    """
+    Base class for the objects in an EntityGroup. Subclasses must declare
+    their own __slots__ (or they will have an instance dictionary after all).
+    """
+
+    __slots__ = ("rect", "image", "visible", "group", "group_index")
+
+    def __init__(self):
+        self.rect = None
+        self.image = None
+        self.visible = True
+        self.group = None
+        self.group_index = -1
+
+    def kill(self):
+        """
+        Removes the entity from its group.
+        """
+        if self.group is not None:
+            self.group.remove(self)
+
+    def alive(self):
+        """
+        Returns True if the entity is in a group.
+        """
+        return self.group is not None
+
+    def get_blit(self):
+        """
+        Returns the image and position to draw the entity at, as a tuple for
+        Surface.blits().
+        """
+        return (self.image, self.rect)
+
+class EntityGroup(object):
+    """
+    An ordered collection of entities, with O(1) add and remove.
+    """
+
+    # The list is only compacted once it has at least this many holes
+    min_holes = 32
+
+    def __init__(self):
+        self.items = []
+        self.count = 0
+        self.holes = 0
+        self.iterating = 0
+
+    def __len__(self):
+        return self.count
+
+    def __nonzero__(self):
+        return self.count > 0
+
+    def __contains__(self, entity):
+        return entity.group is self
+
+    def __iter__(self):
+        if self.iterating == 0 and self.holes >= self.min_holes and self.holes * 2 >= len(self.items):
+            self.compact()
+        self.iterating = self.iterating + 1
+        try:
+            for entity in self.items:
+                if entity is not None:
+                    yield entity
+        finally:
+            self.iterating = self.iterating - 1
+
+    def sprites(self):
+        """
+        Returns a list of the entities (as pygame's Group does).
+        """
+        return [entity for entity in self.items if entity is not None]
+
+    def add(self, entity):
+        """
+        Adds an entity to the end of the group, removing it from any other
+        group which it is in.
+        """
+        if entity.group is self:
+            return
+        if entity.group is not None:
+            entity.group.remove(entity)
+        entity.group = self
+        entity.group_index = len(self.items)
+        self.items.append(entity)
+        self.count = self.count + 1
+
+    def remove(self, entity):
+        """
+        Removes an entity from the group (if it is in it).
+        """
+        if entity.group is not self:
+            return
+        self.items[entity.group_index] = None
+        entity.group = None
+        entity.group_index = -1
+        self.count = self.count - 1
+        self.holes = self.holes + 1
+        if self.iterating == 0 and self.holes >= self.min_holes and self.holes * 2 >= len(self.items):
+            self.compact()
+
+    def empty(self):
+        """
+        Removes all the entities.
+        """
+        for entity in self.items:
+            if entity is not None:
+                entity.group = None
+                entity.group_index = -1
+        self.items = []
+        self.count = 0
+        self.holes = 0
+
+    def compact(self):
+        """
+        Squeezes the holes out of the list, keeping the entities in order.
+        """
+        items = [entity for entity in self.items if entity is not None]
+        for i, entity in enumerate(items):
+            entity.group_index = i
+        self.items = items
+        self.holes = 0
+
+    def update(self, *args):
+        """
+        Calls update() on each entity, with the arguments given.
+        """
+        for entity in self:
+            entity.update(*args)
+
+    def draw(self, target):
+        """
+        Draws the visible entities on the target, in the order they were added,
+        with a single call to blits() where the target supports it.
+        """
+        batch = [entity.get_blit() for entity in self.items if entity is not None and entity.visible]
+        if hasattr(target, "blits"):
+            target.blits(batch, False)
+        else:
+            # Older versions of pygame have no batched blit
+            for image, position in batch:
+                target.blit(image, position)
+
+    def collide(self, entity, test, kill = False):
+        """
+        Returns a list of the entities in the group for which test(entity,
+        other) is True (like pygame.sprite.spritecollide()). If 'kill' is True
+        they are also killed.
+        """
+        hits = [other for other in self.items if other is not None and test(entity, other)]
+        if kill:
+            for other in hits:
+                other.kill()
+        return hits
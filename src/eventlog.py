@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+The gameplay event log, for offline analysis of how games are played.
+
+Every spawn, collision, mine launch, start and end of mining, powerup, change
+of shield or hull, and game over is recorded as a fixed-width event: the time
+(pygame's ticks, in milliseconds), the number of the game, the kind of event,
+a position and a value (see the EVENT_ constants for what each kind records).
+
+The EventLog collects the events in memory, a column at a time, in arrays of
+BLOCK_EVENTS events. Recording an event only appends to the arrays, so it
+takes a microsecond or so and the log can be left on. When a block is full
+it is handed to a worker thread, which writes it to the end of the file in a
+single write, and the game carries on with a fresh block. The last block is
+written (part full) when the log is closed.
+
+Each block in the file has the same size: a header (BLOCK_HEADER) giving the
+number of events in the block, then each column in turn (BLOCK_COLUMNS), each
+BLOCK_EVENTS long whether or not the block is full. The whole file can
+therefore be memory-mapped as an array of blocks, and each column read from
+it without parsing anything (see read_events(), which needs numpy). Blocks
+from several runs can simply follow one another in the same file: each run
+numbers its games on from the last game already in the file (see
+last_game()), so every game in a file has its own number. To see a summary
+of a log:
+
+    python eventlog.py events.bin
+"""
+
+import argparse
+import array
+import os
+import struct
+import sys
+import threading
+import Queue
+from collections import deque
+
+# The kinds of event, and what each records as its position and value
+EVENT_GAME_START = 1     # -, -                       ; 0
+EVENT_SPAWN = 2          # the asteroid's position    ; its value (1 to 7)
+EVENT_COLLISION = 3      # the asteroid's position    ; its value
+EVENT_LAUNCH = 4         # the mine's position        ; mining units left
+EVENT_MINING_START = 5   # the mine's position        ; the asteroid's value
+EVENT_MINING_FINISH = 6  # the mine's position        ; the asteroid's value
+EVENT_MINE_LOST = 7      # the mine's position        ; 0
+EVENT_POWERUP = 8        # -, -                       ; the powerup (5 to 7)
+EVENT_SHIELD = 9         # -, -                       ; the new shield strength
+EVENT_HULL = 10          # -, -                       ; the new hull integrity
+EVENT_GAME_OVER = 11     # -, -                       ; the score
+
+EVENT_NAMES = {
+    EVENT_GAME_START: "game start",
+    EVENT_SPAWN: "spawn",
+    EVENT_COLLISION: "collision",
+    EVENT_LAUNCH: "launch",
+    EVENT_MINING_START: "mining start",
+    EVENT_MINING_FINISH: "mining finish",
+    EVENT_MINE_LOST: "mine lost",
+    EVENT_POWERUP: "powerup",
+    EVENT_SHIELD: "shield",
+    EVENT_HULL: "hull",
+    EVENT_GAME_OVER: "game over",
+}
+
+# The number of events in each block
+BLOCK_EVENTS = 1024
+
+# The header of each block: a magic string, the version of the layout and the
+# number of events in the block
+BLOCK_HEADER = struct.Struct("<4sHH")
+BLOCK_MAGIC = b"JEVT"
+BLOCK_VERSION = 1
+
+# The columns of each block, in the order they are written: the name, the
+# array typecode and the numpy type (both little-endian)
+BLOCK_COLUMNS = [
+    ("time", "I", "<u4"),
+    ("value", "i", "<i4"),
+    ("game", "I", "<u4"),
+    ("x", "h", "<i2"),
+    ("y", "h", "<i2"),
+    ("kind", "B", "u1"),
+]
+
+# The size of each block, in bytes
+BLOCK_SIZE = BLOCK_HEADER.size + sum([array.array(code).itemsize * BLOCK_EVENTS for name, code, numpy_type in BLOCK_COLUMNS])
+
+class EventLog(object):
+    """
+    Records gameplay events into blocks in memory, and writes the full blocks
+    to a file from a worker thread.
+    """
+
+    def __init__(self):
+        # Nothing is recorded until the log is opened
+        self.output = None
+        self.columns = None
+        self.appends = None
+        # The time recorded with each event, which the game keeps up to date
+        self.time = 0
+        self.game = 0
+        self.games = 0
+        self.recorded = 0
+        self.blocks_written = 0
+        self.free = deque()
+        self.ready = Queue.Queue()
+        self.worker = None
+
+    def open(self, filename):
+        """
+        Starts recording, adding the blocks to the end of the file, and
+        numbering the games on from the last one in it.
+        """
+        self.game = last_game(filename)
+        self.output = open(filename, "ab")
+        self.next_block()
+        self.worker = threading.Thread(target = self.run, name = "event log")
+        self.worker.daemon = True
+        self.worker.start()
+
+    def next_block(self):
+        """
+        Starts a new block, recycling the columns of one which has been
+        written if there is one.
+        """
+        try:
+            self.columns = self.free.popleft()
+        except IndexError:
+            self.columns = [array.array(code) for name, code, numpy_type in BLOCK_COLUMNS]
+        self.appends = tuple([column.append for column in self.columns])
+
+    def new_game(self):
+        """
+        Starts the events of a new game.
+        """
+        if self.appends is None:
+            return
+        self.game = self.game + 1
+        self.games = self.games + 1
+        self.log(EVENT_GAME_START)
+
+    def log(self, kind, x = 0, y = 0, value = 0):
+        """
+        Records an event (one of the EVENT_ constants) at the current time.
+        """
+        if self.appends is None:
+            return
+        time, values, game, xs, ys, kinds = self.appends
+        time(self.time)
+        values(value)
+        game(self.game)
+        xs(x)
+        ys(y)
+        kinds(kind)
+        self.recorded = self.recorded + 1
+        if self.recorded % BLOCK_EVENTS == 0:
+            self.ready.put(self.columns)
+            self.next_block()
+
+    def close(self):
+        """
+        Writes the events recorded so far, waits for the worker to finish, and
+        closes the file.
+        """
+        if self.output is None:
+            return
+        if len(self.columns[0]):
+            self.ready.put(self.columns)
+        self.columns = None
+        self.appends = None
+        self.ready.put(None)
+        self.worker.join()
+        self.output.close()
+        self.output = None
+
+    def report(self):
+        """
+        Returns a summary of the events recorded.
+        """
+        return "Event log: %d events recorded in %d games, %d blocks written (%.1f KB)" % (self.recorded, self.games, self.blocks_written, self.blocks_written * BLOCK_SIZE / 1024.0)
+
+    # --------------------------------------------------------------------------
+    # Worker thread
+    # --------------------------------------------------------------------------
+
+    def run(self):
+        while True:
+            columns = self.ready.get()
+            if columns is None:
+                break
+            count = len(columns[0])
+            parts = [BLOCK_HEADER.pack(BLOCK_MAGIC, BLOCK_VERSION, count)]
+            for column in columns:
+                # The columns are padded to the full size of a block, so that
+                # every block has the same layout
+                if count < BLOCK_EVENTS:
+                    column.extend(array.array(column.typecode, [0]) * (BLOCK_EVENTS - count))
+                if sys.byteorder != "little":
+                    column.byteswap()
+                parts.append(column.tostring())
+            self.output.write(b"".join(parts))
+            self.blocks_written = self.blocks_written + 1
+            # Hand the columns back to the game
+            for column in columns:
+                del column[:]
+            self.free.append(columns)
+
+def last_game(filename):
+    """
+    Returns the number of the last game in an event log, or 0 if the file
+    does not exist or is empty. Only the last block is read.
+    """
+    if not os.path.exists(filename):
+        return 0
+    size = os.path.getsize(filename)
+    if size == 0:
+        return 0
+    if size % BLOCK_SIZE:
+        raise ValueError("%s is not an event log, or is incomplete" % filename)
+    f = open(filename, "rb")
+    try:
+        f.seek(size - BLOCK_SIZE)
+        block = f.read(BLOCK_SIZE)
+    finally:
+        f.close()
+    magic, version, count = BLOCK_HEADER.unpack_from(block, 0)
+    if magic != BLOCK_MAGIC or version != BLOCK_VERSION:
+        raise ValueError("%s is not an event log" % filename)
+    offset = BLOCK_HEADER.size
+    for name, code, numpy_type in BLOCK_COLUMNS:
+        column = array.array(code)
+        if name == "game":
+            column.fromstring(block[offset:offset + column.itemsize * count])
+            if sys.byteorder != "little":
+                column.byteswap()
+            return max(column)
+        offset = offset + column.itemsize * BLOCK_EVENTS
+
+def block_dtype(numpy):
+    """
+    Returns the numpy dtype of a block.
+    """
+    fields = [("magic", "S4"), ("version", "<u2"), ("count", "<u2")]
+    fields.extend([(name, numpy_type, (BLOCK_EVENTS,)) for name, code, numpy_type in BLOCK_COLUMNS])
+    return numpy.dtype(fields)
+
+def read_events(filename):
+    """
+    Memory-maps an event log, and returns a dictionary of numpy arrays, one
+    for each of the BLOCK_COLUMNS. The arrays are copies of the events only
+    (leaving out the padding at the end of a part-full block), unless every
+    block is full, in which case they are views of the file. Requires numpy.
+    """
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("Reading the event log requires numpy")
+    dtype = block_dtype(numpy)
+    size = os.path.getsize(filename)
+    if size % dtype.itemsize:
+        raise ValueError("%s is not an event log, or is incomplete" % filename)
+    if size == 0:
+        # An empty file cannot be mapped
+        return dict([(name, numpy.zeros(0, numpy_type)) for name, code, numpy_type in BLOCK_COLUMNS])
+    blocks = numpy.memmap(filename, dtype = dtype, mode = "r")
+    if (blocks["magic"] != BLOCK_MAGIC).any() or (blocks["version"] != BLOCK_VERSION).any():
+        raise ValueError("%s is not an event log" % filename)
+    counts = blocks["count"]
+    events = {}
+    for name, code, numpy_type in BLOCK_COLUMNS:
+        column = blocks[name]
+        if (counts == BLOCK_EVENTS).all():
+            events[name] = column.reshape(-1)
+        else:
+            events[name] = numpy.concatenate([column[i, :counts[i]] for i in range(0, len(blocks))])
+    return events
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Summarises a gameplay event log (requires numpy).")
+    parser.add_argument("file", help = "the event log (events.bin)")
+    args = parser.parse_args()
+    try:
+        events = read_events(args.file)
+    except (RuntimeError, ValueError, OSError), e:
+        parser.error(str(e))
+    import numpy
+    games = numpy.unique(events["game"][events["kind"] == EVENT_GAME_START])
+    print "%d events, %d games" % (len(events["kind"]), len(games))
+    for kind in sorted(EVENT_NAMES):
+        selected = events["kind"] == kind
+        if selected.any():
+            print "%-14s %8d events, value %g on average" % (EVENT_NAMES[kind], selected.sum(), events["value"][selected].mean())
+    over = events["kind"] == EVENT_GAME_OVER
+    if over.any():
+        print "Scores: median %g, best %d" % (numpy.median(events["value"][over]), events["value"][over].max())
@@ -7,12 +7,31 @@ import os
 import os.path
 import re
 import glob
+import heapq
 import logging
 import random
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
 
 import pygame
 from pygame.locals import *
 
+from render import create_renderer, RecordingTarget
+from capture import FrameCapture
+from snapshot import SnapshotRing
+from network import NetHost, NetClient, COMMAND_LEFT, COMMAND_RIGHT, COMMAND_LAUNCH
+from memprofile import MemoryProfiler, SceneMemory
+from assets import read_manifest, convert_image, with_alpha
+from entity import Entity, EntityGroup
+from governor import QualityGovernor, QUALITY_LEVELS
+from analytics import ScoreAnalytics
+from inputs import InputLayer
+from screenfx import ScreenEffects
+from eventlog import EventLog, EVENT_SPAWN, EVENT_COLLISION, EVENT_LAUNCH, EVENT_MINING_START, EVENT_MINING_FINISH, EVENT_MINE_LOST, EVENT_POWERUP, EVENT_SHIELD, EVENT_HULL, EVENT_GAME_OVER
+
 # Some pseudo-constants
 SCREEN_TOP = 16
 SCREEN_BOTTOM = 695
@@ -23,53 +42,313 @@ SHIP_Y = SCREEN_BOTTOM - 64
 SPEEDBAR_X = 170
 SPEEDBAR_Y = SCREEN_BOTTOM + 16 + 6
 
+# The status fields in the panel below the screen: the box which holds them in
+# the overlay, the width of the score and of the other values, and the
+# position, width and colour of the bars beside them
+STATUS_AREA = pygame.Rect(14, SPEEDBAR_Y - 10, 318, 78)
+STATUS_WIDTH = 154
+STATUS_VALUE_WIDTH = 52
+STATUS_BAR_X = SPEEDBAR_X + 54
+STATUS_BAR_WIDTH = 100
+STATUS_BAR_COLOURS = {"mining": pygame.color.Color('#cfa100'), "hull": pygame.color.Color('#ff0000'), "shield": pygame.color.Color('#3080ff')}
+
+# The graphics for each asteroid value (1 to 7)
+ASTEROID_IMAGES = ["asteroid_01", "asteroid_iron_01", "asteroid_gold_01", "asteroid_emerald_01", "asteroid_powerup_mine_01", "asteroid_powerup_shield_01", "asteroid_powerup_hull_01"]
+
 #from time import clock
 
-class GraphicStore(object):
+def clamp_short(value):
+    """
+    Limits the value to the range of a signed 16-bit integer, for packing into
+    a snapshot.
+    """
+    return max(-32768, min(32767, int(value)))
+
+class AssetStore(object):
+    """
+    Base class for the GraphicStore and SoundStore, which keeps count of the
+    scenes using each asset (see Game.scene_assets).
+    
+    A scene acquire()s the assets which it needs, which loads any that are
+    not already loaded, and release()s them when it is over. sweep() unloads
+    every asset which no scene is using, including any which were loaded
+    without being acquired.
+    """
+    
+    def acquire(self, keys):
+        """
+        Loads the named assets (if they are not already loaded), and counts
+        them as being in use.
+        """
+        for key in keys:
+            self[key]
+            self.refs[key] = self.refs.get(key, 0) + 1
+            
+    def release(self, keys):
+        """
+        Counts the named assets as being no longer in use by one scene. They
+        stay loaded until the next sweep().
+        """
+        for key in keys:
+            self.refs[key] = self.refs[key] - 1
+            if self.refs[key] == 0:
+                del self.refs[key]
+                
+    def sweep(self):
+        """
+        Unloads every asset which is not in use. Returns the number unloaded.
+        """
+        unused = [key for key in self.items if key not in self.refs]
+        for key in unused:
+            self.unload(key)
+        return len(unused)
+        
+    def unload(self, key):
+        del self.items[key]
+        
+class GraphicStore(AssetStore):
     """
     Loads and stores all the graphics used in the game. The graphics are stored
     in a dictionary keyed on the name (without extension) of the graphic.
+    
+    Each graphic is loaded the first time that it is used, so that start-up
+    does not have to wait for graphics which may never be shown.
+    
+    Graphics are converted to the surface format chosen for them by the asset
+    import step (see assets.py), which is read from the manifest.
     """
     
-    def load(self, path):
+    def load(self, path, convert = True):
         """
-        Loads all the graphics from the specified path.
+        Finds all the graphics in the specified path. If 'convert' is True the
+        graphics are converted to the format of the display (which must already
+        have been set up by the time they are used).
         """
         self.items = {}
+        self.refs = {}
+        self.files = {}
+        self.convert = convert
+        self.formats = read_manifest(path)
         files = glob.glob(os.path.join(path, "*.png"))
         for imagefile in files:
-            image = pygame.image.load(imagefile).convert_alpha()
             key, ext = os.path.splitext(os.path.basename(imagefile))
-            self.items[key] = image
+            self.files[key] = imagefile
+  
+    def preload(self):
+        """
+        Loads all the graphics which have not been used yet.
+        """
+        for key in self.files:
+            self[key]
   
     def __getitem__(self, key):
-        return self.items[key]
+        image = self.items.get(key)
+        if image is None:
+            image = pygame.image.load(self.files[key])
+            if self.convert:
+                image_format, colorkey = self.formats.get(key, (None, None))
+                image = convert_image(image, image_format, colorkey)
+            self.items[key] = image
+        return image
+        
+    def unload(self, key):
+        """
+        Unloads a graphic, along with the frames and rotated frames made from
+        it (so that none of them keeps it in memory).
+        """
+        image = self.items.pop(key)
+        frame_strips.pop(image, None)
+        r_cache.discard(image)
+        
+    def resident_bytes(self):
+        """
+        Returns the size of the loaded graphics' pixels, in bytes.
+        """
+        return sum([image.get_width() * image.get_height() * image.get_bytesize() for image in self.items.values()])
 
-class SoundStore(object):
+class SoundStore(AssetStore):
     """
     Loads and stores all the sounds used in the game. The sounds are stored in
     a dictionary keyed on the name (without extension) of the graphic.
+    
+    The mixer is started, and each sound loaded, the first time that a sound is
+    used. Call preload() before anything time-critical starts, as starting the
+    mixer takes a noticeable time.
     """
     
+    # The settings for the mixer
+    frequency = 22050
+    size = -16
+    channels = 2
+    buffer = 4096
+    
     def load(self, path):
         """
-        Loads all the sounds from the specified path.
+        Finds all the sounds in the specified path.
         """
         self.items = {}
+        self.refs = {}
+        self.files = {}
         files = glob.glob(os.path.join(path, "*.ogg"))
         for soundfile in files:
-            sound = pygame.mixer.Sound(soundfile)
             key, ext = os.path.splitext(os.path.basename(soundfile))
-            self.items[key] = sound
-            
-        self.items["mining"].set_volume(0.25)
+            self.files[key] = soundfile
+
+    def preload(self):
+        """
+        Starts the mixer, and loads all the sounds which have not been used yet.
+        """
+        for key in self.files:
+            self[key]
 
     def play(self, sound_name, loops = 0):
+        sound = self[sound_name]
         channel = pygame.mixer.find_channel(True)
-        channel.play(self.items[sound_name], loops)
+        channel.play(sound, loops)
+        
+    def stop(self):
+        """
+        Stops all the sounds which are playing.
+        """
+        if pygame.mixer.get_init():
+            pygame.mixer.stop()
         
     def __getitem__(self, key):
-        return self.items[key]
+        sound = self.items.get(key)
+        if sound is None:
+            if not pygame.mixer.get_init():
+                pygame.mixer.init(self.frequency, self.size, self.channels, self.buffer)
+            sound = pygame.mixer.Sound(self.files[key])
+            if key == "mining":
+                sound.set_volume(0.25)
+            self.items[key] = sound
+        return sound
+        
+    def resident_bytes(self):
+        """
+        Returns the size of the loaded sounds' samples, in bytes.
+        """
+        if not self.items:
+            return 0
+        frequency, size, channels = pygame.mixer.get_init()
+        return int(sum([sound.get_length() for sound in self.items.values()]) * frequency * channels * abs(size) // 8)
+
+class FontStore(object):
+    """
+    Shares fonts between the labels. Each font (the file and size) is loaded
+    the first time that a label is drawn in it, and the font module is started
+    when the first font is loaded.
+    """
+    
+    def __init__(self):
+        self.items = {}
+        
+    def get(self, name, size):
+        """
+        Returns the font from the named file (or pygame's default font, if the
+        name is empty) at the specified size.
+        """
+        font = self.items.get((name, size))
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = pygame.font.Font(name or None, size)
+            self.items[(name, size)] = font
+        return font
+
+class RotationCache(object):
+    """
+    Stores rotated copies of sprite frames, so that spinning sprites do not
+    have to call pygame.transform on every frame. The angles are quantized
+    into a fixed number of steps, and each rotated frame is rendered the first
+    time it is needed (or in advance, using prebuild()).
+    
+    The memory used by the rotated frames is limited to 'max_bytes'. When the
+    limit is reached, the least recently used frames are discarded.
+    
+    Each entry also records the bounding rect of the visible pixels in the
+    rotated frame, for use as the collision bounds, and the collision mask of
+    the rotated frame.
+    """
+    
+    def __init__(self, steps = 32, max_bytes = 8 * 1024 * 1024):
+        self.steps = steps
+        self.max_bytes = max_bytes
+        self.clear()
+        
+    def clear(self):
+        """
+        Discards all the rotated frames, and resets the statistics.
+        """
+        self.items = OrderedDict()
+        self.bytes = 0
+        self.build_time = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        
+    def step(self, angle):
+        """
+        Returns the step for the specified angle (in degrees).
+        """
+        return int(angle * self.steps / 360.0) % self.steps
+    
+    def get(self, image, index, step):
+        """
+        Returns a tuple of the rotated image, the bounding rect of its visible
+        pixels, its size in bytes and its collision mask, for the specified
+        frame of a film-strip image (see the Animation class) at the specified
+        step. The bounding rect is relative to the centre of the image.
+        """
+        key = (image, index, step)
+        entry = self.items.pop(key, None)
+        if entry is None:
+            self.misses = self.misses + 1
+            size = image.get_height()
+            entry = self.render(image.subsurface(Rect(index * size, 0, size, size)), step)
+        else:
+            self.hits = self.hits + 1
+        # Re-inserting the entry moves it to the 'most recently used' end
+        self.items[key] = entry
+        return entry
+        
+    def render(self, frame, step):
+        start = time.time()
+        image = pygame.transform.rotozoom(with_alpha(frame), step * 360.0 / self.steps, 1)
+        bounds = image.get_bounding_rect()
+        bounds.move_ip(-(image.get_width() // 2), -(image.get_height() // 2))
+        mask = pygame.mask.from_surface(image)
+        size = image.get_width() * image.get_height() * image.get_bytesize()
+        self.bytes = self.bytes + size
+        while self.items and self.bytes > self.max_bytes:
+            old_key, old_entry = self.items.popitem(False)
+            self.bytes = self.bytes - old_entry[2]
+            self.evictions = self.evictions + 1
+        self.build_time = self.build_time + (time.time() - start)
+        return (image, bounds, size, mask)
+    
+    def discard(self, image):
+        """
+        Discards the rotated frames of the specified film-strip image.
+        """
+        for key in [key for key in self.items if key[0] is image]:
+            self.bytes = self.bytes - self.items.pop(key)[2]
+    
+    def prebuild(self, images):
+        """
+        Renders every step for every frame of the specified film-strip images
+        (see the Animation class for the format).
+        """
+        for image in images:
+            for index in range(0, image.get_width() // image.get_height()):
+                for step in range(0, self.steps):
+                    self.get(image, index, step)
+                    
+    def report(self):
+        """
+        Returns a summary of the cache usage.
+        """
+        return "Rotation cache: %d frames, %.1f KB, built in %.1f ms (%d hits, %d misses, %d evictions)" % (len(self.items), self.bytes / 1024.0, self.build_time * 1000.0, self.hits, self.misses, self.evictions)
 
 # ==============================================================================
 # g_store: GLOBAL VARIABLE!!!!
@@ -92,6 +371,188 @@ g_store = GraphicStore()
 # classes to have access to the sound files.
 s_store = SoundStore()
 
+# ==============================================================================
+# frame_strips: GLOBAL VARIABLE!!!!
+# ==============================================================================
+# The frames of each film-strip image (as sub-surfaces), and their collision
+# masks (None until that frame's mask is first needed), as a tuple of two
+# lists. These are shared by all the animations of the same image. The frames
+# keep their image alive, so an image's entry is dropped when the GraphicStore
+# unloads it (see GraphicStore.unload()).
+frame_strips = {}
+
+# ==============================================================================
+# f_store: GLOBAL VARIABLE!!!!
+# ==============================================================================
+# The fonts for the labels, which are shared between all the labels in the
+# same font and size.
+f_store = FontStore()
+
+# ==============================================================================
+# r_cache: GLOBAL VARIABLE!!!!
+# ==============================================================================
+# The shared cache of rotated frames, for the spinning asteroids. The number of
+# steps and the memory limit are set from the Settings in the Game() class.
+r_cache = RotationCache()
+
+# ==============================================================================
+# e_log: GLOBAL VARIABLE!!!!
+# ==============================================================================
+# The gameplay event log, which the sprites record their events in (see
+# eventlog.py). Nothing is recorded unless the Game() class opens it.
+e_log = EventLog()
+
+class Settings(object):
+    """
+    Holds the options which control how the game runs. The defaults are set
+    here, and can be overridden from the command-line (see main.py).
+    """
+    
+    # If True, asteroids caught in an explosion will explode as well
+    chain_reaction = False
+    
+    # If True, sprites only collide if their visible pixels overlap; otherwise
+    # they collide if the bounds of their visible pixels overlap
+    pixel_collisions = True
+    
+    # The number of angles at which the spinning asteroids are drawn, and the
+    # memory limit for the cache of rotated images
+    rotation_steps = 32
+    rotation_cache_kb = 8192
+    
+    # If True, all the rotated asteroid images are rendered at start-up,
+    # rather than as they are needed
+    rotation_prebuild = False
+    
+    # The render backend, either "surface" or "texture" (see render.py)
+    renderer = "surface"
+    
+    # The scale at which the game world is drawn, before being scaled up to
+    # the window using the scale filter ("integer", "smooth" or "nearest").
+    # The HUD is always drawn at the resolution of the window.
+    render_scale = 1.0
+    scale_filter = "smooth"
+    
+    # The size of the window (None for the size of the game), or fullscreen
+    window_size = None
+    fullscreen = False
+    
+    # If True, use SDL's 'dummy' drivers, so that nothing is shown or heard
+    headless = False
+    
+    # If set, every frame is recorded to this path, in the capture format
+    # ("png", "raw" or "y4m"; see capture.py), via a ring of buffers
+    capture = None
+    capture_format = "png"
+    capture_ring = 16
+    
+    # A snapshot of the game is taken every 'snapshot_interval' milliseconds,
+    # into a ring of 'snapshot_memory_kb'. These are used to rewind the game
+    # (BACKSPACE) and to retry from shortly before the end (R on the game-over
+    # screen).
+    snapshot_interval = 500
+    snapshot_memory_kb = 1024
+    
+    # If set, the latest snapshot is also written to this file (such as
+    # jangam.snapshot), which is deleted when the game ends normally. If
+    # 'resume' is True and the file exists (i.e. the game crashed), the game
+    # is resumed from it. None (the default) saves no snapshots.
+    snapshot_file = None
+    resume = False
+    
+    # The score, duration and powerups of every finished game are added to
+    # the analytics in this file (such as analytics.json, next to the hi-score
+    # table), which the game-over screen uses to show how the score compares
+    # with every other game (see analytics.py). None (the default) keeps the
+    # analytics for this run only, without writing anything.
+    analytics_file = None
+    
+    # The events of every game (spawns, collisions, launches, mining,
+    # powerups, damage and game over) are added to the end of this file (such
+    # as events.bin), for offline analysis (see eventlog.py). None (the
+    # default) records none.
+    event_log = None
+    
+    # Two-player mode: either host a game on the 'net_host' port, or join the
+    # game at 'net_connect' (a (host, port) tuple). The host sends the state
+    # of the game 'net_rate' times a second. For testing, 'net_latency' (in
+    # milliseconds) and 'net_loss' (the fraction of packets dropped) are
+    # applied to everything sent (see network.py).
+    net_host = None
+    net_connect = None
+    net_rate = 30
+    net_latency = 0
+    net_loss = 0.0
+    
+    # The time (from time.time()) at which the program started, from which the
+    # start-up timeline is measured; None to measure from when the Game is
+    # created. If 'eager_init' is True, every pygame module is started, and
+    # every graphic and sound loaded, before the game starts (rather than each
+    # being left until it is first used).
+    started = None
+    eager_init = False
+    
+    # If True, only the graphics and sounds which the current scene (mode)
+    # needs are kept loaded (see Game.scene_assets); otherwise each one stays
+    # loaded from when it is first used. 'eager_init' turns this off, as it
+    # loads everything before the game starts.
+    unload_assets = True
+    
+    # If True, the allocations made in each frame and the pauses for garbage
+    # collection are recorded, and summarised in the log (see memprofile.py).
+    # This slows the game down considerably.
+    memory_profile = False
+    
+    # If True, the game is simulated on its own thread, 'sim_rate' times a
+    # second (0 for as often as possible), and the main thread draws the
+    # latest state of the world which the simulation has published. The
+    # two-player mode always simulates at Game.net_frame_rate. The memory
+    # profiler only works with a single thread, so it turns this off.
+    threaded = False
+    sim_rate = 60
+    
+    # The frame rate which the quality governor holds, by stepping down the
+    # level of detail when the game falls short of it and back up when there
+    # is room to spare (see governor.py); 0 to always show full quality. The
+    # governor is not used with the memory profiler.
+    target_fps = 60
+    
+    # If True, the ship's shields, hits and powerups are shown with glows,
+    # flashes and shakes drawn over the world (see screenfx.py). These are
+    # not shown by the texture renderer.
+    screen_effects = True
+    
+    def __init__(self, **options):
+        for name, value in options.items():
+            setattr(self, name, value)
+
+class StartupTimeline(object):
+    """
+    Records how long each stage of starting the game takes, from the time that
+    the program started until the first frame is on screen.
+    """
+    
+    def __init__(self, started = None):
+        if started is None:
+            started = time.time()
+        self.started = started
+        self.last = started
+        self.stages = []
+        
+    def mark(self, name):
+        """
+        Marks the end of the named stage, which began at the end of the last.
+        """
+        current = time.time()
+        self.stages.append((name, (current - self.last) * 1000.0))
+        self.last = current
+        
+    def total(self):
+        return (self.last - self.started) * 1000.0
+        
+    def report(self):
+        return "Start-up: %s; %.1f ms in total" % (", ".join(["%s %.1f ms" % stage for stage in self.stages]), self.total())
+
 class Label(object):
     """
     Simple class to render a label on-screen. Create an instance and call
@@ -106,7 +567,7 @@ class Label(object):
         self.y = y
         self.colour = colour
         self._text = text
-        self.set_font(os.path.join("graphics", "04B_03.ttf"), 16)
+        self.set_font(os.path.join("graphics", "04B_03.TTF"), 16)
         
     def draw(self, surface):
         """
@@ -122,21 +583,40 @@ class Label(object):
     def set_font(self, name, size):
         self.fontname = name
         self.fontsize = size
-        if self.fontname == "":
-            self.font = pygame.font.Font(None, self.fontsize)
-        else:
-            self.font = pygame.font.Font(self.fontname, self.fontsize)
-        self.image = self.font.render(self.text, True, self.colour)
+        self.font = None
+        self._image = None
+
+    def get_image(self):
+        """
+        Returns the rendered text, rendering it (and loading the font) if it
+        has changed since it was last drawn.
+        """
+        if self._image is None:
+            if self.font is None:
+                self.font = f_store.get(self.fontname, self.fontsize)
+            self._image = self.font.render(self._text, True, self.colour)
+        return self._image
+        
+    image = property(get_image)
 
     def get_text(self):
         return self._text
         
     def set_text(self, new_text):
-        self._text = new_text
-        self.image = self.font.render(self.text, True, self.colour)
+        # The text is only rendered again if it has changed
+        if new_text != self._text:
+            self._text = new_text
+            self._image = None
         
     text = property(get_text, set_text)
     
+    def update(self, text):
+        """
+        Sets the text (as Progressbar.update() sets the value, for the
+        HudLayer).
+        """
+        self.text = text
+    
 class ParallaxScroller(object):
     """
     Implements a vertically scrolling area of the screen, wrapping around at the 
@@ -159,6 +639,81 @@ class ParallaxScroller(object):
         target.blit(self.image, [int(self.x), int(self.y)])
         target.blit(self.image, [int(self.x), int(self.y) - self.h])
 
+class Scheduler(object):
+    """
+    Central timer for timed events. Rather than every sprite comparing its own
+    'next update' time against the clock on every game tick, each sprite
+    registers the time at which it next needs attention, and the scheduler
+    only calls back the ones which are due.
+    
+    The pending events are held in a heap ordered on their due time, so
+    finding the due events costs nothing for the sprites which are still
+    waiting. Cancelled events are simply marked as dead and are discarded when
+    they reach the top of the heap.
+    
+    The 'visited' variable holds the number of callbacks made by the most
+    recent call to run(), and can be used to monitor how much work is being
+    done per frame.
+    """
+    
+    def __init__(self):
+        self.queue = []
+        self.counter = 0
+        self.visited = 0
+        self.total_visited = 0
+        self.runs = 0
+        
+    def schedule(self, due_time, callback):
+        """
+        Registers a callback to be invoked (with the current time) by the first
+        call to run() which is made after the due time. Returns an entry which
+        can be passed to cancel().
+        """
+        # The counter keeps events which are due at the same time in the order
+        # they were scheduled, and prevents the callbacks being compared.
+        self.counter = self.counter + 1
+        entry = [due_time, self.counter, callback]
+        heapq.heappush(self.queue, entry)
+        return entry
+    
+    def cancel(self, entry):
+        """
+        Cancels a scheduled event.
+        """
+        if entry:
+            entry[2] = None
+        
+    def clear(self):
+        """
+        Discards all the pending events.
+        """
+        self.queue = []
+        
+    def run(self, current_time):
+        """
+        Invokes the callbacks for all the events which are due. This should be
+        called every game-tick.
+        """
+        visited = 0
+        queue = self.queue
+        while queue and queue[0][0] < current_time:
+            entry = heapq.heappop(queue)
+            callback = entry[2]
+            if callback:
+                visited = visited + 1
+                callback(current_time)
+        self.visited = visited
+        self.total_visited = self.total_visited + visited
+        self.runs = self.runs + 1
+
+    def average_visited(self):
+        """
+        Returns the average number of callbacks made per call to run().
+        """
+        if self.runs == 0:
+            return 0.0
+        return float(self.total_visited) / self.runs
+    
 class Animation(object):
     """
     Implements an animated image, for use by sprites, which can retrieve the
@@ -170,11 +725,16 @@ class Animation(object):
     animation reaches the end of the cycle and has looped back to the start. The
     callback will be passed the Animation image. This can be used, for example,
     to remove an animation which should only be played once.
+    
+    Every sprite has its own Animation, so the attributes are kept in slots
+    (see entity.py), and the frames are shared between the animations of the
+    same image.
     """
-    sprite_image = None
-    frames = None
-    on_cycle = None
-    rect = None
+    __slots__ = ("sprite_image", "frames", "masks", "frame_height", "frame_width", "frame_count", "frame", "image_index", "image", "rect", "speed", "frame_time", "on_cycle")
+    
+    # Every animation is slowed down by this factor (set by the quality
+    # governor), so that the sprites are redrawn less often
+    slowdown = 1
     
     def __init__(self, image, speed, on_cycle = None):
         """
@@ -203,15 +763,21 @@ class Animation(object):
         self.frame_count = self.sprite_image.get_width() / self.frame_width
         
         # Extract the frames into a list of sub-surfaces, as this is more
-        # efficient than creating an image for each frame.
-        self.frames = []
-        for frame in range(0, self.frame_count):
-            offset = frame * self.frame_width
-            frame = self.sprite_image.subsurface(Rect(offset, 0, self.frame_width, self.frame_width))
-            self.frames.append(frame)
+        # efficient than creating an image for each frame. The collision masks
+        # are made as they are needed (see get_mask()).
+        strip = frame_strips.get(image)
+        if strip is None:
+            frames = []
+            for frame in range(0, self.frame_count):
+                offset = frame * self.frame_width
+                frames.append(self.sprite_image.subsurface(Rect(offset, 0, self.frame_width, self.frame_width)))
+            strip = frame_strips[image] = (frames, [None] * self.frame_count)
+        self.frames, self.masks = strip
             
-        # Prepare the first frame.
+        # Prepare the first frame. The 'image_index' is the index of the frame
+        # in 'image', while 'frame' is the index of the next frame to show.
         self.frame = 0
+        self.image_index = 0
         self.image = self.frames[self.frame]
         self.rect = self.image.get_rect()
         
@@ -229,6 +795,7 @@ class Animation(object):
         if self.frame_time < current_time:
             # Get the current frame image
             self.image = self.frames[self.frame]
+            self.image_index = self.frame
             # Advance to the next frame, looping back to frame 0 at the end
             self.frame = self.frame + 1
             if self.frame > self.frame_count - 1:
@@ -236,17 +803,38 @@ class Animation(object):
                 if self.on_cycle:
                     self.on_cycle(self)
             # Advance the timer to wait for the next update time                    
-            self.frame_time = current_time + self.speed
+            self.frame_time = current_time + self.speed * self.slowdown
+            
+    def get_mask(self):
+        """
+        Returns the collision mask of the current frame.
+        """
+        mask = self.masks[self.image_index]
+        if mask is None:
+            mask = pygame.mask.from_surface(self.frames[self.image_index])
+            self.masks[self.image_index] = mask
+        return mask
     
-class FrameSprite(pygame.sprite.Sprite):
+class FrameSprite(Entity):
     """
     Implements an animated sprite which has multiple frames, using the 
     Animation() class.
+    
+    Sprites which need to do something at regular intervals (such as moving)
+    can set 'tick_interval' (in milliseconds) and override the tick() method.
+    
+    The sprite can either be updated by calling update() every game tick, or
+    can be handed to a Scheduler using start(), in which case it will only be
+    called back when the next animation frame or tick is due.
+    
+    Sprites are Entities (see entity.py), so the attributes of each class are
+    declared in its __slots__, and set in __init__() rather than given class
+    defaults. Only the constants shared by every instance are class
+    attributes.
     """
-    spriteImage = None
-    frames = None
-    animation = None
-    on_remove = None
+    __slots__ = ("animation", "play_once", "next_update_time", "on_remove", "scheduler", "animation_entry", "tick_entry")
+    
+    tick_interval = None
     
     def __init__(self, image, speed):
         """
@@ -254,7 +842,7 @@ class FrameSprite(pygame.sprite.Sprite):
         actual animation. See the Animation class for the meaning of the
         parameters (these are passed directly on to the Animation class).
         """
-        pygame.sprite.Sprite.__init__(self)
+        Entity.__init__(self)
 
         # Set up the animation handler
         self.animation = Animation(image, speed, self.on_cycle)
@@ -262,18 +850,110 @@ class FrameSprite(pygame.sprite.Sprite):
         self.image = self.animation.image
         
         # Set the other parameters
-        self.visible = True
         self.play_once = False
+        self.next_update_time = 0 # tick() hasn't been called yet.
+        self.on_remove = None
+        self.scheduler = None
+        self.animation_entry = None
+        self.tick_entry = None
         
     def update(self, current_time):
         """
         This is called every game-tick to allow the sprite to be updated.
         """
         if self.visible:
-            # Advance the animation and retrieve the current frame image from 
-            # it.
-            self.animation.update(current_time)
-            self.image = self.animation.image
+            self.animate(current_time)
+        if self.tick_interval is not None and self.next_update_time < current_time:
+            self.tick(current_time)
+            self.next_update_time = current_time + self.tick_interval
+
+    def animate(self, current_time):
+        """
+        Advances the animation and retrieves the current frame image from it.
+        """
+        self.animation.update(current_time)
+        self.image = self.animation.image
+        
+    def tick(self, current_time):
+        """
+        Called every 'tick_interval' milliseconds. Override this in descendant
+        classes.
+        """
+        pass
+    
+    def start(self, scheduler):
+        """
+        Registers the sprite with the scheduler, which will then take care of
+        updating it. Do not call update() on a sprite which has been started.
+        """
+        self.scheduler = scheduler
+        self.animation_entry = scheduler.schedule(self.animation.frame_time, self.on_animation_due)
+        if self.tick_interval is not None:
+            self.tick_entry = scheduler.schedule(self.next_update_time, self.on_tick_due)
+            
+    def stop(self):
+        """
+        Cancels any events which the sprite has pending with the scheduler.
+        """
+        if self.scheduler:
+            self.scheduler.cancel(self.animation_entry)
+            self.scheduler.cancel(self.tick_entry)
+            self.scheduler = None
+            
+    def on_animation_due(self, current_time):
+        """
+        Scheduler callback, invoked when the next animation frame is due.
+        """
+        if self.visible:
+            self.animate(current_time)
+        # The animation might have finished, or the sprite been removed, in
+        # which case the scheduler will have been released.
+        if self.scheduler and self.visible:
+            self.animation_entry = self.scheduler.schedule(self.animation.frame_time, self.on_animation_due)
+            
+    def on_tick_due(self, current_time):
+        """
+        Scheduler callback, invoked when the next tick is due.
+        """
+        self.tick(current_time)
+        self.next_update_time = current_time + self.tick_interval
+        if self.scheduler:
+            self.tick_entry = self.scheduler.schedule(self.next_update_time, self.on_tick_due)
+
+    def get_timing(self, current_time):
+        """
+        Returns the current animation frame, the next frame, and the times
+        until the next animation frame and tick are due, for a snapshot of the
+        sprite.
+        """
+        animation = self.animation
+        return (animation.image_index, animation.frame, clamp_short(animation.frame_time - current_time), clamp_short(self.next_update_time - current_time))
+
+    def set_timing(self, image_index, frame, animation_delay, tick_delay, current_time):
+        """
+        Restores the values returned by get_timing(). Call this before the
+        sprite is started.
+        """
+        self.show_frame(image_index)
+        self.animation.frame = frame
+        self.animation.frame_time = current_time + animation_delay
+        self.next_update_time = current_time + tick_delay
+        
+    def show_frame(self, image_index):
+        """
+        Shows the specified frame of the animation, without advancing it.
+        """
+        animation = self.animation
+        animation.image_index = image_index
+        animation.image = animation.frames[image_index]
+        self.image = animation.image
+
+    def get_mask(self):
+        """
+        Returns the collision mask of the current image, and the position that
+        the image is drawn at (see collide_pixels()).
+        """
+        return (self.animation.get_mask(), self.rect.topleft)
 
     def draw(self, target):
         """
@@ -299,24 +979,44 @@ class FrameSprite(pygame.sprite.Sprite):
         removed.
         """
         self.visible = False
+        self.stop()
         if self.on_remove:
             self.on_remove(self)
             
+    def kill(self):
+        """
+        Removes the sprite from its group (this is called by the collision
+        functions), and cancels any pending events.
+        """
+        self.stop()
+        Entity.kill(self)
+            
 class Asteroid(FrameSprite):
     """
     Handles a single asteroid or powerup.
+    
+    Asteroids spin as they fall. The rotated images come from the shared
+    RotationCache (r_cache), and the 'bounds' property gives the rect of the
+    visible part of the rotated image, for collision detection.
     """
-    spriteImage = None
-    frames = None
-    being_mined = False
+    __slots__ = ("value", "speed", "drift", "angle", "spin", "step", "frame", "bottom", "being_mined", "rotated_bounds", "rotated_mask", "net_id")
+    
     radius = 28
-    value = 1
+    tick_interval = 10
+    
+    # The layout of an asteroid in a game snapshot: value, position, speed,
+    # drift, being_mined, angle, spin, then the timing (see get_timing())
+    state_struct = struct.Struct("<BhhbbBffBBhh")
     
     def __init__(self, value, on_remove):
-        asteroids = ["asteroid_01", "asteroid_iron_01", "asteroid_gold_01", "asteroid_emerald_01", "asteroid_powerup_mine_01", "asteroid_powerup_shield_01", "asteroid_powerup_hull_01"]
         self.value = value
+        self.being_mined = False
+        self.bottom = 864
+        self.step = None       # Current rotation step
+        self.frame = None      # Animation frame that the current image is taken from
+        self.net_id = 0
         
-        FrameSprite.__init__(self, g_store[asteroids[self.value - 1]], 10)
+        FrameSprite.__init__(self, g_store[ASTEROID_IMAGES[self.value - 1]], 10)
 
         # The size is currently hard-coded.
         self.rect = Rect(0, 0, 64, 64)
@@ -328,46 +1028,136 @@ class Asteroid(FrameSprite):
         self.speed = random.randint(1, 3)
         self.drift = random.randint(-2, 2)
         
-        self.next_update_time = 0 # update() hasn't been called yet.
+        self.angle = random.uniform(0, 360)
+        self.spin = random.choice([-1, 1]) * random.uniform(15, 120) # Degrees per second
+        self.rotate()
         
         self.on_remove = on_remove
         
-    def update(self, current_time, bottom):
+    def update(self, current_time, bottom = None):
+        if bottom is not None:
+            self.bottom = bottom
         FrameSprite.update(self, current_time)
                 
-        if self.next_update_time < current_time:
-
-            if self.being_mined:
-                # Asteroids which are being mined do not move
-                pass
-            else:
-                # If we're at the bottom of the screen, remove us.
-                if self.rect.bottom >= bottom - 1:
-                    self.remove()
+    def animate(self, current_time):
+        FrameSprite.animate(self, current_time)
+        self.rotate()
+        
+    def rotate(self):
+        """
+        Updates the image to match the current angle and animation frame.
+        """
+        frame = self.animation.image_index
+        step = r_cache.step(self.angle)
+        if step != self.step or frame != self.frame:
+            self.image, self.rotated_bounds, size, self.rotated_mask = r_cache.get(self.animation.sprite_image, frame, step)
+            self.step = step
+            self.frame = frame
             
-                self.rect.left = self.rect.left + self.drift
-                    
-                # Move our position down by one pixel
-                self.rect.top += self.speed
+    def get_bounds(self):
+        return self.rotated_bounds.move(self.rect.centerx, self.rect.centery)
+    
+    bounds = property(get_bounds)
+    
+    def get_mask(self):
+        width, height = self.image.get_size()
+        return (self.rotated_mask, (self.rect.centerx - width // 2, self.rect.centery - height // 2))
+    
+    def get_blit(self):
+        """
+        Returns the rotated image, and the position which centres it on the
+        asteroid's position.
+        """
+        width, height = self.image.get_size()
+        return (self.image, (self.rect.centerx - width // 2, self.rect.centery - height // 2))
+    
+    def draw(self, target):
+        """
+        Draws the rotated image, centred on the asteroid's position. Returns
+        the rect which was drawn.
+        """
+        return target.blit(*self.get_blit())
+        
+    def tick(self, current_time):
+        if self.being_mined:
+            # Asteroids which are being mined do not move
+            pass
+        else:
+            # If we're at the bottom of the screen, remove us.
+            if self.rect.bottom >= self.bottom - 1:
+                self.remove()
+        
+            self.rect.left = self.rect.left + self.drift
+                
+            # Move our position down by one pixel
+            self.rect.top += self.speed
+            
+            # Spin
+            self.angle = (self.angle + (self.spin * self.tick_interval / 1000.0)) % 360
+            self.rotate()
+
+    def get_state(self, current_time):
+        """
+        Returns the asteroid's state, for a snapshot (see state_struct).
+        """
+        return (self.value, self.rect.left, self.rect.top, self.speed, self.drift, self.being_mined, self.angle, self.spin) + self.get_timing(current_time)
     
-            self.next_update_time = current_time + 10
+    def set_state(self, state, current_time):
+        """
+        Restores the state returned by get_state().
+        """
+        value, left, top, self.speed, self.drift, being_mined, self.angle, self.spin = state[0:8]
+        self.rect.topleft = (left, top)
+        self.being_mined = bool(being_mined)
+        self.set_timing(*(state[8:12] + (current_time,)))
+        self.step = None
+        self.rotate()
+
+def collide_bounds(left, right):
+    """
+    Collision test for EntityGroup.collide(), which uses the 'bounds'
+    of sprites which have them (such as the rotated asteroids), and the rect of
+    any which don't.
+    """
+    return getattr(left, "bounds", left.rect).colliderect(getattr(right, "bounds", right.rect))
+
+def collide_pixels(left, right):
+    """
+    Collision test for EntityGroup.collide(), which checks whether any
+    of the visible pixels of the sprites overlap, using their get_mask(). The
+    bounds are compared first (see collide_bounds()), so that the masks are
+    only compared for sprites which are close enough to touch.
+    """
+    if not collide_bounds(left, right):
+        return False
+    left_mask, left_position = left.get_mask()
+    right_mask, right_position = right.get_mask()
+    return left_mask.overlap(right_mask, (right_position[0] - left_position[0], right_position[1] - left_position[1])) is not None
 
 class Asteroids(object):
     
     max_asteroids = 20
+    next_id = 0
     
-    def __init__(self):
-        self.roids = pygame.sprite.Group()
-
+    def __init__(self, scheduler):
+        self.roids = EntityGroup()
+        self.scheduler = scheduler
+
+    def add(self, roid):
+        # Each asteroid is numbered, so that it can be identified in the
+        # two-player mode
+        self.next_id = (self.next_id + 1) & 0xffff
+        roid.net_id = self.next_id
+        self.roids.add(roid)
+        roid.start(self.scheduler)
+        
     def clear(self):
+        for roid in self.roids:
+            roid.stop()
         self.roids.empty()
         
-    def update(self, current_time):
-        self.roids.update(current_time, 864)
-    
     def draw(self, target):
-        rectlist = self.roids.draw(target)
-        pygame.display.update(rectlist)
+        self.roids.draw(target)
 
     def on_roid_die(self, roid):
         self.roids.remove(roid)
@@ -376,16 +1166,22 @@ class Mine(FrameSprite):
     """
     Sprite for the asteroid-miner.
     """
+    __slots__ = ("ship", "effects", "speed", "is_mining", "mine_time", "asteroid", "dust", "net_id")
     
-    is_mining = False
-    mine_time = 1000
-    asteroid = None
     radius = 12
-    clouds = None
-    ship = None
+    tick_interval = 1
+    
+    # The layout of a mine in a game snapshot: rect, is_mining, mine_time, the
+    # index of the asteroid being mined (or -1), then the timing
+    state_struct = struct.Struct("<hhhhBHhBBhh")
     
-    def __init__(self, ship, on_remove):
+    def __init__(self, ship, on_remove, effects):
         FrameSprite.__init__(self, g_store["miner_frames_01"], 10)
+        self.is_mining = False
+        self.mine_time = 1000
+        self.asteroid = None
+        self.dust = None
+        self.net_id = 0
 
         # Store the reference to the Ship instance.
         self.ship = ship
@@ -400,63 +1196,74 @@ class Mine(FrameSprite):
 
         self.speed = 1
         
-        self.next_update_time = 0 # update() hasn't been called yet.
-        
         self.on_remove = on_remove
         
-        self.clouds = FrameSprite(g_store["cloud_frames_01"], 10)
-        self.clouds.visible = False
+        # The 'mining dust' is handled by the ParticleEngine
+        self.effects = effects
         
-    def update(self, current_time):
-        FrameSprite.update(self, current_time)
-                
-        if self.next_update_time < current_time:
-
-            if self.is_mining:
-                # Update the animated 'mining dust'
-                self.clouds.update(current_time)
-                # Count down the time we've spent mining
-                self.mine_time = self.mine_time - 1
-                if self.asteroid:
-                    # If it is a normal asteroid, update the player's score
-                    # with the value
-                    if self.asteroid.value < 5:
-                        self.ship.score = self.ship.score + self.asteroid.value
-                if self.mine_time < 1:
-                    # The mining-time has finished. Remove the mining unit
-                    # and the asteroid
-                    self.remove()
-            else:
-                # Move us up the screen
-                self.rect.top -= self.speed
-
-                # If we reach the top of the screen without encountering any
-                # asteroids, remove the unit
-                if self.rect.top < -24:
-                    self.remove()
-                
-            self.next_update_time = current_time + 1
-
-    def draw_clouds(self, target):
+    def tick(self, current_time):
         if self.is_mining:
-            self.clouds.draw(target)
+            # Count down the time we've spent mining
+            self.mine_time = self.mine_time - 1
+            if self.asteroid:
+                # If it is a normal asteroid, update the player's score
+                # with the value
+                if self.asteroid.value < 5:
+                    self.ship.score = self.ship.score + self.asteroid.value
+            if self.mine_time < 1:
+                # The mining-time has finished. Remove the mining unit
+                # and the asteroid
+                self.remove()
+        else:
+            # Move us up the screen
+            self.rect.top -= self.speed
+
+            # If we reach the top of the screen without encountering any
+            # asteroids, remove the unit
+            if self.rect.top < -24:
+                self.remove()
 
     def start_mining(self):
         self.is_mining = True
         # Position the 'mining dust' animation at the top of the mining unit
-        self.clouds.rect = Rect(self.rect)
-        self.clouds.rect.width = 32
-        self.clouds.rect.left = self.clouds.rect.left - 4
-        self.clouds.rect.top = self.rect.top - 16
-        self.clouds.visible = True
+        self.dust = self.effects.emit("dust", self.rect.left - 4, self.rect.top - 16, optional = True)
 
-    def remove(self, destroyed = False):
-        s_store["mining"].stop()
-        self.ship.mining_units = self.ship.mining_units + 1
-        if self.asteroid:
+    def get_state(self, current_time, roids):
+        """
+        Returns the mine's state, for a snapshot (see state_struct). The
+        'roids' dictionary gives the index of each asteroid in the snapshot.
+        """
+        return (self.rect.left, self.rect.top, self.rect.width, self.rect.height, self.is_mining, max(self.mine_time, 0), roids.get(self.asteroid, -1)) + self.get_timing(current_time)
+    
+    def set_state(self, state, current_time, roids):
+        """
+        Restores the state returned by get_state(), where 'roids' is the list
+        of restored asteroids.
+        """
+        self.rect = Rect(state[0:4])
+        self.mine_time = state[5]
+        if state[6] >= 0:
+            self.asteroid = roids[state[6]]
+        self.set_timing(*(state[7:11] + (current_time,)))
+        if state[4]:
+            # This also restarts the 'mining dust'
+            self.start_mining()
+
+    def remove(self, destroyed = False):
+        s_store["mining"].stop()
+        if self.dust:
+            self.effects.kill(self.dust)
+            self.dust = None
+        self.ship.mining_units = self.ship.mining_units + 1
+        if self.asteroid:
             if not destroyed:
+                e_log.log(EVENT_MINING_FINISH, self.rect.x, self.rect.y, self.asteroid.value)
                 self.ship.apply_powerup(self.asteroid.value)
+            else:
+                e_log.log(EVENT_MINE_LOST, self.rect.x, self.rect.y)
             self.asteroid.remove()
+        else:
+            e_log.log(EVENT_MINE_LOST, self.rect.x, self.rect.y)
         FrameSprite.remove(self)
         
 class MineController(object):
@@ -466,33 +1273,44 @@ class MineController(object):
     """
 
     ship = None
+    next_id = 0
     
-    def __init__(self, ship):
+    def __init__(self, ship, scheduler, effects):
         # Store the reference to the Ship instance
         self.ship = ship
         
-        # Store the 'mine' sprites in a sprite group for efficiency
-        self.mines = pygame.sprite.Group()
+        # Store the reference to the ParticleEngine, for the 'mining dust'
+        self.effects = effects
+        
+        # Store the 'mine' sprites in a group for efficiency
+        self.mines = EntityGroup()
+        
+        # The scheduler which will update the mines
+        self.scheduler = scheduler
 
     def clear(self):
+        for mine in self.mines:
+            mine.stop()
         self.mines.empty()
         
-    def update(self, current_time):
-        # Update any existing mines            
-        self.mines.update(current_time)
-
     def launch(self, position):
-        # Launch a mine
-        mine = Mine(self.ship, self.on_mine_remove)
-        mine.rect = position
+        # Launch a mine from the specified position (which is copied into the
+        # mine's own rect)
+        mine = Mine(self.ship, self.on_mine_remove, self.effects)
+        mine.rect.topleft = position.topleft
+        mine.rect.size = position.size
+        self.add(mine)
+        e_log.log(EVENT_LAUNCH, mine.rect.x, mine.rect.y, self.ship.mining_units)
+        
+    def add(self, mine):
+        self.next_id = (self.next_id + 1) & 0xffff
+        mine.net_id = self.next_id
         self.mines.add(mine)
+        mine.start(self.scheduler)
         
     def draw(self, target):
-        # Update the 'mines' sprite-group (this will redraw all the sprites in
-        # the group)
-        rectlist = self.mines.draw(target)
-        pygame.display.update(rectlist)
-        [mine.draw_clouds(target) for mine in self.mines]
+        # Draw all the sprites in the 'mines' group
+        self.mines.draw(target)
 
     def on_mine_remove(self, mine):
         # The mine has gone off-screen, so remove it
@@ -503,6 +1321,7 @@ class Burst(FrameSprite):
     A Burst is the visual representation of an explosion. It is a simple frame
     sprite which doesn't move.
     """
+    __slots__ = ()
     
     def __init__(self, on_remove = None):
         FrameSprite.__init__(self, g_store["explosion_frames_01"], 10)
@@ -515,16 +1334,21 @@ class Burst(FrameSprite):
 
 class Explosions(object):
     """
-    A class for handling explosions in the game.
+    A class for handling explosions in the game, using a Burst sprite for each
+    one. The game itself now uses the ParticleEngine, and this class is kept as
+    the reference implementation for benchmark.py.
     """
 
     # Position is the point from which the explosion pulses will emanate. This
     # must be set externally before the explosion is triggered.
     position = 0
     
-    def __init__(self):
-        # Store the 'burst' sprites in a sprite group for efficiency
-        self.bursts = pygame.sprite.Group()
+    def __init__(self, scheduler):
+        # Store the 'burst' sprites in a group for efficiency
+        self.bursts = EntityGroup()
+        
+        # The scheduler which will update the bursts
+        self.scheduler = scheduler
         
     def add(self, position):
         """
@@ -534,24 +1358,246 @@ class Explosions(object):
         burst.rect.left = position.left
         burst.rect.top = position.top
         self.bursts.add(burst)
+        burst.start(self.scheduler)
 
     def clear(self):
+        for burst in self.bursts:
+            burst.stop()
         self.bursts.empty()
-        
-    def update(self, current_time):
-        # Update any existing pulses            
-        self.bursts.update(current_time)
     
     def draw(self, target):
-        # Update the 'bursts' sprite-group (this will redraw all the sprites in
-        # the group)
-        rectlist = self.bursts.draw(target)
-        pygame.display.update(rectlist)
+        # Draw all the sprites in the 'bursts' group, and show them
+        self.bursts.draw(target)
+        pygame.display.update()
 
     def on_burst_remove(self, burst):
         # The burst has finished, so remove it
         self.bursts.remove(burst)
         
+class ParticleEffect(object):
+    """
+    Describes one kind of effect for the ParticleEngine: the animation frames
+    (in the same 'film-strip' format used by the Animation class), the speed
+    of the animation, and how long each instance of the effect lasts.
+    """
+    
+    def __init__(self, image, speed, loop = False, lifetime = None):
+        """
+        Params:
+            image   : film-strip image
+            speed   : frames per second
+            loop    : if True, the animation repeats until the effect expires
+                      or is killed, otherwise it plays once
+            lifetime: optional lifetime in milliseconds. Defaults to one
+                      cycle of the animation, or forever if 'loop' is True
+        """
+        animation = Animation(image, speed)
+        self.frames = animation.frames
+        self.frame_count = len(self.frames)
+        self.frame_time = animation.speed
+        self.loop = loop
+        if lifetime:
+            self.lifetime = lifetime
+        elif loop:
+            self.lifetime = None
+        else:
+            self.lifetime = self.frame_time * self.frame_count
+
+class ParticleEngine(object):
+    """
+    Handles large numbers of short-lived animated effects, such as explosions,
+    debris and mining dust.
+    
+    Unlike the sprite-based classes, the effects are not objects in their own
+    right. Each effect is a slot in a set of parallel lists (kind, position,
+    velocity and start time), so adding, updating and removing them is cheap,
+    and the whole set is drawn with a single call to Surface.blits() where the
+    installed version of pygame supports it.
+    
+    The effects must be registered (using register()) before they can be
+    emitted.
+    """
+    
+    # The layout of an effect in a game snapshot: kind (the index of its name
+    # in 'names'), position, velocity, age and remaining lifetime
+    state_struct = struct.Struct("<Bffffhh")
+    
+    def __init__(self):
+        self.effects = {}
+        self.names = []
+        self.mirrored = {}
+        self.show_optional = True
+        self.next_id = 0
+        self.current_time = 0
+        self.clear()
+        
+    def register(self, name, effect):
+        """
+        Registers a ParticleEffect under the specified name.
+        """
+        self.effects[name] = effect
+        effect.name = name
+        self.names = sorted(self.effects)
+        
+    def clear(self):
+        """
+        Removes all the active effects.
+        """
+        self.ids = []
+        self.kinds = []
+        self.x = []
+        self.y = []
+        self.dx = []
+        self.dy = []
+        self.start = []
+        self.expires = []
+        self.index = {}
+        self.batch = []
+        
+    def __len__(self):
+        return len(self.ids)
+    
+    def emit(self, name, x, y, dx = 0.0, dy = 0.0, lifetime = None, optional = False):
+        """
+        Starts a new instance of the named effect, with its top-left corner at
+        the specified position, and optionally moving at dx, dy pixels per
+        millisecond. Returns an id which can be passed to kill() to remove the
+        effect early. 'optional' effects are not started (and None is
+        returned) while 'show_optional' is False.
+        """
+        if optional and not self.show_optional:
+            return None
+        effect = self.effects[name]
+        if not lifetime:
+            lifetime = effect.lifetime
+        self.next_id = self.next_id + 1
+        self.index[self.next_id] = len(self.ids)
+        self.ids.append(self.next_id)
+        self.kinds.append(effect)
+        self.x.append(x)
+        self.y.append(y)
+        self.dx.append(dx)
+        self.dy.append(dy)
+        self.start.append(self.current_time)
+        if lifetime:
+            self.expires.append(self.current_time + lifetime)
+        else:
+            self.expires.append(None)
+        return self.next_id
+    
+    def kill(self, particle_id):
+        """
+        Removes the effect with the specified id, if it is still active.
+        """
+        slot = self.index.get(particle_id)
+        if slot is not None:
+            self._remove(slot)
+            
+    def _remove(self, slot):
+        # Move the last effect into the vacated slot, so that nothing else in
+        # the lists needs to be shifted.
+        del self.index[self.ids[slot]]
+        last = len(self.ids) - 1
+        if slot != last:
+            for values in (self.ids, self.kinds, self.x, self.y, self.dx, self.dy, self.start, self.expires):
+                values[slot] = values[last]
+            self.index[self.ids[slot]] = slot
+        for values in (self.ids, self.kinds, self.x, self.y, self.dx, self.dy, self.start, self.expires):
+            values.pop()
+        
+    def update(self, current_time):
+        """
+        Advances all the effects, removes the ones which have expired, and
+        prepares the list of images to be drawn.
+        """
+        self.current_time = current_time
+        kinds = self.kinds
+        start = self.start
+        expires = self.expires
+        batch = []
+        slot = len(self.ids) - 1
+        while slot >= 0:
+            expiry = expires[slot]
+            if expiry is not None and expiry <= current_time:
+                self._remove(slot)
+            else:
+                effect = kinds[slot]
+                age = current_time - start[slot]
+                frame = age // effect.frame_time
+                if effect.loop:
+                    frame = frame % effect.frame_count
+                elif frame >= effect.frame_count:
+                    frame = effect.frame_count - 1
+                batch.append((effect.frames[frame], (int(self.x[slot] + self.dx[slot] * age), int(self.y[slot] + self.dy[slot] * age))))
+            slot = slot - 1
+        self.batch = batch
+        
+    def get_state(self, current_time):
+        """
+        Returns the effects which have a limited lifetime, for a snapshot (see
+        state_struct). Looping effects (the mining dust) belong to other
+        objects, which recreate them when they are restored.
+        """
+        state = []
+        for slot in range(0, len(self.ids)):
+            expiry = self.expires[slot]
+            if expiry is not None:
+                state.append((self.names.index(self.kinds[slot].name), self.x[slot], self.y[slot], self.dx[slot], self.dy[slot], clamp_short(current_time - self.start[slot]), clamp_short(expiry - current_time)))
+        return state
+    
+    def set_state(self, state, current_time):
+        """
+        Restores the effects returned by get_state().
+        """
+        self.current_time = current_time
+        for kind, x, y, dx, dy, age, remaining in state:
+            self.emit(self.names[kind], x, y, dx, dy, max(remaining, 1))
+            self.start[-1] = current_time - age
+        
+    def get_effects(self, current_time):
+        """
+        Returns all the active effects, ordered by id, as (id, kind, x, y, dx,
+        dy, age) tuples, for sending to the two-player client. The velocity is
+        in pixels per second.
+        """
+        effects = []
+        for slot in range(0, len(self.ids)):
+            effects.append((self.ids[slot] & 0xffff, self.names.index(self.kinds[slot].name), int(self.x[slot]), int(self.y[slot]), int(self.dx[slot] * 1000), int(self.dy[slot] * 1000), min(current_time - self.start[slot], 0xffff)))
+        effects.sort()
+        return effects
+    
+    def mirror(self, effects, current_time):
+        """
+        Makes the active effects match a list from get_effects() (on another
+        engine), leaving the ones which are already running alone.
+        """
+        self.current_time = current_time
+        mirrored = {}
+        for effect_id, kind, x, y, dx, dy, age in effects:
+            particle_id = self.mirrored.get(effect_id)
+            if particle_id not in self.index:
+                particle_id = self.emit(self.names[kind], x, y, dx / 1000.0, dy / 1000.0)
+                self.start[-1] = current_time - age
+                if self.expires[-1] is not None:
+                    self.expires[-1] = self.expires[-1] - age
+            mirrored[effect_id] = particle_id
+        for effect_id, particle_id in self.mirrored.items():
+            if effect_id not in mirrored:
+                self.kill(particle_id)
+        self.mirrored = mirrored
+        
+    def draw(self, target):
+        """
+        Draws all the active effects on the target surface.
+        """
+        if self.batch:
+            if hasattr(target, "blits"):
+                target.blits(self.batch, False)
+            else:
+                # Older versions of pygame have no batched blit
+                for image, position in self.batch:
+                    target.blit(image, position)
+
 class Ship(FrameSprite):
     """
     Controls and displays the player's ship
@@ -565,6 +1611,12 @@ class Ship(FrameSprite):
     score = 0
     mining_units = 1       # Mining units available for launch
     total_mining_units = 1 # Total mining units, including currently-deployed ones
+    collided = False
+    powerups = 0           # Powerups collected this game
+    
+    # The layout of the ship in a game snapshot: position, speed, shield,
+    # hull, score, mining units and whether it has been hit
+    state_struct = struct.Struct("<hfhhIhhB")
     
     def __init__(self, x, y, container_rect):
         FrameSprite.__init__(self, g_store["ship_01"], 10)
@@ -583,6 +1635,13 @@ class Ship(FrameSprite):
         
     def update(self, current_time):
         FrameSprite.update(self, current_time)
+        self.move()
+        
+    def move(self):
+        """
+        Moves the ship according to the thrust. This is called once per frame
+        (in the two-player mode, once per command).
+        """
         if abs(self.speed) < self.max_speed:
             self.speed = self.speed + self.thrust_right
             self.speed = self.speed - self.thrust_left
@@ -618,22 +1677,61 @@ class Ship(FrameSprite):
     def release_thrust_right(self):
         self.thrust_right = 0
 
+    def apply_command(self, flags):
+        """
+        Sets the thrust from the key state in a two-player command.
+        """
+        self.thrust_left = self.acceleration if flags & COMMAND_LEFT else 0
+        self.thrust_right = self.acceleration if flags & COMMAND_RIGHT else 0
+        
+    def get_command(self):
+        """
+        Returns the key state, as a two-player command.
+        """
+        flags = 0
+        if self.thrust_left:
+            flags = flags | COMMAND_LEFT
+        if self.thrust_right:
+            flags = flags | COMMAND_RIGHT
+        return flags
+
     def apply_powerup(self, value):
+        if value >= 5:
+            self.powerups = self.powerups + 1
+            e_log.log(EVENT_POWERUP, value = value)
         if value == 5:
             self.mining_units = self.mining_units + 1
             self.total_mining_units = self.total_mining_units + 1
             s_store.play("new_mining_unit")
         elif value == 6:
             self.shield = min(self.shield + 25, 100)
+            e_log.log(EVENT_SHIELD, value = self.shield)
             s_store.play("shield_enhanced")
         elif value == 7:
             self.hull = min(self.hull + 25, 100)
+            e_log.log(EVENT_HULL, value = self.hull)
             s_store.play("hull_integrity_restored")
         
     def stop(self):
         self.thrust_left = 0
         self.thrust_right = 0
     
+    def get_state(self):
+        """
+        Returns the ship's state, for a snapshot (see state_struct).
+        """
+        return (self.rect.left, self.speed, self.shield, self.hull, self.score, self.mining_units, self.total_mining_units, self.collided)
+    
+    def set_state(self, state):
+        """
+        Restores the state returned by get_state(). The thrust is cleared, as
+        the keys may no longer be held down.
+        """
+        self.rect.left, self.speed, self.shield, self.hull, self.score, self.mining_units, self.total_mining_units, collided = state
+        self.collided = bool(collided)
+        self.visible = self.hull > 0
+        self.stop()
+    
 class Progressbar():
     """
     Draws a Progress Bar on-screen
@@ -651,6 +1749,88 @@ class Progressbar():
         self.rect.width = abs(int(self.value))
         target.fill(self.color, self.rect)
     
+class HudLayer(object):
+    """
+    The overlay, with the status fields composited onto it.
+    
+    Each field is a Label or a Progressbar which is given its own area of the
+    overlay. Its value is set with set(), and it is drawn onto the layer only
+    when the value changes: the overlay is restored under the field's area,
+    and the field is drawn within it.
+    
+    The fields all lie within the 'area' of the overlay, which must be
+    opaque, and are positioned relative to it. That area is cut out of the
+    overlay, so that the overlay never changes (and keeps its run-length
+    encoding, which redrawing a field would undo), and it is held as an
+    opaque surface of its own. Both are drawn each frame.
+    
+    When 'copy_on_write' is set, the area is copied before a field is redrawn,
+    if it has been drawn since the last copy. This is needed when the targets
+    hold on to the surfaces after they have been blitted (the recorded frames
+    of the threaded mode, and the textures of the texture renderer).
+    """
+    
+    def __init__(self, overlay, area, copy_on_write = False):
+        self.area = Rect(area)
+        self.copy_on_write = copy_on_write
+        self.shared = False
+        
+        # The overlay, with the area made transparent
+        self.overlay = overlay.copy()
+        colorkey = overlay.get_colorkey()
+        if colorkey is not None:
+            self.overlay.fill(colorkey, self.area)
+            self.overlay.set_colorkey(colorkey, RLEACCEL)
+        elif overlay.get_flags() & SRCALPHA:
+            self.overlay.fill((0, 0, 0, 0), self.area)
+            
+        # The area, with the fields drawn on it
+        self.background = overlay.subsurface(self.area).copy()
+        self.background.set_colorkey(None)
+        self.surface = self.background.copy()
+        self.fields = {}
+        self.values = {}
+        self.frames = 0
+        self.redraws = 0
+        
+    def add(self, name, widget, rect, value):
+        """
+        Adds a field which is drawn by the widget (a Label or a Progressbar)
+        within the rect, showing the initial value. The rect and the widget's
+        position are relative to the area.
+        """
+        self.fields[name] = (widget, Rect(rect).clip(self.surface.get_rect()))
+        self.values[name] = None
+        self.set(name, value)
+        
+    def set(self, name, value):
+        """
+        Sets the value of the named field, redrawing it if it has changed.
+        """
+        if value == self.values[name]:
+            return
+        self.values[name] = value
+        widget, rect = self.fields[name]
+        widget.update(value)
+        
+        if self.shared:
+            self.surface = self.surface.copy()
+            self.shared = False
+        self.surface.blit(self.background, rect, rect)
+        self.surface.set_clip(rect)
+        widget.draw(self.surface)
+        self.surface.set_clip(None)
+        self.redraws = self.redraws + 1
+        
+    def draw(self, target):
+        target.blit(self.overlay, (0, 0))
+        target.blit(self.surface, self.area)
+        self.shared = self.copy_on_write
+        self.frames = self.frames + 1
+        
+    def report(self):
+        return "HUD: %d frames, %d field redraws" % (self.frames, self.redraws)
+    
 class Hiscore(object):
     """
     Class for reading and maintaining the hi-score table.
@@ -710,11 +1890,104 @@ class Hiscore(object):
             return result
     
     def add(self, player, score):
+        """
+        Adds a score to the table, if it is high enough. Returns the entry, or
+        None if the score was not added.
+        """
         pos = self.position(score)
         if pos > -1:
-            self.scores[pos:pos] = [[score, player]]
+            entry = [score, player]
+            self.scores[pos:pos] = [entry]
             if len(self.scores) > 10:
                 self.scores.pop()
+            return entry
+        return None
+    
+    def remove(self, entry):
+        """
+        Removes an entry returned by add(), if it is still in the table.
+        """
+        for i in range(0, len(self.scores)):
+            if self.scores[i] is entry:
+                del self.scores[i]
+                break
+
+class WorldState(object):
+    """
+    The state of the world sent by the two-player host, as decoded by the
+    client (see Game.encode_world()). The asteroids and mines are held in
+    dictionaries keyed on their ids (and owner, for the mines).
+    """
+    
+    def __init__(self, time, mode):
+        self.time = time
+        self.mode = mode
+        self.ships = []
+        self.roids = {}
+        self.mines = {}
+        self.effects = []
+        
+class RenderState(object):
+    """
+    Everything needed to draw one frame, as recorded by the simulation thread
+    in the threaded mode: what is drawn on the world and on the HUD. Once
+    published, a RenderState is never changed.
+    """
+    
+    def __init__(self, step, update, size):
+        self.step = step
+        # The number of the update recorded, for the input latency
+        self.update = update
+        self.world = RecordingTarget(size)
+        self.hud = RecordingTarget(size)
+        # The screen effects drawn over the world (see ScreenEffects.frame())
+        self.effects = None
+
+class FrameTimes(object):
+    """
+    Records the intervals between frames (or simulation steps), for the rate
+    and the jitter (the standard deviation of the intervals).
+    """
+    
+    def __init__(self, name):
+        self.name = name
+        self.last = None
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.longest = 0.0
+        
+    def tick(self):
+        """
+        Records a frame, and returns the time since the last (or None for the
+        first).
+        """
+        current = time.time()
+        interval = None
+        if self.last is not None:
+            interval = current - self.last
+            self.count = self.count + 1
+            self.total = self.total + interval
+            self.squares = self.squares + interval * interval
+            self.longest = max(self.longest, interval)
+        self.last = current
+        return interval
+        
+    def rate(self):
+        if self.total == 0:
+            return 0.0
+        return self.count / self.total
+        
+    def jitter(self):
+        if self.count == 0:
+            return 0.0
+        mean = self.total / self.count
+        return max(self.squares / self.count - mean * mean, 0.0) ** 0.5
+        
+    def report(self):
+        if self.count == 0:
+            return "%s: none" % self.name
+        return "%s: %d, %.1f per second, %.2f ms apart on average, %.2f ms jitter, %.2f ms longest" % (self.name, self.count + 1, self.rate(), self.total * 1000.0 / self.count, self.jitter() * 1000.0, self.longest * 1000.0)
 
 class Game(object):
     """
@@ -734,23 +2007,223 @@ class Game(object):
     MODE_SCORE = 3  # Player is editing hi-score table
     MODE_OUTRO = 4  # 'Game Over' screen
     
+    mode_names = {MODE_INTRO: "intro", MODE_GAME: "game", MODE_SCORE: "score", MODE_OUTRO: "outro"}
+    
+    # The graphics and sounds which every scene needs, and those which each
+    # scene (mode) needs, as two lists of names. A scene's assets are loaded
+    # when the game switches to it, before its first frame, and unloaded once
+    # no scene needs them (see set_mode()). The game scene includes what the
+    # end of the game needs, so that the switch at the end is immediate.
+    common_assets = (["starfield_01a", "starfield_01b", "starfield_01c", "ship_01", "explosion_frames_01", "cloud_frames_01"], [])
+    scene_assets = {
+        MODE_INTRO: (["logo"], []),
+        MODE_GAME: (ASTEROID_IMAGES + ["miner_frames_01", "game_over_01"],
+                    ["explosion", "mining", "new_mining_unit", "shield_enhanced", "hull_integrity_restored",
+                     "hull_integrity_75", "hull_integrity_50", "hull_integrity_25", "game_over"]),
+        MODE_SCORE: (["game_over_01"], ["game_over"]),
+        MODE_OUTRO: (["game_over_01"], ["game_over"]),
+    }
+    
     player_name = ""
     
-    def __init__(self):
+    # The number of scheduled entities updated during the last game tick
+    entities_visited = 0
+    
+    # Explosions in 'chain reaction' mode will set off any free asteroids
+    # within this distance of their centre, after the delay (in milliseconds)
+    blast_radius = 96
+    blast_delay = 150
+    
+    # The number of pieces of debris thrown out by each explosion
+    debris_count = 6
+    
+    # The layout of a game snapshot: a header (magic, version, and the number
+    # of asteroids, mines and effects), the ship, the asteroids, mines and
+    # effects, and finally the state of the random number generator
+    snapshot_header = struct.Struct("<4sBHHH")
+    snapshot_random = struct.Struct("<625IBd")
+    snapshot_magic = b"JGSS"
+    snapshot_version = 1
+    
+    # Retrying after the game is over goes back this many snapshots
+    retry_depth = 4
+    
+    # In the two-player mode, the other player's ship (and on the host, its
+    # mines). Both games are limited to 'net_frame_rate', and the client shows
+    # the world 'interpolation_delay' milliseconds in the past, so that it can
+    # move things smoothly between the states sent by the host.
+    partner = None
+    partner_mines = None
+    net_frame_rate = 60
+    interpolation_delay = 100
+    
+    # The layout of the world state sent to the two-player client: a header
+    # (the host's time, mode, and the number of ships, asteroids, mines and
+    # effects), then the ships (the host's first), asteroids, mines and
+    # effects, each ordered by id
+    world_header = struct.Struct("<IBBHHH")
+    world_ship = struct.Struct("<hfhhIhhBB")
+    world_roid = struct.Struct("<HBhhHBB")
+    world_mine = struct.Struct("<HBhhBB")
+    world_effect = struct.Struct("<HBhhhhH")
+    
+    # The phases of the frame which the memory profiler reports on, as pairs
+    # of the name and the method (see MemoryProfiler.watch()). Phases include
+    # the allocations of any phases which they call.
+    memory_phases = [
+        ("update", "update"),
+        ("network", "update_network"),
+        ("game", "update_game"),
+        ("client", "update_client"),
+        ("scheduler", "scheduler.run"),
+        ("collisions", "check_collisions"),
+        ("effects", "effects.update"),
+        ("labels", "update_labels"),
+        ("draw", "draw"),
+        ("asteroids", "asteroids.draw"),
+        ("mines", "mines.draw"),
+        ("particles", "effects.draw"),
+        ("present", "renderer.present"),
+    ]
+    
+    def __init__(self, settings = None):
+        if settings is None:
+            settings = Settings()
+        self.settings = settings
+        
         logging.basicConfig(filename='jangam.log', format='%(asctime)s %(message)s', level=logging.INFO)
         
         os.environ['SDL_VIDEO_CENTERED'] = '1'
-        pygame.mixer.pre_init(frequency=22050, size=-16, channels=2, buffer=4096)
-        pygame.init()
-        
-        # Prepare the main display
-        self.display = pygame.display.set_mode((800, 800))
-        pygame.display.set_caption("Jangam")
+        if self.settings.headless:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+        self.timeline = StartupTimeline(self.settings.started)
+        self.timeline.mark("import")
+        if self.settings.eager_init:
+            pygame.mixer.pre_init(s_store.frequency, s_store.size, s_store.channels, s_store.buffer)
+            pygame.init()
+        else:
+            # Only the display (and the timer) are needed to get going. Fonts
+            # and sound are started when they are first used (see FontStore
+            # and SoundStore).
+            pygame.display.init()
+            pygame.time.wait(0)
+        
+        # Prepare the main display. Everything is drawn onto the targets
+        # provided by the render backend: the game world onto 'display', and
+        # the text and overlay onto 'hud'. Both use the game co-ordinates,
+        # whatever the size of the window.
+        self.renderer = create_renderer(self.settings.renderer, (800, 800), "Jangam",
+                                        render_scale = self.settings.render_scale,
+                                        window_size = self.settings.window_size,
+                                        fullscreen = self.settings.fullscreen,
+                                        scale_filter = self.settings.scale_filter)
+        self.display = self.renderer.target
+        self.hud = self.renderer.hud
+        logging.info("Using the %s renderer" % self.renderer.name)
         
         self.hiscores = Hiscore()
-        
-        g_store.load("graphics")
+        self.analytics = ScoreAnalytics()
+        if self.settings.analytics_file:
+            try:
+                self.analytics.read(self.settings.analytics_file)
+            except (IOError, ValueError, KeyError):
+                logging.exception("Unable to read the analytics from %s" % self.settings.analytics_file)
+                self.analytics = ScoreAnalytics()
+        # The score, duration and powerups of the game which has just ended.
+        # They are only added to the analytics when the next game starts (or
+        # the program closes), so that a retried game replaces them.
+        self.finished_game = None
+        self.game_started = time.time()
+        if self.settings.event_log:
+            try:
+                e_log.open(self.settings.event_log)
+            except (IOError, ValueError):
+                logging.exception("Unable to open the event log %s" % self.settings.event_log)
+        self.timeline.mark("init")
+        
+        g_store.load("graphics", self.renderer.convert_images)
+        
+        self.capture = None
+        if self.settings.capture:
+            self.capture = FrameCapture(self.settings.capture, self.settings.capture_format, self.settings.capture_ring)
         s_store.load("sounds")
+        if self.settings.eager_init:
+            g_store.preload()
+            s_store.preload()
+        
+        r_cache.steps = self.settings.rotation_steps
+        r_cache.max_bytes = self.settings.rotation_cache_kb * 1024
+        r_cache.clear()
+        if self.settings.rotation_prebuild:
+            r_cache.prebuild([g_store[name] for name in ASTEROID_IMAGES])
+            logging.info(r_cache.report())
+            
+        # The assets which every scene needs are held for as long as the game
+        # runs (and the asteroids too, if their rotated frames are prebuilt,
+        # which would otherwise be discarded with them)
+        self.mode = None
+        self.unload_assets = self.settings.unload_assets and not self.settings.eager_init
+        graphics, sounds = self.common_assets
+        if self.settings.rotation_prebuild:
+            graphics = graphics + ASTEROID_IMAGES
+        g_store.acquire(graphics)
+        s_store.acquire(sounds)
+        self.scene_memory = SceneMemory(self.mode_names)
+        
+        if self.settings.pixel_collisions:
+            self.collide = collide_pixels
+        else:
+            self.collide = collide_bounds
+        
+        self.snapshots = SnapshotRing(self.settings.snapshot_memory_kb * 1024)
+        self.snapshot_entry = None
+        self.snapshot_time = 0.0
+        self.restore_time = 0.0
+        self.restores = 0
+        
+        self.memory = None
+        
+        # The keyboard events, filtered and timestamped for the input latency
+        # (in the threaded mode, they are collected by the main thread for
+        # the simulation thread)
+        self.input = InputLayer()
+        self.frame_times = FrameTimes("Frames")
+        self.step_times = FrameTimes("Simulation steps")
+        
+        # The quality governor steps the level of detail (self.quality) down
+        # and up to hold the target frame rate (see set_quality())
+        self.quality = QUALITY_LEVELS[0]
+        self.governor = None
+        if self.settings.target_fps and not self.settings.memory_profile:
+            # A game limited to a lower rate can never reach the target, so
+            # aim for the limit instead
+            target_fps = self.settings.target_fps
+            if self.settings.net_host or self.settings.net_connect:
+                target_fps = min(target_fps, self.net_frame_rate)
+            elif self.settings.threaded and self.settings.sim_rate:
+                target_fps = min(target_fps, self.settings.sim_rate)
+            self.governor = QualityGovernor(target_fps)
+        self.frame_started = time.time()
+        
+        # The screen effects work on the surface which the world is drawn on,
+        # so their images are built for it now
+        self.screen_effects = None
+        world_surface = self.renderer.world_surface()
+        if self.settings.screen_effects and world_surface is not None:
+            self.screen_effects = ScreenEffects(Rect(SCREEN_LEFT, SCREEN_TOP, SCREEN_RIGHT - SCREEN_LEFT, SCREEN_BOTTOM - SCREEN_TOP))
+            self.screen_effects.prepare(world_surface[0], world_surface[1])
+        
+        self.network = None
+        self.net_client = False
+        if self.settings.net_host:
+            self.network = NetHost(self.settings.net_host, self.settings.net_latency, self.settings.net_loss)
+            logging.info("Hosting a two-player game on port %d" % self.network.link.port)
+        elif self.settings.net_connect:
+            self.network = NetClient(self.settings.net_connect, self.settings.net_latency, self.settings.net_loss)
+            self.net_client = True
+            logging.info("Joining the two-player game at %s:%d" % self.settings.net_connect)
+        self.timeline.mark("assets")
 
     # --------------------------------------------------------------------------
     
@@ -759,81 +2232,170 @@ class Game(object):
         Creates and initialises the various game components.
         """
         self.running = True
+        self.input.start()
         
         # Prepare the animations
         self.scrollers = []
         self.scrollers.append(ParallaxScroller(g_store["starfield_01a"], 0, 0, 0.1))
         self.scrollers.append(ParallaxScroller(g_store["starfield_01b"], 0, 0, 0.2))
         self.scrollers.append(ParallaxScroller(g_store["starfield_01c"], 0, 0, 0.3))
-        self.next_update_time = 0
+        
+        # The background scrolls in every mode, so it is given its own
+        # scheduler, separate from the one that runs the main game.
+        self.background_scheduler = Scheduler()
+        self.background_scheduler.schedule(0, self.on_scroll_due)
+        
+        # Prepare the scheduler for the timed events in the main game
+        self.scheduler = Scheduler()
         
         # Prepare the player's ship
         self.ship = Ship(400 - 32, SHIP_Y, pygame.Rect(0, SHIP_Y, 800 - 64, 64))
 
-        self.explosions = Explosions()
-        
-        self.mines = MineController(self.ship)
+        # Prepare the visual effects
+        self.effects = ParticleEngine()
+        self.effects.register("explosion", ParticleEffect(g_store["explosion_frames_01"], 10))
+        self.effects.register("dust", ParticleEffect(g_store["cloud_frames_01"], 10, True))
+        self.effects.register("debris", ParticleEffect(pygame.transform.smoothscale(with_alpha(g_store["asteroid_01"]), (12, 12)), 10, lifetime = 600))
+        
+        self.mines = MineController(self.ship, self.scheduler, self.effects)
+        
+        if self.network:
+            # The other player's ship. On the host, it is moved by the commands
+            # from the client; on the client, it shows the host's ship.
+            self.partner = Ship(400 - 32, SHIP_Y, pygame.Rect(0, SHIP_Y, 800 - 64, 64))
+            self.partner_joined = False
+            self.net_states = 0
+            self.net_roids = 0
+            if self.net_client:
+                self.launch_requested = False
+                self.host_offset = None
+            else:
+                self.partner_mines = MineController(self.partner, self.scheduler, self.effects)
+                self.background_scheduler.schedule(0, self.on_network_due)
         
         # Prepare the asteroids
-        self.asteroids = Asteroids()
-        
-        # Prepare the UI screen
-        self.overlay = g_store["screen_01"]
-        
-        # Prepare the status bars
-        self.score_label  = Label("%d" % self.ship.score, SPEEDBAR_X, SPEEDBAR_Y)
-        self.mine_label   = Label("%d" % self.ship.mining_units, SPEEDBAR_X, SPEEDBAR_Y + 16)
-        self.hull_label   = Label("%d %%" % self.ship.hull, SPEEDBAR_X, SPEEDBAR_Y + 32)
-        self.shield_label = Label("%d" % self.ship.shield, SPEEDBAR_X, SPEEDBAR_Y + 48)
+        self.asteroids = Asteroids(self.scheduler)
+        
+        # Prepare the UI screen, and the status fields and bars on it
+        copy_on_write = self.settings.threaded or self.renderer.retains_images
+        self.hud_layer = HudLayer(g_store["screen_01"], STATUS_AREA, copy_on_write)
+        x = SPEEDBAR_X - STATUS_AREA.left
+        bar_x = STATUS_BAR_X - STATUS_AREA.left
+        y = SPEEDBAR_Y - STATUS_AREA.top
+        self.hud_layer.add("score", Label("", x, y), (x, y, STATUS_WIDTH, 16), "%d" % self.ship.score)
+        for name in ["mining", "hull", "shield"]:
+            y = y + 16
+            self.hud_layer.add(name, Label("", x, y), (x, y, STATUS_VALUE_WIDTH, 16), "")
+            bar = Progressbar(Rect(bar_x, y + 5, 0, 6), STATUS_BAR_COLOURS[name])
+            self.hud_layer.add(name + "_bar", bar, (bar_x, y + 5, STATUS_BAR_WIDTH, 6), 0)
         
         self.large_score_label = Label("Score: %d" % self.ship.score, 200, 32)
-        self.large_score_label.set_font(os.path.join("graphics", "04B_03.ttf"), 48)
+        self.large_score_label.set_font(os.path.join("graphics", "04B_03.TTF"), 48)
+        self.update_labels()
         
         self.hiscore_edit = Label("Enter your name: _", 200, 420)
-        self.hiscore_edit.set_font(os.path.join("graphics", "04B_03.ttf"), 32)
+        self.hiscore_edit.set_font(os.path.join("graphics", "04B_03.TTF"), 32)
 
         self.hiscore_title = Label("High Scores", 300, 260, pygame.color.Color('#990000'))
-        self.hiscore_title.set_font(os.path.join("graphics", "04B_03.ttf"), 32)
+        self.hiscore_title.set_font(os.path.join("graphics", "04B_03.TTF"), 32)
         
         self.hiscore_labels = []
         for i in range(0, 10):
             y = 320 + (i * 32)
             player_label = Label("", 248, y)
             score_label  = Label("", 544, y)
-            player_label.set_font(os.path.join("graphics", "04B_03.ttf"), 32)
-            score_label.set_font(os.path.join("graphics", "04B_03.ttf"), 32)
+            player_label.set_font(os.path.join("graphics", "04B_03.TTF"), 32)
+            score_label.set_font(os.path.join("graphics", "04B_03.TTF"), 32)
             self.hiscore_labels.append([player_label, score_label])
 
         self.replay_label = Label("Press SPACE to play again, or ESC to exit", 232, 672, pygame.color.Color('#ffffff'))
-        
-        self.logo = g_store["logo"]
-        
-        self.end = g_store["game_over_01"]
+        self.rank_label = Label("", 0, 648, pygame.color.Color('#ffffff'))
         
         self.reset()
         
+        if self.settings.resume:
+            self.resume()
+        
     # --------------------------------------------------------------------------
 
     def reset(self):
         """
         Resets the game to its starting parameters
         """
-        self.ship.collided = False
-        self.ship.shield = 0
-        self.ship.hull = 100
-        self.ship.score = 0
-        self.ship.mining_units = 1
-        self.ship.total_mining_units = 1
-        self.ship.speed = 0
-        self.ship.thrust_left = 0
-        self.ship.thrust_right = 0
-        self.ship.rect.x = 400 - 32
-        
-        self.explosions.clear()
+        # The hi-score entry made for this game, which is replaced if the game
+        # is retried and ends again
+        self.hiscore_entry = None
+        if self.network:
+            # Start the two ships apart, with the host's on the left
+            if self.net_client:
+                self.reset_ship(self.ship, 400 - 32 + 128)
+                self.reset_ship(self.partner, 400 - 32 - 128)
+            else:
+                self.reset_ship(self.ship, 400 - 32 - 128)
+                self.reset_ship(self.partner, 400 - 32 + 128)
+            self.partner.visible = self.net_client or self.partner_joined
+            self.world_states = []
+            self.remote_roids = {}
+            self.remote_mines = {}
+            self.remote_mining = []
+        else:
+            self.reset_ship(self.ship, 400 - 32)
+        
+        self.effects.clear()
         self.mines.clear()
+        if self.partner_mines:
+            self.partner_mines.clear()
         self.asteroids.clear()
+        self.scheduler.clear()
+        if self.screen_effects:
+            self.screen_effects.clear()
+        
+        self.set_mode(self.MODE_INTRO)
+        
+    # --------------------------------------------------------------------------
+
+    def set_mode(self, mode, new_game = True):
+        """
+        Switches to another scene (mode). The graphics and sounds which it
+        needs are loaded first (see scene_assets), and those which no scene
+        needs any more are unloaded afterwards.
+        
+        Switching to the game starts a new one unless 'new_game' is False, as
+        it is when a snapshot is restored to carry on with an earlier game.
+        """
+        if mode == self.mode:
+            return
+        if mode == self.MODE_GAME and new_game:
+            self.save_game()
+            self.game_started = time.time()
+            e_log.new_game()
+        graphics, sounds = self.scene_assets[mode]
+        g_store.acquire(graphics)
+        s_store.acquire(sounds)
+        if self.mode is not None:
+            graphics, sounds = self.scene_assets[self.mode]
+            g_store.release(graphics)
+            s_store.release(sounds)
+        self.mode = mode
+        if self.unload_assets:
+            unloaded = g_store.sweep() + s_store.sweep()
+            logging.info("Scene: %s, %d assets unloaded; %.1f MB of graphics and %.1f MB of sounds loaded" % (self.mode_names[mode], unloaded, g_store.resident_bytes() / 1048576.0, s_store.resident_bytes() / 1048576.0))
         
-        self.mode = self.MODE_INTRO
+    # --------------------------------------------------------------------------
+
+    def reset_ship(self, ship, x):
+        ship.collided = False
+        ship.shield = 0
+        ship.hull = 100
+        ship.score = 0
+        ship.mining_units = 1
+        ship.total_mining_units = 1
+        ship.powerups = 0
+        ship.speed = 0
+        ship.thrust_left = 0
+        ship.thrust_right = 0
+        ship.rect.x = x
+        ship.visible = True
         
     # --------------------------------------------------------------------------
 
@@ -846,17 +2408,22 @@ class Game(object):
                 self.ship.apply_thrust_right()
                     
             if key == K_UP:
-                if self.ship.mining_units > 0:
-                    position = Rect(self.ship.rect)
-                    self.mines.launch(position)
+                if self.net_client:
+                    # The host launches the mine
+                    self.launch_requested = True
+                elif self.ship.mining_units > 0 and self.ship.visible:
+                    self.mines.launch(self.ship.rect)
+                    
+            if key == K_BACKSPACE and not self.network:
+                self.rewind(pygame.time.get_ticks())
                     
         elif self.mode == self.MODE_SCORE:
             if key == K_BACKSPACE and self.player_name <> "":
                 self.player_name = self.player_name[:-2]
             elif key == K_RETURN:
-                self.hiscores.add(self.player_name, self.ship.score)
+                self.hiscore_entry = self.hiscores.add(self.player_name, self.ship.score)
                 self.hiscores.write()
-                self.mode = self.MODE_OUTRO
+                self.set_mode(self.MODE_OUTRO)
                 self.prepare_outro()
             # If the user presses a valid character key
             elif key >= 32 and key <= 126:
@@ -884,34 +2451,257 @@ class Game(object):
         Main routine for updating the game.
         """
         current_time = pygame.time.get_ticks()
+        e_log.time = current_time
+        
+        # Exchange commands and states with the other player
+        if self.network:
+            self.update_network(current_time)
 
         # Always update the scrolling background animations
-        if self.next_update_time < current_time:
-            for scroller in self.scrollers:
-                scroller.update()
-            self.next_update_time = current_time + 10
+        self.background_scheduler.run(current_time)
+        self.entities_visited = self.background_scheduler.visited
 
         # Call the mode-specific update routine
         if self.mode == self.MODE_INTRO:
             self.update_intro(current_time)
         elif self.mode == self.MODE_GAME:
-            self.update_game(current_time)
+            if self.net_client:
+                self.update_client(current_time)
+            else:
+                self.update_game(current_time)
         elif self.mode == self.MODE_SCORE:
             self.update_score(current_time)
         elif self.mode == self.MODE_OUTRO:
             self.update_outro(current_time)
+            
+        # The client keeps sending (empty) commands outside the game, so that
+        # the host knows it is there
+        if self.net_client and self.mode != self.MODE_GAME:
+            self.network.send_command(0)
 
     # --------------------------------------------------------------------------
 
+    def explode(self, rect, current_time):
+        """
+        Shows an explosion (with flying debris) over the specified rect. In
+        'chain reaction' mode, this will also set off any nearby asteroids.
+        """
+        self.effects.emit("explosion", rect.left, rect.top)
+        for i in range(0, self.debris_count):
+            dx = random.uniform(-0.15, 0.15)
+            dy = random.uniform(-0.15, 0.15)
+            self.effects.emit("debris", rect.centerx - 6, rect.centery - 6, dx, dy)
+            
+        if self.settings.chain_reaction:
+            x, y = rect.center
+            for roid in self.asteroids.roids:
+                if not roid.being_mined:
+                    distance_x = roid.rect.centerx - x
+                    distance_y = roid.rect.centery - y
+                    if (distance_x * distance_x) + (distance_y * distance_y) <= self.blast_radius * self.blast_radius:
+                        self.scheduler.schedule(current_time + self.blast_delay, lambda due_time, roid = roid: self.on_blast_due(roid, due_time))
+                        
+    # --------------------------------------------------------------------------
+
+    def on_blast_due(self, roid, current_time):
+        """
+        Scheduler callback, which sets off an asteroid caught in an earlier
+        explosion (unless something else has already destroyed it).
+        """
+        if roid.alive() and not roid.being_mined:
+            roid.kill()
+            s_store.play("explosion")
+            self.explode(roid.rect, current_time)
+
+    # --------------------------------------------------------------------------
+
+    def take_snapshot(self, current_time):
+        """
+        Returns a compact binary snapshot of the game world: the ship, the
+        asteroids, mines and effects, and the random number generator. Times
+        are stored relative to 'current_time', so that the snapshot can be
+        restored at any later time. Pending chain-reaction blasts are not
+        included.
+        """
+        roids = list(self.asteroids.roids)
+        mines = list(self.mines.mines)
+        effects = self.effects.get_state(current_time)
+        parts = [self.snapshot_header.pack(self.snapshot_magic, self.snapshot_version, len(roids), len(mines), len(effects))]
+        parts.append(Ship.state_struct.pack(*self.ship.get_state()))
+        for roid in roids:
+            parts.append(Asteroid.state_struct.pack(*roid.get_state(current_time)))
+        index = dict([(roid, i) for i, roid in enumerate(roids)])
+        for mine in mines:
+            parts.append(Mine.state_struct.pack(*mine.get_state(current_time, index)))
+        for effect in effects:
+            parts.append(ParticleEngine.state_struct.pack(*effect))
+        version, internal, gauss_next = random.getstate()
+        parts.append(self.snapshot_random.pack(*(internal + (gauss_next is not None, gauss_next or 0.0))))
+        return b"".join(parts)
+    
+    # --------------------------------------------------------------------------
+
+    def restore_snapshot(self, snapshot, current_time):
+        """
+        Replaces the game world with the one in a snapshot from
+        take_snapshot(), and continues the game from there.
+        """
+        start = time.time()
+        magic, version, roid_count, mine_count, effect_count = self.snapshot_header.unpack_from(snapshot, 0)
+        if magic != self.snapshot_magic or version != self.snapshot_version:
+            raise ValueError("Not a Jangam snapshot")
+        offset = self.snapshot_header.size
+        self.set_mode(self.MODE_GAME, new_game = False)
+        
+        s_store["mining"].stop()
+        self.effects.clear()
+        self.mines.clear()
+        self.asteroids.clear()
+        self.scheduler.clear()
+        self.effects.current_time = current_time
+        
+        ship_state = Ship.state_struct.unpack_from(snapshot, offset)
+        offset = offset + Ship.state_struct.size
+        
+        roids = []
+        for i in range(0, roid_count):
+            state = Asteroid.state_struct.unpack_from(snapshot, offset)
+            offset = offset + Asteroid.state_struct.size
+            roid = Asteroid(state[0], self.asteroids.on_roid_die)
+            roid.set_state(state, current_time)
+            self.asteroids.add(roid)
+            roids.append(roid)
+            
+        for i in range(0, mine_count):
+            state = Mine.state_struct.unpack_from(snapshot, offset)
+            offset = offset + Mine.state_struct.size
+            mine = Mine(self.ship, self.mines.on_mine_remove, self.effects)
+            mine.set_state(state, current_time, roids)
+            self.mines.add(mine)
+            
+        effects = []
+        for i in range(0, effect_count):
+            effects.append(ParticleEngine.state_struct.unpack_from(snapshot, offset))
+            offset = offset + ParticleEngine.state_struct.size
+        self.effects.set_state(effects, current_time)
+        
+        state = self.snapshot_random.unpack_from(snapshot, offset)
+        if state[625]:
+            gauss_next = state[626]
+        else:
+            gauss_next = None
+        random.setstate((3, tuple(state[0:625]), gauss_next))
+        
+        # Creating the mines will have used up the ship's mining units, so
+        # the ship is restored last. Its thrust is cleared, so it is put back
+        # for the keys which are still held down.
+        self.ship.set_state(ship_state)
+        if self.input.is_held(K_LEFT):
+            self.ship.apply_thrust_left()
+        if self.input.is_held(K_RIGHT):
+            self.ship.apply_thrust_right()
+        if self.screen_effects:
+            self.screen_effects.clear()
+        
+        self.schedule_snapshot(current_time + self.settings.snapshot_interval)
+        self.restore_time = self.restore_time + (time.time() - start)
+        self.restores = self.restores + 1
+        
+    # --------------------------------------------------------------------------
+
+    def schedule_snapshot(self, due_time):
+        self.scheduler.cancel(self.snapshot_entry)
+        self.snapshot_entry = self.scheduler.schedule(due_time, self.on_snapshot_due)
+        
+    # --------------------------------------------------------------------------
+
+    def on_snapshot_due(self, current_time):
+        """
+        Scheduler callback which adds a snapshot of the game to the ring, and
+        saves it in case the game crashes.
+        """
+        start = time.time()
+        snapshot = self.take_snapshot(current_time)
+        self.snapshots.push(snapshot)
+        if self.settings.snapshot_file:
+            try:
+                f = open(self.settings.snapshot_file, "wb")
+                f.write(snapshot)
+                f.close()
+            except IOError:
+                logging.exception("Unable to save the snapshot")
+        self.snapshot_time = self.snapshot_time + (time.time() - start)
+        self.snapshot_entry = self.scheduler.schedule(current_time + self.settings.snapshot_interval, self.on_snapshot_due)
+        
+    # --------------------------------------------------------------------------
+
+    def rewind(self, current_time):
+        """
+        Goes back to the snapshot before the latest one. Each call goes back
+        further, until the oldest snapshot in the ring is reached.
+        """
+        if len(self.snapshots) > 0:
+            self.restore_snapshot(self.snapshots.truncate(max(-2, -len(self.snapshots))), current_time)
+            
+    # --------------------------------------------------------------------------
+
+    def retry(self, current_time):
+        """
+        Continues a finished game from a few seconds before the end.
+        """
+        if len(self.snapshots) > 0:
+            self.restore_snapshot(self.snapshots.truncate(max(-self.retry_depth, -len(self.snapshots))), current_time)
+            
+    # --------------------------------------------------------------------------
+
+    def resume(self):
+        """
+        Resumes the game from the snapshot file, if there is one (it is only
+        left behind if the game crashed).
+        """
+        if not (self.settings.snapshot_file and os.path.exists(self.settings.snapshot_file)):
+            return
+        try:
+            f = open(self.settings.snapshot_file, "rb")
+            snapshot = f.read()
+            f.close()
+            self.restore_snapshot(snapshot, pygame.time.get_ticks())
+            self.snapshots.push(snapshot)
+            logging.info("Resumed from %s" % self.settings.snapshot_file)
+        except (IOError, ValueError, struct.error):
+            logging.exception("Unable to resume from %s" % self.settings.snapshot_file)
+            self.reset()
+            
+    # --------------------------------------------------------------------------
+
+    def discard_snapshot_file(self):
+        if self.settings.snapshot_file and os.path.exists(self.settings.snapshot_file):
+            os.remove(self.settings.snapshot_file)
+            
+    # --------------------------------------------------------------------------
+
+    def on_scroll_due(self, current_time):
+        """
+        Scheduler callback which moves the scrolling background.
+        """
+        for scroller in self.scrollers:
+            scroller.update()
+        self.background_scheduler.schedule(current_time + 10, self.on_scroll_due)
+        
+    # --------------------------------------------------------------------------
+
     def update_intro(self, current_time):
         """
         Updates the intro scene
         """
-        for event in pygame.event.get():
+        for event in self.input.events():
             if event.type == QUIT or (event.type == KEYUP and event.key == K_ESCAPE):
                 self.running = False
-            elif (event.type == KEYDOWN) and (event.key == K_SPACE):
-                self.mode = self.MODE_GAME
+            elif (event.type == KEYDOWN) and (event.key == K_SPACE) and not self.net_client:
+                self.set_mode(self.MODE_GAME)
+                if not self.network:
+                    self.snapshots.clear()
+                    self.schedule_snapshot(current_time)
             
     # --------------------------------------------------------------------------
 
@@ -921,16 +2711,14 @@ class Game(object):
         """
         # Update the ship position
         self.ship.update(current_time)
+        if self.partner:
+            # The partner's ship is moved by the commands from the client
+            self.partner.animate(current_time)
 
-        self.score_label.text  = "%d" % self.ship.score
-        self.mine_label.text   = "%d" % self.ship.mining_units
-        self.hull_label.text   = "%d %%" % self.ship.hull
-        self.shield_label.text = "%d" % self.ship.shield
-        
-        self.large_score_label.text = "Score: %d" % self.ship.score
+        self.update_labels()
 
         # Possibly add a new asteroid
-        if random.randint(0, 100) > 50 and len(self.asteroids.roids) < self.asteroids.max_asteroids:
+        if random.randint(0, 100) > 50 and len(self.asteroids.roids) < int(self.asteroids.max_asteroids * self.quality.asteroids):
             # Most asteroids have the default value of 1, but there is a 20% chance
             # that it will be a more valuable one.
             if random.randint(1, 100) > 80:
@@ -955,84 +2743,402 @@ class Game(object):
                 else:
                     # No power-ups available. Revert to a standard asteroid
                     value = 1
-            self.asteroids.roids.add(Asteroid(value, self.asteroids.on_roid_die))
+            roid = Asteroid(value, self.asteroids.on_roid_die)
+            self.asteroids.add(roid)
+            e_log.log(EVENT_SPAWN, roid.rect.x, roid.rect.y, value)
+        
+        # Update the asteroids, mines and explosions which are due for
+        # animation or movement
+        self.scheduler.run(current_time)
+        self.entities_visited = self.entities_visited + self.scheduler.visited
+
+        # Check for collisions with asteroids. The game is over once every
+        # ship has been destroyed.
+        for ship in self.ships():
+            self.check_collisions(ship, current_time)
+        if not [ship for ship in self.ships() if ship.visible]:
+            self.end_game()
+
+        # Check for hitting asteroids with a miner
+        for controller in [self.mines, self.partner_mines]:
+            if controller is None:
+                continue
+            for mine in controller.mines:
+                collision = self.asteroids.roids.collide(mine, self.collide)
+                for roid in collision:
+                    if mine.is_mining and not roid.being_mined:
+                        s_store["mining"].stop()
+                        s_store.play("explosion")
+                        self.explode(mine.rect, current_time)
+                        mine.remove(True)
+                    elif not mine.is_mining:
+                        roid.being_mined = True
+                        mine.rect.left = roid.rect.left + 20
+                        mine.rect.top  = roid.rect.top + roid.rect.height - 8
+                        mine.asteroid = roid
+                        s_store.play("mining", 2)
+                        mine.start_mining()
+                        e_log.log(EVENT_MINING_START, mine.rect.x, mine.rect.y, roid.value)
+        
+        self.effects.update(current_time)
+        
+
+        # Handle the pygame events
+        for event in self.input.events():
+            if event.type == QUIT or (event.type == KEYUP and event.key == K_ESCAPE):
+                self.running = False
+            elif (event.type == KEYDOWN):
+                self.on_keydown(event.key)
+            elif (event.type == KEYUP):
+                self.on_keyup(event.key)
+
+        if self.ship.mining_units == self.ship.total_mining_units:
+            s_store["mining"].stop()
+            
+    # --------------------------------------------------------------------------
+
+    def update_labels(self):
+        ship = self.ship
+        hud = self.hud_layer
+        hud.set("score", "%d" % ship.score)
+        hud.set("mining", "%d" % ship.mining_units)
+        hud.set("hull", "%d %%" % ship.hull)
+        hud.set("shield", "%d" % ship.shield)
+        hud.set("mining_bar", STATUS_BAR_WIDTH * ship.mining_units // max(ship.total_mining_units, 1))
+        hud.set("hull_bar", STATUS_BAR_WIDTH * max(ship.hull, 0) // 100)
+        hud.set("shield_bar", STATUS_BAR_WIDTH * max(ship.shield, 0) // 100)
         
-        # Update the asteroid positions
-        self.asteroids.update(current_time)
+        self.large_score_label.text = "Score: %d" % self.ship.score
         
-        self.mines.update(current_time)
+    # --------------------------------------------------------------------------
+
+    def ships(self):
+        """
+        Returns the ships in play (the partner's is only included in the
+        two-player mode).
+        """
+        if self.partner:
+            return [self.ship, self.partner]
+        return [self.ship]
+    
+    # --------------------------------------------------------------------------
 
-        # Check for collisions with asteroids
-        collision = pygame.sprite.spritecollide(self.ship, self.asteroids.roids, True)
+    def check_collisions(self, ship, current_time):
+        """
+        Checks whether the ship has been hit by an asteroid, and applies the
+        damage. A ship with no hull left is hidden, and takes no further part.
+        """
+        if not ship.visible:
+            return
+        collision = self.asteroids.roids.collide(ship, self.collide, True)
         if collision:
             # Show explosion
-            self.ship.collided = True
-            self.explosions.add(collision[0].rect)
+            ship.collided = True
+            self.explode(collision[0].rect, current_time)
             s_store.play("explosion")
+            e_log.log(EVENT_COLLISION, collision[0].rect.x, collision[0].rect.y, collision[0].value)
             # If the ship has shields, reduce them...
-            if self.ship.shield > 0:
-                self.ship.shield = max(self.ship.shield - 25, 0)
+            if ship.shield > 0:
+                ship.shield = max(ship.shield - 25, 0)
+                e_log.log(EVENT_SHIELD, value = ship.shield)
             else:
                 # ...otherwise apply the damage directly to the hull
-                self.ship.hull = self.ship.hull - 25
+                ship.hull = ship.hull - 25
+                e_log.log(EVENT_HULL, value = max(ship.hull, 0))
                 # Announce the new hull status
                 """
-                if self.ship.hull == 75:
+                if ship.hull == 75:
                     s_store.play("hull_integrity_75")
-                elif self.ship.hull == 50:
+                elif ship.hull == 50:
                     s_store.play("hull_integrity_50")
-                elif self.ship.hull == 25:
+                elif ship.hull == 25:
                     s_store.play("hull_integrity_25")
                 """
-                if self.ship.hull <= 0:
-                    self.ship.hull = 0
-                    if self.hiscores.position(self.ship.score) <> -1:
-                        self.mode = self.MODE_SCORE
-                    else:
-                        self.prepare_outro()
-                        self.mode = self.MODE_OUTRO
-                    pygame.mixer.stop()
-                    s_store.play("game_over")
+                if ship.hull <= 0:
+                    ship.hull = 0
+                    ship.visible = False
+                    
+    # --------------------------------------------------------------------------
 
-        # Check for hitting asteroids with a miner
-        for mine in self.mines.mines:
-            collision = pygame.sprite.spritecollide(mine, self.asteroids.roids, False)
-            for roid in collision:
-                if mine.is_mining and not roid.being_mined:
-                    s_store["mining"].stop()
-                    s_store.play("explosion")
-                    self.explosions.add(mine.rect)
-                    mine.remove(True)
-                elif not mine.is_mining:
-                    roid.being_mined = True
-                    mine.rect.left = roid.rect.left + 20
-                    mine.rect.top  = roid.rect.top + roid.rect.height - 8
-                    mine.asteroid = roid
-                    s_store.play("mining", 2)
-                    mine.start_mining()
-        
-        self.explosions.update(current_time)
+    def end_game(self):
+        """
+        Ends the game, moving on to the hi-score table.
+        """
+        if self.hiscore_entry is not None:
+            # A retried game only keeps the score it ends with
+            self.hiscores.remove(self.hiscore_entry)
+            self.hiscores.write()
+            self.hiscore_entry = None
+        if self.hiscores.position(self.ship.score) <> -1:
+            self.set_mode(self.MODE_SCORE)
+        else:
+            self.prepare_outro()
+            self.set_mode(self.MODE_OUTRO)
+        s_store.stop()
+        s_store.play("game_over")
+        self.discard_snapshot_file()
+        e_log.log(EVENT_GAME_OVER, value = self.ship.score)
+        self.record_game()
+        
+    # --------------------------------------------------------------------------
+
+    def record_game(self):
+        """
+        Keeps the game which has just ended for the analytics (replacing it,
+        if it was retried), and shows how its score compares with every game
+        before it.
+        """
+        ship = self.ship
+        if len(self.analytics):
+            self.rank_label.text = "You beat %d%% of all games" % int(self.analytics.score_rank(ship.score) * 100)
+            self.rank_label.x = 400 - self.rank_label.image.get_width() // 2
+        else:
+            self.rank_label.text = ""
+        self.finished_game = (ship.score, time.time() - self.game_started, ship.powerups)
+        
+    # --------------------------------------------------------------------------
+
+    def save_game(self):
+        """
+        Adds the game kept by record_game() to the analytics, once it can no
+        longer be retried.
+        """
+        if self.finished_game is None:
+            return
+        self.analytics.add(*self.finished_game)
+        self.finished_game = None
+        if self.settings.analytics_file:
+            try:
+                self.analytics.write(self.settings.analytics_file)
+            except IOError:
+                logging.exception("Unable to write the analytics to %s" % self.settings.analytics_file)
+        
+    # --------------------------------------------------------------------------
+
+    def update_network(self, current_time):
+        """
+        Handles the packets from the other player: on the host, the commands
+        for the partner's ship; on the client, the states of the world.
+        """
+        if self.net_client:
+            for data in self.network.poll():
+                self.receive_world(self.decode_world(data), current_time)
+            return
+        for flags in self.network.poll():
+            if self.mode == self.MODE_GAME and self.partner.visible:
+                self.partner.apply_command(flags)
+                self.partner.move()
+                if flags & COMMAND_LAUNCH and self.partner.mining_units > 0:
+                    self.partner_mines.launch(self.partner.rect)
+        if self.network.client and not self.partner_joined:
+            logging.info("Player two joined from %s:%d" % self.network.client)
+            self.partner_joined = True
+            self.partner.visible = True
+            
+    # --------------------------------------------------------------------------
+
+    def on_network_due(self, current_time):
+        """
+        Scheduler callback which sends the state of the world to the client.
+        """
+        self.network.send_state(self.encode_world(current_time))
+        self.net_states = self.net_states + 1
+        self.net_roids = self.net_roids + len(self.asteroids.roids)
+        self.background_scheduler.schedule(current_time + 1000 // self.settings.net_rate, self.on_network_due)
+        
+    # --------------------------------------------------------------------------
+
+    def encode_world(self, current_time):
+        """
+        Returns the state of the world, for the two-player client. Unlike a
+        snapshot, this only holds what the client needs to show the world, and
+        everything is identified, so that the client can follow it from one
+        state to the next.
+        """
+        ships = self.ships()
+        roids = sorted(self.asteroids.roids, key = lambda roid: roid.net_id)
+        mines = [(0, mine.net_id, mine) for mine in self.mines.mines]
+        if self.partner_mines:
+            mines.extend([(1, mine.net_id, mine) for mine in self.partner_mines.mines])
+        mines.sort()
+        effects = self.effects.get_effects(current_time)
+        parts = [self.world_header.pack(current_time & 0xffffffff, self.mode, len(ships), len(roids), len(mines), len(effects))]
+        for ship in ships:
+            parts.append(self.world_ship.pack(*(ship.get_state() + (ship.visible,))))
+        for roid in roids:
+            parts.append(self.world_roid.pack(roid.net_id, roid.value, roid.rect.left, roid.rect.top, int(roid.angle * 65536 / 360) & 0xffff, roid.animation.image_index, roid.being_mined))
+        for owner, mine_id, mine in mines:
+            parts.append(self.world_mine.pack(mine_id, owner, mine.rect.left, mine.rect.top, mine.is_mining, mine.animation.image_index))
+        for effect in effects:
+            parts.append(self.world_effect.pack(*effect))
+        return b"".join(parts)
     
-        # Handle the pygame events
-        for event in pygame.event.get():
+    # --------------------------------------------------------------------------
+
+    def decode_world(self, data):
+        """
+        Returns the WorldState for a state from encode_world().
+        """
+        host_time, mode, ship_count, roid_count, mine_count, effect_count = self.world_header.unpack_from(data, 0)
+        world = WorldState(host_time, mode)
+        offset = self.world_header.size
+        for i in range(0, ship_count):
+            world.ships.append(self.world_ship.unpack_from(data, offset))
+            offset = offset + self.world_ship.size
+        for i in range(0, roid_count):
+            roid = self.world_roid.unpack_from(data, offset)
+            world.roids[roid[0]] = roid
+            offset = offset + self.world_roid.size
+        for i in range(0, mine_count):
+            mine = self.world_mine.unpack_from(data, offset)
+            world.mines[(mine[1], mine[0])] = mine
+            offset = offset + self.world_mine.size
+        for i in range(0, effect_count):
+            world.effects.append(self.world_effect.unpack_from(data, offset))
+            offset = offset + self.world_effect.size
+        return world
+    
+    # --------------------------------------------------------------------------
+
+    def receive_world(self, world, current_time):
+        """
+        Handles a new state from the two-player host: follows the host into
+        and out of the game, and corrects the position of the player's ship.
+        """
+        # Estimate the host's clock (less the time the state took to arrive),
+        # smoothing out the jitter
+        offset = world.time - current_time
+        if self.host_offset is None or abs(offset - self.host_offset) > 1000:
+            self.host_offset = offset
+        else:
+            self.host_offset = self.host_offset + (offset - self.host_offset) / 10.0
+            
+        if world.mode == self.MODE_GAME and self.mode in [self.MODE_INTRO, self.MODE_OUTRO]:
+            self.reset()
+            self.set_mode(self.MODE_GAME)
+        elif world.mode != self.MODE_GAME and self.mode == self.MODE_GAME:
+            self.end_game()
+            
+        self.world_states.append(world)
+        if len(self.world_states) > 16:
+            self.world_states.pop(0)
+            
+        if self.mode == self.MODE_GAME and len(world.ships) > 1:
+            # The host's position for the ship is from the last command which
+            # it applied, so re-apply the later ones (client-side prediction)
+            thrust_left = self.ship.thrust_left
+            thrust_right = self.ship.thrust_right
+            self.ship.set_state(world.ships[1][0:8])
+            self.ship.visible = bool(world.ships[1][8])
+            for flags in self.network.pending():
+                self.ship.apply_command(flags)
+                self.ship.move()
+            self.ship.thrust_left = thrust_left
+            self.ship.thrust_right = thrust_right
+            
+    # --------------------------------------------------------------------------
+
+    def update_client(self, current_time):
+        """
+        Updates the main game scene on the two-player client. The host runs
+        the game: the client sends it a command each frame, moves its own ship
+        straight away (rather than waiting for the host), and shows everything
+        else as it was on the host a short time ago.
+        """
+        for event in self.input.events():
             if event.type == QUIT or (event.type == KEYUP and event.key == K_ESCAPE):
                 self.running = False
             elif (event.type == KEYDOWN):
                 self.on_keydown(event.key)
             elif (event.type == KEYUP):
                 self.on_keyup(event.key)
-            elif event.type == MOUSEBUTTONDOWN:
-                # self.mouse_down(pygame.mouse.get_pos())
-                pass
-            elif event.type == MOUSEBUTTONUP:
-                # self.mouse_up(pygame.mouse.get_pos())
-                pass
-            elif event.type == MOUSEMOTION:
-                # self.mouse_moved(pygame.mouse.get_pos())
-                pass
+                
+        flags = self.ship.get_command()
+        if self.launch_requested:
+            flags = flags | COMMAND_LAUNCH
+            self.launch_requested = False
+        self.network.send_command(flags)
+        if self.ship.visible:
+            self.ship.animate(current_time)
+            self.ship.move()
+            
+        self.interpolate_world(current_time)
+        self.effects.update(current_time)
+        self.update_labels()
+        
+    # --------------------------------------------------------------------------
 
-        if self.ship.mining_units == self.ship.total_mining_units:
-            s_store["mining"].stop()
+    def interpolate_world(self, current_time):
+        """
+        Positions the asteroids, mines, effects and the host's ship at the
+        point between the two states from the host either side of the time
+        being shown.
+        """
+        if not self.world_states:
+            return
+        render_time = current_time + self.host_offset - self.interpolation_delay
+        before = after = self.world_states[-1]
+        for i in range(0, len(self.world_states)):
+            if self.world_states[i].time >= render_time:
+                after = self.world_states[i]
+                before = self.world_states[max(i - 1, 0)]
+                break
+        if after.time > before.time:
+            fraction = min(max((render_time - before.time) / float(after.time - before.time), 0.0), 1.0)
+        else:
+            fraction = 1.0
+            
+        def between(first, second):
+            return int(round(first + (second - first) * fraction))
+        
+        roids = {}
+        for roid_id, state in after.roids.items():
+            previous = before.roids.get(roid_id, state)
+            roid = self.remote_roids.get(roid_id)
+            if roid is None:
+                roid = Asteroid(state[1], None)
+                self.asteroids.roids.add(roid)
+            roid.rect.topleft = (between(previous[2], state[2]), between(previous[3], state[3]))
+            start_angle = previous[4] * 360.0 / 65536
+            turn = ((state[4] * 360.0 / 65536) - start_angle + 180) % 360 - 180
+            roid.angle = (start_angle + turn * fraction) % 360
+            roid.being_mined = bool(state[6])
+            roid.show_frame(state[5])
+            roid.rotate()
+            roids[roid_id] = roid
+        for roid_id, roid in self.remote_roids.items():
+            if roid_id not in roids:
+                self.asteroids.roids.remove(roid)
+        self.remote_roids = roids
+        
+        mines = {}
+        for key, state in after.mines.items():
+            previous = before.mines.get(key, state)
+            mine = self.remote_mines.get(key)
+            if mine is None:
+                mine = FrameSprite(g_store["miner_frames_01"], 10)
+                self.mines.mines.add(mine)
+            mine.rect.topleft = (between(previous[2], state[2]), between(previous[3], state[3]))
+            mine.show_frame(state[5])
+            mines[key] = mine
+        for key, mine in self.remote_mines.items():
+            if key not in mines:
+                self.mines.mines.remove(mine)
+        self.remote_mines = mines
+        # The client's mines are plain sprites, so the ones which are mining
+        # (for the screen effects) are taken from the states
+        self.remote_mining = [mines[key].rect for key, state in after.mines.items() if state[4]]
+        
+        if after.ships:
+            state = after.ships[0]
+            previous = before.ships[0] if before.ships else state
+            self.partner.rect.left = between(previous[0], state[0])
+            self.partner.visible = bool(state[8])
+            self.partner.animate(current_time)
+            
+        # The effects are started as though they had begun at the time shown
+        lag = int(render_time - after.time)
+        self.effects.mirror([effect[0:6] + (max(effect[6] + lag, 0),) for effect in after.effects], current_time)
             
     # --------------------------------------------------------------------------
 
@@ -1040,11 +3146,11 @@ class Game(object):
         """
         Updates the high-score edit scene
         """
-        for event in pygame.event.get():
+        for event in self.input.events():
             if event.type == QUIT or (event.type == KEYUP and event.key == K_ESCAPE):
                 self.running = False
             elif (event.type == KEYDOWN):
-                self.on_keydown(event.key, pygame.key.get_mods())
+                self.on_keydown(event.key, event.mod)
             
     # --------------------------------------------------------------------------
 
@@ -1061,11 +3167,13 @@ class Game(object):
         """
         Updates the ending scene
         """
-        for event in pygame.event.get():
+        for event in self.input.events():
             if event.type == QUIT or (event.type == KEYUP and event.key == K_ESCAPE):
                 self.running = False
             elif event.type == KEYUP and event.key == K_SPACE:
                 self.reset()
+            elif event.type == KEYUP and event.key == K_r and not self.network:
+                self.retry(current_time)
             
     # --------------------------------------------------------------------------
     
@@ -1073,75 +3181,331 @@ class Game(object):
         """
         Main routine for drawing the display.
         """
-        # Draw the background
-        for scroller in self.scrollers:
-            scroller.render(self.display)
+        self.draw_world(self.display)
+        self.draw_screen_effects(self.screen_frame(pygame.time.get_ticks()))
+        
+        # The rest is drawn on the HUD, which is kept at the resolution of the
+        # window when the world is drawn at a lower render scale.
+        self.renderer.finish_world()
+        self.draw_hud(self.hud)
+        self.present(self.input.updates)
+        
+    # --------------------------------------------------------------------------
+    
+    def draw_world(self, target):
+        """
+        Draws the background, and the game world for the current mode.
+        """
+        # Draw the background (the nearest layers are left out at the lower
+        # levels of quality)
+        for scroller in self.scrollers[:self.quality.layers]:
+            scroller.render(target)
 
         if self.mode == self.MODE_INTRO:
             # Draw the logo
-            self.display.blit(self.logo, [0, 0])
+            target.blit(g_store["logo"], [0, 0])
             
         elif self.mode == self.MODE_GAME:
             
-            # Draw any active explosions
-            self.explosions.draw(self.display)
-    
             # Draw the asteroids
-            self.asteroids.draw(self.display)
+            self.asteroids.draw(target)
             
             # Draw any active mines
-            self.mines.draw(self.display)
+            self.mines.draw(target)
+            
+            # Draw the explosions, debris and mining dust
+            self.effects.draw(target)
     
             # Draw the ship
-            self.ship.draw(self.display)
+            self.ship.draw(target)
             
-        elif self.mode == self.MODE_OUTRO:
+            # Draw the other player's ship and mines
+            if self.partner:
+                self.partner.draw(target)
+            if self.partner_mines:
+                self.partner_mines.draw(target)
+            
+        elif self.mode in [self.MODE_OUTRO, self.MODE_SCORE]:
+            
+            target.blit(g_store["game_over_01"], [200, 100])
+
+    # --------------------------------------------------------------------------
+    
+    def screen_frame(self, current_time):
+        """
+        Returns the screen effects to draw over the world in this frame (see
+        ScreenEffects.frame()), or None.
+        """
+        if self.screen_effects is None or self.mode != self.MODE_GAME:
+            return None
+        if self.net_client:
+            mining = self.remote_mining
+        else:
+            mining = [mine.rect for controller in (self.mines, self.partner_mines) if controller for mine in controller.mines if mine.is_mining]
+        return self.screen_effects.frame(self.ship, self.ships(), mining, current_time)
+        
+    def draw_screen_effects(self, effects):
+        """
+        Draws the screen effects from screen_frame() over the world, on the
+        surface which it was drawn on.
+        """
+        if effects is not None:
+            surface, scale = self.renderer.world_surface()
+            self.screen_effects.apply(surface, scale, effects)
+        
+    # --------------------------------------------------------------------------
+    
+    def draw_hud(self, target):
+        """
+        Draws the overlay and the text.
+        """
+        if self.mode == self.MODE_OUTRO:
             
-            self.display.blit(self.end, [200, 100])
-            self.hiscore_title.draw(self.display)
+            self.hiscore_title.draw(target)
             for label in self.hiscore_labels:
-                label[0].draw(self.display)
-                label[1].draw(self.display)
-            self.replay_label.draw(self.display)
+                label[0].draw(target)
+                label[1].draw(target)
+            self.replay_label.draw(target)
+            self.rank_label.draw(target)
 
         elif self.mode == self.MODE_SCORE:
             
-            self.display.blit(self.end, [200, 100])
-            self.hiscore_edit.draw(self.display)
+            self.hiscore_edit.draw(target)
+            self.rank_label.draw(target)
             
-        # Update the UI
-        self.display.blit(self.overlay, [0, 0])
-        
-        # Update the status
-        self.score_label.draw(self.display)
-        self.mine_label.draw(self.display)
-        self.hull_label.draw(self.display)
-        self.shield_label.draw(self.display)
+        # Update the UI and the status
+        self.hud_layer.draw(target)
 
         if self.mode in [self.MODE_GAME, self.MODE_SCORE]:
-            self.large_score_label.draw(self.display)
+            self.large_score_label.draw(target)
         
+    # --------------------------------------------------------------------------
+    
+    def present(self, update):
+        """
+        Shows the finished frame, which shows the specified update (see
+        InputLayer.events()).
+        """
+        # Record the frame, if required
+        if self.capture:
+            self.capture.capture(self.renderer.frame_surface())
+            
         # Update the display
-        pygame.display.update()
+        work = time.time() - self.frame_started
+        self.renderer.present()
+        self.input.presented(update)
+        interval = self.frame_times.tick()
+        self.scene_memory.sample(self.mode)
+        if self.governor and interval is not None:
+            level = self.governor.frame(interval, work)
+            if level is not None:
+                self.set_quality(level)
+        self.frame_started = time.time()
+        
+    # --------------------------------------------------------------------------
+    
+    def set_quality(self, level):
+        """
+        Changes to one of the QUALITY_LEVELS. This is called on the thread
+        which draws the frames. Everything but the render scale is read from
+        'quality' by the update as it goes, so only the render scale has to
+        be changed here.
+        """
+        previous = self.quality
+        self.quality = QUALITY_LEVELS[level]
+        Animation.slowdown = self.quality.animation_slowdown
+        self.effects.show_optional = self.quality.dust
+        if self.quality.render_scale != previous.render_scale:
+            self.renderer.set_render_scale(self.settings.render_scale * self.quality.render_scale)
+            self.display = self.renderer.target
+            self.hud = self.renderer.hud
+            self.hud_layer.copy_on_write = self.settings.threaded or self.renderer.retains_images
+        logging.info("Quality: level %d (%s), at %.1f FPS" % (level, self.quality.name, self.governor.changes[-1][3]))
         
     # --------------------------------------------------------------------------
 
+    def frame_pacing(self):
+        """
+        Describes how the frames are paced, for the input latency report.
+        """
+        if self.network:
+            pacing = "two-player, %d FPS" % self.net_frame_rate
+        elif self.settings.threaded and self.settings.sim_rate:
+            pacing = "threaded, %d steps/s" % self.settings.sim_rate
+        elif self.settings.threaded:
+            pacing = "threaded, unlimited"
+        else:
+            pacing = "single-threaded, unlimited"
+        if self.settings.threaded and self.network:
+            pacing = pacing + ", threaded"
+        return pacing
+
+    # --------------------------------------------------------------------------
+
     def run(self):
         """
         Main game loop
         """
         self.startup()
+        self.timeline.mark("setup")
+        if self.settings.memory_profile:
+            # Profile the game's own source, and the modules which it uses
+            self.memory = MemoryProfiler([sys.modules[name] for name in (__name__, "render", "capture", "snapshot", "network")])
+            for name, method in self.memory_phases:
+                self.memory.watch(self, method, name)
+            self.memory.start()
+        elif self.settings.threaded:
+            self.run_threaded()
+            return
+        # The two-player mode runs at a fixed frame rate, as each command
+        # from the client moves its ship by one frame's worth
+        clock = pygame.time.Clock()
+        first_frame = True
         while self.running:
             self.update()
+            self.step_times.tick()
             self.draw()
+            if first_frame:
+                first_frame = False
+                self.timeline.mark("first frame")
+                logging.info(self.timeline.report())
+            if self.memory:
+                self.memory.end_frame()
+            if self.network:
+                clock.tick(self.net_frame_rate)
         self.shutdown()
     
     # --------------------------------------------------------------------------
 
+    def run_threaded(self):
+        """
+        Main game loop for the threaded mode. The simulation runs on its own
+        thread (see simulate()), and publishes a RenderState after every step.
+        This thread passes the events on to the simulation, and draws each new
+        state as it arrives. The simulation records each step into a new
+        RenderState, so it is never writing to the one which is being drawn.
+        pygame releases the GIL while it blits, so drawing one frame can
+        overlap with simulating the next.
+        """
+        self.input.separate_pump = True
+        self.render_state = None
+        self.state_ready = threading.Condition()
+        self.sim_error = None
+        simulation = threading.Thread(target = self.simulate, name = "simulation")
+        simulation.daemon = True
+        simulation.start()
+        
+        drawn = None
+        while self.running:
+            # SDL only delivers events to the thread which created the window
+            self.input.pump()
+            with self.state_ready:
+                if self.render_state is drawn:
+                    # Wait for the next state, but not for long, so that the
+                    # events keep flowing
+                    self.state_ready.wait(0.005)
+                state = self.render_state
+            if state is None or state is drawn:
+                continue
+            self.draw_state(state)
+            if drawn is None:
+                self.timeline.mark("first frame")
+                logging.info(self.timeline.report())
+            drawn = state
+        simulation.join()
+        if self.sim_error:
+            raise self.sim_error[0], self.sim_error[1], self.sim_error[2]
+        self.shutdown()
+        
+    # --------------------------------------------------------------------------
+
+    def simulate(self):
+        """
+        The simulation thread, for the threaded mode. Updates the game at a
+        fixed rate, and records what is to be drawn after each update.
+        """
+        rate = self.settings.sim_rate
+        if self.network:
+            rate = self.net_frame_rate
+        next_step = time.time()
+        step = 0
+        try:
+            while self.running:
+                self.update()
+                self.step_times.tick()
+                step = step + 1
+                state = RenderState(step, self.input.updates, (self.display.get_width(), self.display.get_height()))
+                self.draw_world(state.world)
+                state.effects = self.screen_frame(pygame.time.get_ticks())
+                self.draw_hud(state.hud)
+                with self.state_ready:
+                    self.render_state = state
+                    self.state_ready.notify()
+                if rate:
+                    next_step = next_step + 1.0 / rate
+                    delay = next_step - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        # Running behind, so carry on from now rather than
+                        # trying to catch up
+                        next_step = time.time()
+        except Exception:
+            self.sim_error = sys.exc_info()
+            self.running = False
+            
+    # --------------------------------------------------------------------------
+
+    def draw_state(self, state):
+        """
+        Draws a RenderState recorded by the simulation thread.
+        """
+        state.world.replay(self.display)
+        self.draw_screen_effects(state.effects)
+        self.renderer.finish_world()
+        state.hud.replay(self.hud)
+        self.present(state.update)
+        
+    # --------------------------------------------------------------------------
+
     def shutdown(self):
         """
         Cleans up before the application closes.
         """
+        if self.memory:
+            self.memory.stop()
+            for line in self.memory.report():
+                logging.info(line)
+        if self.capture:
+            self.capture.close()
+            logging.info(self.capture.report())
+        logging.info(r_cache.report())
+        logging.info(self.snapshots.report())
+        logging.info(self.hud_layer.report())
+        for line in self.scene_memory.report():
+            logging.info(line)
+        if self.snapshots.pushed:
+            logging.info("Snapshot time: %.3f ms average" % (self.snapshot_time * 1000.0 / self.snapshots.pushed))
+        if self.restores:
+            logging.info("Restore time: %.3f ms average over %d restores" % (self.restore_time * 1000.0 / self.restores, self.restores))
+        self.discard_snapshot_file()
+        self.save_game()
+        if self.network:
+            logging.info(self.network.report())
+            if self.net_states:
+                logging.info("Average asteroids per state sent: %.1f" % (float(self.net_roids) / self.net_states))
+            self.network.close()
+        logging.info("Average entities visited per frame: %.2f (background), %.2f (game)" % (self.background_scheduler.average_visited(), self.scheduler.average_visited()))
+        logging.info(self.frame_times.report())
+        logging.info(self.step_times.report())
+        if self.governor:
+            logging.info(self.governor.report())
+        logging.info(self.input.report(self.frame_pacing()))
+        if self.settings.event_log:
+            e_log.close()
+            logging.info(e_log.report())
+        if self.screen_effects:
+            self.screen_effects.close()
         pygame.quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+The quality governor, which trades detail for frame rate.
+
+The QualityGovernor is given the time of every frame, and looks at them a
+window of frames at a time:
+
+    - If the frame rate over the window is below the target, the quality is
+      stepped down one level.
+    - If the frames' work (the time taken to update and draw them, but not to
+      put them on screen, which may include waiting for the display) fits
+      comfortably within the frame budget for several windows in a row, the
+      quality is stepped back up one level.
+
+If a step up is followed straight away by a step back down, the next step up
+has to wait twice as long, so that the quality does not flip back and forth
+when the game is on the edge of the target. Frames which take far longer than
+any frame should (loading, or the window being dragged) are left out.
+
+The game applies the QUALITY_LEVELS; the governor only chooses between them.
+Every change is recorded in 'changes', and report() summarises them, along
+with the time spent at each level.
+"""
+
+import time
+
+class QualityLevel(object):
+    """
+    The settings for one level of quality.
+    """
+
+    def __init__(self, name, layers = 3, animation_slowdown = 1, dust = True, asteroids = 1.0, render_scale = 1.0):
+        """
+        Params:
+            name               : description, for the log
+            layers             : number of parallax background layers drawn
+            animation_slowdown : factor by which the sprite animations are
+                                 slowed down (see Animation)
+            dust               : whether to show the mining-dust clouds
+            asteroids          : fraction of Asteroids.max_asteroids allowed
+            render_scale       : factor applied to the render scale
+        """
+        self.name = name
+        self.layers = layers
+        self.animation_slowdown = animation_slowdown
+        self.dust = dust
+        self.asteroids = asteroids
+        self.render_scale = render_scale
+
+# The levels of quality, from the best to the cheapest. Each level keeps the
+# savings of the ones before it.
+QUALITY_LEVELS = [
+    QualityLevel("full"),
+    QualityLevel("no mining dust", dust = False),
+    QualityLevel("two background layers, half-rate animation", layers = 2, animation_slowdown = 2, dust = False),
+    QualityLevel("one background layer, 75% of the asteroids", layers = 1, animation_slowdown = 2, dust = False, asteroids = 0.75),
+    QualityLevel("75% render scale", layers = 1, animation_slowdown = 2, dust = False, asteroids = 0.75, render_scale = 0.75),
+    QualityLevel("50% render scale, 50% of the asteroids", layers = 1, animation_slowdown = 2, dust = False, asteroids = 0.5, render_scale = 0.5),
+]
+
+class QualityGovernor(object):
+    """
+    Chooses the level of quality which holds the target frame rate.
+    """
+
+    # The number of frames which are judged together
+    window = 60
+
+    # The fraction of the target frame rate which counts as holding it
+    tolerance = 0.95
+
+    # The fraction of the frame budget which the work of each frame must fit
+    # within, on average, for there to be room to step up
+    headroom = 0.6
+
+    # The number of windows with room to spare before stepping up, and the
+    # most that this can grow to after failed steps up
+    up_windows = 3
+    max_up_windows = 48
+
+    # Frames which take longer than this (in seconds) are left out
+    stall = 0.25
+
+    def __init__(self, target_fps, levels = QUALITY_LEVELS):
+        self.target_fps = target_fps
+        self.budget = 1.0 / target_fps
+        self.levels = levels
+        self.level = 0
+        self.intervals = []
+        self.work = []
+        self.spare_windows = 0
+        self.needed_windows = self.up_windows
+        self.stepped_up = False
+        self.started = time.time()
+        self.level_since = self.started
+        self.level_time = [0.0] * len(levels)
+        # A tuple of (time since the start, old level, new level, frame rate)
+        # for each change
+        self.changes = []
+
+    def frame(self, interval, work):
+        """
+        Records a frame, given the time since the previous one and the time
+        spent updating and drawing it (both in seconds). Returns the new
+        level if the quality is to change, otherwise None.
+        """
+        if interval > self.stall:
+            return None
+        self.intervals.append(interval)
+        self.work.append(work)
+        if len(self.intervals) < self.window:
+            return None
+
+        fps = len(self.intervals) / sum(self.intervals)
+        load = sum(self.work) / len(self.work) / self.budget
+        self.intervals = []
+        self.work = []
+
+        level = None
+        if fps < self.target_fps * self.tolerance:
+            self.spare_windows = 0
+            if self.stepped_up:
+                # The last step up was too far, so wait longer before the next
+                self.needed_windows = min(self.needed_windows * 2, self.max_up_windows)
+            if self.level < len(self.levels) - 1:
+                level = self.level + 1
+        elif load < self.headroom:
+            self.spare_windows = self.spare_windows + 1
+            if self.spare_windows >= self.needed_windows and self.level > 0:
+                level = self.level - 1
+        else:
+            self.spare_windows = 0
+
+        self.stepped_up = level is not None and level < self.level
+        if level is not None:
+            self.set_level(level, fps)
+        return level
+
+    def set_level(self, level, fps = 0.0):
+        """
+        Changes to the specified level, recording the frame rate which caused
+        the change.
+        """
+        current = time.time()
+        self.level_time[self.level] = self.level_time[self.level] + current - self.level_since
+        self.level_since = current
+        self.changes.append((current - self.started, self.level, level, fps))
+        self.level = level
+        self.spare_windows = 0
+        if level == 0:
+            self.needed_windows = self.up_windows
+
+    def report(self):
+        """
+        Returns a summary of the changes of quality.
+        """
+        level_time = list(self.level_time)
+        level_time[self.level] = level_time[self.level] + time.time() - self.level_since
+        total = max(sum(level_time), 0.001)
+        down = len([change for change in self.changes if change[2] > change[1]])
+        shares = ", ".join(["%d: %.0f%%" % (level, seconds * 100.0 / total) for level, seconds in enumerate(level_time) if seconds])
+        return "Quality: target %d FPS, %d changes (%d down, %d up), lowest level %d; time at each level %s" % (self.target_fps, len(self.changes), down, len(self.changes) - down, max([self.level] + [change[2] for change in self.changes]), shares)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+The input layer, which takes the events from pygame and hands them to the
+game, and measures the input latency: the time from a key being pressed (or
+released) to the first frame showing its effect being put on screen.
+
+The game only reacts to the keyboard (and to the window being closed), so the
+InputLayer tells SDL to drop every other type of event (the mouse, joystick
+and window events) as they arrive, rather than queueing them for the game to
+walk past.
+
+pump() must be called on the thread which created the window (SDL only
+delivers the events there). events() is called by the update, and pumps the
+events itself unless the update runs on another thread (see
+Game.run_threaded()), in which case the main thread pumps them, and the two
+threads meet in a deque (which is safe to append to from one thread and pop
+from another). pygame gives its events no timestamps, so each event is stamped
+when pump() takes it from SDL; the time it spent in SDL's own queue (at most
+the time since the previous pump) is not counted.
+
+events() also keeps the key bitmap, which says which keys are held down as
+the update saw them, and notes the number of the update which consumed each
+key event. Each frame records the number of the last update drawn in it, and
+when the frame has been put on screen, presented() records the latency of
+every key event consumed up to that update in a KLL sketch (see analytics).
+"""
+
+import time
+from collections import deque
+
+import pygame
+from pygame.locals import QUIT, KEYDOWN, KEYUP
+
+from analytics import KLLSketch
+
+# The events which are let through
+EVENT_TYPES = [QUIT, KEYDOWN, KEYUP]
+
+# pygame 2 numbers the keys without a character (the arrows, for example) as
+# SDL scancodes with this bit set
+SCANCODE_MASK = 1 << 30
+
+def key_bit(key):
+    """
+    Returns the key's bit in the key bitmap. The keys with characters keep
+    their codes (all below 512); the others, whose codes are only large under
+    pygame 2, are moved to the next 512 bits.
+    """
+    if key & SCANCODE_MASK:
+        return 512 + (key & 0x1ff)
+    return key & 0x1ff
+
+class InputLayer(object):
+    """
+    Filters, timestamps and delivers the keyboard events, and records how long
+    they take to reach the screen.
+    """
+
+    # The percentiles shown by report()
+    PERCENTILES = [50, 90, 99]
+
+    def __init__(self):
+        self.queue = deque()
+        self.keys = 0
+        self.updates = 0
+        self.pending = deque()
+        self.latency = KLLSketch()
+        self.longest = 0.0
+        self.events_seen = 0
+        # Set when pump() is called by another thread, rather than by events()
+        self.separate_pump = False
+
+    def start(self):
+        """
+        Restricts SDL's event queue to the EVENT_TYPES. Blocking a type of
+        event discards the ones already waiting, so those are pumped first,
+        and the ones of the allowed types are kept.
+        """
+        self.pump()
+        self.queue = deque([(event, stamp) for event, stamp in self.queue if event.type in EVENT_TYPES])
+        pygame.event.set_allowed(None)
+        pygame.event.set_allowed(EVENT_TYPES)
+
+    def pump(self):
+        """
+        Takes the waiting events from SDL, stamping each with the time. Must
+        be called on the thread which created the window.
+        """
+        events = pygame.event.get()
+        if events:
+            now = time.time()
+            self.queue.extend([(event, now) for event in events])
+
+    def events(self):
+        """
+        Returns the events pumped since the last call, for one update,
+        updating the key bitmap to match.
+        """
+        if not self.separate_pump:
+            self.pump()
+        self.updates = self.updates + 1
+        events = []
+        while self.queue:
+            event, stamp = self.queue.popleft()
+            if event.type == KEYDOWN:
+                self.keys = self.keys | (1 << key_bit(event.key))
+                self.pending.append((self.updates, stamp))
+            elif event.type == KEYUP:
+                self.keys = self.keys & ~(1 << key_bit(event.key))
+                self.pending.append((self.updates, stamp))
+            events.append(event)
+        return events
+
+    def is_held(self, key):
+        """
+        Returns True if the key is held down, as of the last call to events().
+        """
+        return bool(self.keys & (1 << key_bit(key)))
+
+    def presented(self, update):
+        """
+        Records the latency of the key events consumed up to (and including)
+        the specified update, which has just been put on screen.
+        """
+        if not self.pending:
+            return
+        now = time.time()
+        while self.pending and self.pending[0][0] <= update:
+            latency = now - self.pending.popleft()[1]
+            self.latency.add(latency * 1000.0)
+            self.longest = max(self.longest, latency)
+            self.events_seen = self.events_seen + 1
+
+    def report(self, configuration):
+        """
+        Returns a summary of the input latency, for the specified frame pacing
+        configuration (which is only used to label it).
+        """
+        if not self.events_seen:
+            return "Input latency (%s): no key events" % configuration
+        percentiles = ", ".join(["p%d %.1f ms" % (p, self.latency.quantile(p / 100.0)) for p in self.PERCENTILES])
+        return "Input latency (%s): %d key events, %s, longest %.1f ms" % (configuration, self.events_seen, percentiles, self.longest * 1000.0)
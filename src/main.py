@@ -5,16 +5,121 @@
 Main entry point for the game.
 
 This simply creates an instance of the main Game class (from game.py) and runs
-it.
+it. The command-line options are passed to the game via a Settings instance.
 """
 
-from game import Game
+import time
+
+# The start-up timeline (which is written to jangam.log) starts from here
+started = time.time()
+
+import argparse
+
+from game import Game, Settings
+from render import SCALE_FILTERS
+from capture import CAPTURE_FORMATS
+
+# The snapshot file used by --resume, when no --snapshot-file is given
+RESUME_FILE = "jangam.snapshot"
+
+def window_size(text):
+    """
+    Parses a window size given as WIDTHxHEIGHT.
+    """
+    try:
+        width, height = text.lower().split("x")
+        return (int(width), int(height))
+    except ValueError:
+        raise argparse.ArgumentTypeError("window size must be WIDTHxHEIGHT, e.g. 1200x1200")
+
+def address(text):
+    """
+    Parses a network address given as HOST:PORT.
+    """
+    try:
+        host, port = text.rsplit(":", 1)
+        return (host, int(port))
+    except ValueError:
+        raise argparse.ArgumentTypeError("address must be HOST:PORT, e.g. localhost:5999")
 
 # ==============================================================================
 # Entry point
 # ==============================================================================
 
-game = Game()
-game.run()
+parser = argparse.ArgumentParser(description = "Jangam Retro")
+parser.add_argument("--chain-reaction", action = "store_true", help = "asteroids caught in an explosion explode as well")
+parser.add_argument("--rect-collisions", action = "store_true", help = "collide on the bounds of the sprites, rather than their pixels")
+parser.add_argument("--rotation-steps", type = int, default = Settings.rotation_steps, help = "number of angles the asteroids are drawn at")
+parser.add_argument("--rotation-cache-kb", type = int, default = Settings.rotation_cache_kb, help = "memory limit for the rotated asteroid images")
+parser.add_argument("--prebuild-rotations", action = "store_true", help = "render all the rotated asteroid images at start-up")
+parser.add_argument("--renderer", choices = ["surface", "texture"], default = Settings.renderer, help = "render backend (texture requires pygame 2)")
+parser.add_argument("--render-scale", type = float, default = Settings.render_scale, help = "scale at which the game world is drawn, e.g. 0.5 or 0.75")
+parser.add_argument("--scale-filter", choices = SCALE_FILTERS, default = Settings.scale_filter, help = "filter for scaling the game world up to the window")
+parser.add_argument("--window", type = window_size, default = Settings.window_size, help = "window size, as WIDTHxHEIGHT")
+parser.add_argument("--fullscreen", action = "store_true", help = "run fullscreen at the desktop resolution")
+parser.add_argument("--headless", action = "store_true", help = "run without a window or sound")
+parser.add_argument("--capture", metavar = "PATH", help = "record every frame to PATH (a directory for png, otherwise a file)")
+parser.add_argument("--capture-format", choices = CAPTURE_FORMATS, default = Settings.capture_format, help = "format for --capture")
+parser.add_argument("--capture-ring", type = int, default = Settings.capture_ring, help = "frames which can wait to be written before frames are dropped")
+parser.add_argument("--snapshot-interval", type = int, default = Settings.snapshot_interval, help = "milliseconds between snapshots of the game, for rewinding")
+parser.add_argument("--snapshot-memory-kb", type = int, default = Settings.snapshot_memory_kb, help = "memory for the ring of snapshots")
+parser.add_argument("--snapshot-file", metavar = "PATH", default = Settings.snapshot_file, help = "file the latest snapshot is saved to, in case the game crashes (default: none)")
+parser.add_argument("--resume", action = "store_true", help = "resume a crashed game from the snapshot file (%s unless --snapshot-file is given), and keep saving to it" % RESUME_FILE)
+parser.add_argument("--analytics", dest = "analytics_file", metavar = "PATH", default = Settings.analytics_file, help = "file the score, duration and powerups of every game are recorded in (default: none)")
+parser.add_argument("--event-log", metavar = "PATH", default = Settings.event_log, help = "file the events of every game are added to, for offline analysis (default: none)")
+parser.add_argument("--host", metavar = "PORT", type = int, help = "host a two-player game on this UDP port")
+parser.add_argument("--connect", metavar = "HOST:PORT", type = address, help = "join the two-player game at this address")
+parser.add_argument("--net-rate", type = int, default = Settings.net_rate, help = "states per second sent by the host")
+parser.add_argument("--net-latency", type = int, default = Settings.net_latency, help = "milliseconds of delay added to everything sent (for testing)")
+parser.add_argument("--net-loss", type = float, default = Settings.net_loss, help = "fraction of the packets sent which are dropped (for testing)")
+parser.add_argument("--threaded", action = "store_true", help = "simulate the game on its own thread, and draw on the main thread")
+parser.add_argument("--sim-rate", type = int, default = Settings.sim_rate, help = "simulation steps per second in the threaded mode (0 for as many as possible)")
+parser.add_argument("--target-fps", type = int, default = Settings.target_fps, help = "frame rate which the quality governor holds by lowering the detail (0 to always show full detail)")
+parser.add_argument("--no-screen-effects", action = "store_true", help = "do not show the glows, flashes and shakes for the ship's shields, hits and powerups")
+parser.add_argument("--memory-profile", action = "store_true", help = "record the allocations and garbage collection in each frame (slow)")
+parser.add_argument("--keep-assets", action = "store_true", help = "keep every graphic and sound loaded once it has been used, rather than only those which the current scene needs")
+parser.add_argument("--eager-init", action = "store_true", help = "start all of pygame and load every asset before the game starts")
+args = parser.parse_args()
 
+# --resume without a --snapshot-file uses the usual file, and saves to it, so
+# that a game which crashes can be resumed the next time
+snapshot_file = args.snapshot_file
+if args.resume and not snapshot_file:
+    snapshot_file = RESUME_FILE
 
+settings = Settings(chain_reaction = args.chain_reaction,
+                    pixel_collisions = not args.rect_collisions,
+                    rotation_steps = args.rotation_steps,
+                    rotation_cache_kb = args.rotation_cache_kb,
+                    rotation_prebuild = args.prebuild_rotations,
+                    renderer = args.renderer,
+                    render_scale = args.render_scale,
+                    scale_filter = args.scale_filter,
+                    window_size = args.window,
+                    fullscreen = args.fullscreen,
+                    headless = args.headless,
+                    capture = args.capture,
+                    capture_format = args.capture_format,
+                    capture_ring = args.capture_ring,
+                    snapshot_interval = args.snapshot_interval,
+                    snapshot_memory_kb = args.snapshot_memory_kb,
+                    snapshot_file = snapshot_file,
+                    analytics_file = args.analytics_file,
+                    event_log = args.event_log,
+                    resume = args.resume,
+                    net_host = args.host,
+                    net_connect = args.connect,
+                    net_rate = args.net_rate,
+                    net_latency = args.net_latency,
+                    net_loss = args.net_loss,
+                    started = started,
+                    eager_init = args.eager_init,
+                    unload_assets = not args.keep_assets,
+                    memory_profile = args.memory_profile,
+                    threaded = args.threaded,
+                    sim_rate = args.sim_rate,
+                    target_fps = args.target_fps,
+                    screen_effects = not args.no_screen_effects)
+
+game = Game(settings)
+game.run()
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Memory profiling for the game loop.
+
+The MemoryProfiler counts the objects allocated in each frame, by source line
+and by phase of the frame (the methods passed to watch()), and measures the
+pauses for garbage collection. The results are summarised by report().
+
+Python 2 has neither tracemalloc nor gc.callbacks, so the profiler works from
+the garbage collector's own allocation count (the count for generation 0,
+which goes up by one for every object the collector tracks that is created,
+and down by one for every one that is freed):
+
+    - Automatic collection is switched off while profiling, so that the count
+      only ever changes because objects were created or freed.
+    - A trace function reads the count on every line of the watched source
+      files, and charges the change since the last line to that line. Calls
+      into other modules (including pygame and the standard library) are
+      charged to the line which made them.
+    - At the end of each frame, the profiler collects whichever generation
+      the collector would have collected automatically (see gc.get_threshold)
+      and times it, so the pauses are measured where they can be seen.
+
+Only objects which the garbage collector tracks are counted: lists, tuples,
+dicts, instances, bound methods, closures and so on. Strings, numbers, Rects
+and Surfaces are not, so a line which only creates those shows no
+allocations. The counts are also net: an object created and freed within the
+same line is not counted.
+
+The trace function slows the game down considerably, so the time taken by
+each phase is not reported.
+
+SceneMemory is much cheaper, and is always used: it samples the resident set
+size of the process now and then, and reports the peak and steady-state size
+in each scene of the game.
+"""
+
+import gc
+import heapq
+import linecache
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+
+def resident_bytes():
+    """
+    Returns the resident set size of the process (the memory it is actually
+    using) in bytes, or None where this cannot be read (it is read from /proc,
+    so only works on Linux).
+    """
+    try:
+        f = open("/proc/self/statm", "r")
+    except IOError:
+        return None
+    try:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    finally:
+        f.close()
+
+class PhaseStats(object):
+    """
+    The allocations made by one phase of the frame.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.allocated = 0
+        self.kept = 0
+        self.frame_allocated = 0
+        self.highest = 0
+
+class MemoryProfiler(object):
+    """
+    Counts the allocations made in each frame, by source line and by phase,
+    and times the garbage collection between frames.
+    """
+
+    def __init__(self, modules):
+        """
+        Params:
+            modules : the modules whose source lines are traced
+        """
+        self.files = set([os.path.splitext(module.__file__)[0] + ".py" for module in modules])
+        self.code_files = {}
+        self.lines = {}
+        self.phases = OrderedDict()
+        self.phase_stack = []
+        self.last_line = None
+        self.last_count = 0
+
+        self.frames = 0
+        self.frame_start = 0
+        self.allocated = 0
+        self.frame_allocated = []
+        self.frame_kept = []
+        self.pauses = []
+        self.collections = [0, 0, 0]
+        self.collected = 0
+        self.running = False
+
+    def traced(self, code):
+        """
+        Returns True if the lines of the code object are to be traced.
+        """
+        filename = code.co_filename
+        result = self.code_files.get(filename)
+        if result is None:
+            result = os.path.splitext(os.path.abspath(filename))[0] + ".py" in self.files
+            self.code_files[filename] = result
+        return result
+
+    def watch(self, owner, path, phase):
+        """
+        Replaces a method with one which records the allocations made by it
+        as the named phase. The 'path' is the name of the method on 'owner',
+        and can go through attributes (e.g. "scheduler.run"). Phases which are
+        called by others are included in both.
+        """
+        names = path.split(".")
+        for name in names[:-1]:
+            owner = getattr(owner, name)
+        method = getattr(owner, names[-1])
+        stats = self.phases.setdefault(phase, PhaseStats())
+
+        def watched(*args, **kwargs):
+            self.charge(gc.get_count()[0])
+            self.phase_stack.append(stats)
+            start = self.last_count
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.charge(gc.get_count()[0])
+                self.phase_stack.pop()
+                stats.calls = stats.calls + 1
+                stats.kept = stats.kept + self.last_count - start
+
+        setattr(owner, names[-1], watched)
+
+    def start(self):
+        """
+        Starts profiling (on the calling thread).
+        """
+        self.gc_enabled = gc.isenabled()
+        gc.disable()
+        self.running = True
+        self.frame_start = gc.get_count()[0]
+        sys.settrace(self.trace_call)
+
+    def stop(self):
+        """
+        Stops profiling, and restores automatic garbage collection.
+        """
+        if not self.running:
+            return
+        sys.settrace(None)
+        self.running = False
+        if self.gc_enabled:
+            gc.enable()
+
+    # --------------------------------------------------------------------------
+    # Trace functions
+    # --------------------------------------------------------------------------
+
+    def trace_call(self, frame, event, arg):
+        if self.traced(frame.f_code):
+            return self.trace_line
+        return None
+
+    def trace_line(self, frame, event, arg):
+        self.charge(gc.get_count()[0])
+        self.last_line = (frame.f_code.co_filename, frame.f_lineno)
+        # Read the count again, so that the trace function's own objects are
+        # not charged to the next line
+        self.last_count = gc.get_count()[0]
+        return self.trace_line
+
+    def charge(self, count):
+        """
+        Charges the change in the allocation count since it was last read to
+        the last line traced, and to the phases in progress.
+        """
+        change = count - self.last_count
+        if change and self.last_line is not None:
+            entry = self.lines.get(self.last_line)
+            if entry is None:
+                entry = self.lines[self.last_line] = [0, 0]
+            if change > 0:
+                entry[0] = entry[0] + change
+                self.allocated = self.allocated + change
+                for stats in self.phase_stack:
+                    stats.allocated = stats.allocated + change
+                    stats.frame_allocated = stats.frame_allocated + change
+            else:
+                entry[1] = entry[1] - change
+        self.last_count = count
+
+    # --------------------------------------------------------------------------
+
+    def end_frame(self):
+        """
+        Call at the end of each frame. Records the frame's allocations, and
+        runs the garbage collection which is due.
+        """
+        count = gc.get_count()
+        self.frames = self.frames + 1
+        self.frame_allocated.append(self.allocated)
+        self.frame_kept.append(count[0] - self.frame_start)
+        self.allocated = 0
+        for stats in self.phases.values():
+            stats.highest = max(stats.highest, stats.frame_allocated)
+            stats.frame_allocated = 0
+
+        # Collect the oldest generation which has passed its threshold, as
+        # the collector would have done
+        pause = 0.0
+        threshold = gc.get_threshold()
+        for generation in (2, 1, 0):
+            if threshold[generation] and count[generation] > threshold[generation]:
+                start = time.time()
+                self.collected = self.collected + gc.collect(generation)
+                pause = time.time() - start
+                self.collections[generation] = self.collections[generation] + 1
+                break
+        self.pauses.append(pause)
+
+        # The collection resets the count, so start the next frame (and line)
+        # from the new count
+        self.frame_start = gc.get_count()[0]
+        self.last_count = self.frame_start
+
+    def report(self, top = 20):
+        """
+        Returns a summary of the allocations and garbage collection, as a list
+        of lines of text.
+        """
+        if self.frames == 0:
+            return ["Memory profile: no frames profiled"]
+        frames = float(self.frames)
+        allocated = self.frame_allocated
+        highest = max(allocated)
+        pauses = [pause for pause in self.pauses if pause]
+        lines = []
+        lines.append("Memory profile: %d frames, %.1f objects allocated per frame (highest %d, in frame %d), %.1f per frame still in use at the end of the frame" % (self.frames, sum(allocated) / frames, highest, allocated.index(highest) + 1, sum(self.frame_kept) / frames))
+        if pauses:
+            lines.append("Garbage collection: %d collections (%d, %d and %d of generations 0, 1 and 2), %.3f ms average pause, %.3f ms longest, %d objects freed" % (len(pauses), self.collections[0], self.collections[1], self.collections[2], sum(pauses) * 1000.0 / len(pauses), max(pauses) * 1000.0, self.collected))
+        else:
+            lines.append("Garbage collection: no collections")
+        lines.append("Allocations by phase (per frame, highest in one frame, still in use per frame, calls per frame):")
+        for name, stats in self.phases.items():
+            lines.append("    %-12s %10.1f %8d %8.1f %8.1f" % (name, stats.allocated / frames, stats.highest, stats.kept / frames, stats.calls / frames))
+        lines.append("Allocations by line (per frame, freed per frame):")
+        for key, entry in heapq.nlargest(top, self.lines.items(), key = lambda item: item[1][0]):
+            filename, lineno = key
+            source = linecache.getline(filename, lineno).strip()
+            lines.append("    %8.2f %8.2f  %s:%d  %s" % (entry[0] / frames, entry[1] / frames, os.path.basename(filename), lineno, source))
+        return lines
+
+class SceneMemory(object):
+    """
+    Records the resident set size of the process in each scene (mode) of the
+    game: the peak, and the steady-state size once the scene has settled.
+    
+    sample() is called every frame with the current scene, and reads the size
+    every 'interval' frames, and on the first frame of each visit to a scene.
+    The samples taken in the first 'settle' seconds of a visit (while the
+    scene's assets are loaded and the previous scene's freed) only count
+    towards the peak; the steady-state size is the median of the rest (the
+    most recent 'history' of them).
+    """
+
+    interval = 30
+    settle = 1.0
+    history = 256
+
+    def __init__(self, names):
+        """
+        Params:
+            names : the name of each scene, keyed on the scene
+        """
+        self.names = names
+        self.scene = None
+        self.entered = 0.0
+        self.frames = 0
+        self.visits = {}
+        self.peaks = {}
+        self.samples = {}
+
+    def sample(self, scene):
+        """
+        Records a frame in the specified scene.
+        """
+        self.frames = self.frames + 1
+        if scene == self.scene and self.frames < self.interval:
+            return
+        current = time.time()
+        if scene != self.scene:
+            self.scene = scene
+            self.entered = current
+            self.visits[scene] = self.visits.get(scene, 0) + 1
+        self.frames = 0
+        size = resident_bytes()
+        if size is None:
+            return
+        self.peaks[scene] = max(self.peaks.get(scene, 0), size)
+        if current - self.entered >= self.settle:
+            if scene not in self.samples:
+                self.samples[scene] = deque(maxlen = self.history)
+            self.samples[scene].append(size)
+
+    def report(self):
+        """
+        Returns a summary of the memory used in each scene, as a list of lines
+        of text.
+        """
+        if not self.peaks:
+            return ["Resident memory: not available"]
+        lines = []
+        for scene in sorted(self.peaks):
+            samples = sorted(self.samples.get(scene, []))
+            if samples:
+                steady = "%.1f MB" % (samples[len(samples) // 2] / 1048576.0)
+            else:
+                steady = "not settled"
+            lines.append("Resident memory in the %s scene: %.1f MB peak, %s steady (%d visits)" % (self.names.get(scene, scene), self.peaks[scene] / 1048576.0, steady, self.visits[scene]))
+        return lines
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Networking for the two-player mode.
+
+One game is the 'host', which runs the game and is the authority on its
+state. The other is the 'client', which sends the player's input to the host,
+and shows the state of the world which the host sends back.
+
+Everything is sent over UDP, so packets can be lost or arrive out of order:
+
+    client -> host: the client's most recent commands (one per frame, giving
+                    the state of the keys), repeated in every packet until the
+                    host has acknowledged them. The host applies each command
+                    once, in order.
+
+    host -> client: the state of the world, several times a second. Each state
+                    is sent as the difference (XOR) from the latest state which
+                    the client has acknowledged receiving, compressed, so only
+                    what has changed takes up any space. If the client has not
+                    acknowledged any of the recent states, the state is sent in
+                    full.
+
+Each packet also carries the sender's clock and an echo of the other end's,
+from which both ends measure the round-trip time.
+
+For testing on one machine, a Link can add an artificial delay and packet
+loss to everything which it sends (the 'shim').
+"""
+
+import heapq
+import random
+import socket
+import struct
+import time
+import zlib
+from collections import deque
+
+from snapshot import xor_bytes, pad
+
+# The bits of a command
+COMMAND_LEFT = 1
+COMMAND_RIGHT = 2
+COMMAND_LAUNCH = 4
+
+# The size of the IPv4 and UDP headers, which are included in the bandwidth
+UDP_OVERHEAD = 28
+
+# Client -> host: kind, acknowledged state, echo of the host's clock and the
+# time it was held for, the client's clock, the newest command and the number
+# of commands which follow (one byte each, oldest first)
+INPUT = struct.Struct("<cIIHIIB")
+
+# Host -> client: kind, state number, the state it is the difference from (0
+# for none), the length of the state, the last command applied, the host's
+# clock, and the echo of the client's clock and the time it was held for. The
+# compressed state follows.
+STATE = struct.Struct("<cIIIIIIH")
+
+def now_ms():
+    return int(time.time() * 1000) & 0xffffffff
+
+class RoundTrip(object):
+    """
+    Collects round-trip time measurements.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.lowest = None
+        self.highest = 0
+
+    def add(self, echo, held):
+        """
+        Adds a measurement from the echo of our clock, and the time that the
+        other end held on to it before replying.
+        """
+        rtt = (now_ms() - echo - held) & 0xffffffff
+        if rtt > 60000:
+            # The echo is from before the clock wrapped, or is nonsense
+            return
+        self.count = self.count + 1
+        self.total = self.total + rtt
+        self.highest = max(self.highest, rtt)
+        if self.lowest is None or rtt < self.lowest:
+            self.lowest = rtt
+
+    def average(self):
+        if self.count == 0:
+            return 0.0
+        return float(self.total) / self.count
+
+    def report(self):
+        if self.count == 0:
+            return "no round trips measured"
+        return "round trip %.1f ms average (%d-%d ms)" % (self.average(), self.lowest, self.highest)
+
+class Link(object):
+    """
+    A non-blocking UDP socket, which can add a fixed delay (in milliseconds)
+    to everything sent, and drop a fraction of the packets.
+    """
+
+    def __init__(self, port = 0, latency = 0, loss = 0.0):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("", port))
+        self.socket.setblocking(False)
+        self.port = self.socket.getsockname()[1]
+        self.latency = latency
+        self.loss = loss
+        # The shim has its own random numbers, so that it does not disturb
+        # the game's
+        self.random = random.Random()
+        self.delayed = []
+        self.counter = 0
+
+        self.started = time.time()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.packets_sent = 0
+        self.packets_received = 0
+        self.packets_dropped = 0
+
+    def send(self, data, address):
+        self.packets_sent = self.packets_sent + 1
+        self.bytes_sent = self.bytes_sent + len(data) + UDP_OVERHEAD
+        if self.loss and self.random.random() < self.loss:
+            self.packets_dropped = self.packets_dropped + 1
+        elif self.latency:
+            self.counter = self.counter + 1
+            heapq.heappush(self.delayed, (time.time() + self.latency / 1000.0, self.counter, data, address))
+        else:
+            self.sendto(data, address)
+
+    def sendto(self, data, address):
+        try:
+            self.socket.sendto(data, address)
+        except socket.error:
+            # Nothing is listening yet, or the network is down. Either way,
+            # this is the same as a lost packet.
+            pass
+
+    def receive(self):
+        """
+        Sends any delayed packets which are due, and returns the packets which
+        have arrived, as (data, address) tuples.
+        """
+        current = time.time()
+        while self.delayed and self.delayed[0][0] <= current:
+            due, counter, data, address = heapq.heappop(self.delayed)
+            self.sendto(data, address)
+        packets = []
+        while True:
+            try:
+                data, address = self.socket.recvfrom(65536)
+            except socket.error:
+                break
+            self.packets_received = self.packets_received + 1
+            self.bytes_received = self.bytes_received + len(data) + UDP_OVERHEAD
+            packets.append((data, address))
+        return packets
+
+    def elapsed(self):
+        return max(time.time() - self.started, 0.001)
+
+    def close(self):
+        self.socket.close()
+
+class NetHost(object):
+    """
+    The host's end of the connection. The first client to send a command is
+    the one which the states are sent to.
+    """
+
+    # The number of sent states kept, to be used as the base of the next one
+    history_size = 64
+
+    def __init__(self, port, latency = 0, loss = 0.0):
+        self.link = Link(port, latency, loss)
+        self.client = None
+        self.seq = 0
+        self.sent = {}
+        self.acked = 0
+        self.processed = 0
+        self.echo = 0
+        self.echo_received = 0
+        self.rtt = RoundTrip()
+        self.full_states = 0
+        self.delta_states = 0
+        self.state_bytes = 0
+
+    def poll(self):
+        """
+        Returns the new commands from the client, oldest first.
+        """
+        commands = []
+        for data, address in self.link.receive():
+            try:
+                kind, ack, echo, held, timestamp, newest, count = INPUT.unpack_from(data)
+            except struct.error:
+                continue
+            if kind != b"I":
+                continue
+            if self.client is None:
+                self.client = address
+            elif address != self.client:
+                continue
+            flags = data[INPUT.size:INPUT.size + count]
+            first = newest - len(flags) + 1
+            for i in range(0, len(flags)):
+                if first + i > self.processed:
+                    commands.append(ord(flags[i]))
+                    self.processed = first + i
+            if ack > self.acked:
+                self.acked = ack
+                self.rtt.add(echo, held)
+            self.echo = timestamp
+            self.echo_received = now_ms()
+        return commands
+
+    def send_state(self, state):
+        """
+        Sends the state of the world to the client.
+        """
+        if self.client is None:
+            return
+        self.seq = self.seq + 1
+        base = self.sent.get(self.acked)
+        if base is None:
+            base_seq = 0
+            payload = zlib.compress(state)
+            self.full_states = self.full_states + 1
+        else:
+            base_seq = self.acked
+            length = max(len(state), len(base))
+            payload = zlib.compress(xor_bytes(pad(state, length), pad(base, length)))
+            self.delta_states = self.delta_states + 1
+        held = min((now_ms() - self.echo_received) & 0xffffffff, 0xffff)
+        header = STATE.pack(b"S", self.seq, base_seq, len(state), self.processed, now_ms(), self.echo, held)
+        self.link.send(header + payload, self.client)
+        self.state_bytes = self.state_bytes + len(state)
+        self.sent[self.seq] = state
+        self.sent.pop(self.seq - self.history_size, None)
+
+    def report(self):
+        link = self.link
+        sent = max(self.seq, 1)
+        return "Network host: %d states sent (%d delta, %d full, %d dropped by the shim), %.0f bytes per state (%.0f uncompressed), %.2f KB/s to the client, %.2f KB/s from the client, %s" % (self.seq, self.delta_states, self.full_states, link.packets_dropped, float(link.bytes_sent) / max(link.packets_sent, 1), float(self.state_bytes) / sent, link.bytes_sent / 1024.0 / link.elapsed(), link.bytes_received / 1024.0 / link.elapsed(), self.rtt.report())
+
+    def close(self):
+        self.link.close()
+
+class NetClient(object):
+    """
+    The client's end of the connection.
+    """
+
+    # The number of received states kept, as the bases for the next ones
+    history_size = 64
+
+    # The number of unacknowledged commands repeated in each packet, and the
+    # number kept for replaying (see pending())
+    resend_commands = 16
+    max_commands = 128
+
+    def __init__(self, address, latency = 0, loss = 0.0):
+        self.link = Link(0, latency, loss)
+        self.host = (socket.gethostbyname(address[0]), address[1])
+        self.received = {}
+        self.latest = 0
+        self.commands = deque()
+        self.next_command = 0
+        self.processed = 0
+        self.echo = 0
+        self.echo_received = 0
+        self.rtt = RoundTrip()
+        self.states = 0
+
+    def send_command(self, flags):
+        """
+        Sends a command (the COMMAND_ bits) to the host, along with any earlier
+        ones which the host has not yet applied.
+        """
+        self.next_command = self.next_command + 1
+        self.commands.append((self.next_command, flags))
+        while len(self.commands) > self.max_commands:
+            self.commands.popleft()
+        unapplied = self.pending()[-self.resend_commands:]
+        held = min((now_ms() - self.echo_received) & 0xffffffff, 0xffff)
+        header = INPUT.pack(b"I", self.latest, self.echo, held, now_ms(), self.next_command, len(unapplied))
+        self.link.send(header + b"".join([chr(command) for command in unapplied]), self.host)
+
+    def pending(self):
+        """
+        Returns the commands which the host has not yet applied, oldest first.
+        """
+        return [flags for seq, flags in self.commands if seq > self.processed]
+
+    def poll(self):
+        """
+        Returns the new states from the host, oldest first. States which
+        arrive after a newer one are ignored.
+        """
+        states = []
+        for data, address in self.link.receive():
+            try:
+                kind, seq, base_seq, length, processed, timestamp, echo, held = STATE.unpack_from(data)
+                if kind != b"S" or seq <= self.latest:
+                    continue
+                payload = zlib.decompress(data[STATE.size:])
+            except (struct.error, zlib.error):
+                continue
+            if base_seq:
+                base = self.received.get(base_seq)
+                if base is None:
+                    continue
+                state = xor_bytes(payload, pad(base, len(payload)))[:length]
+            else:
+                state = payload
+            self.received[seq] = state
+            self.received.pop(seq - self.history_size, None)
+            self.latest = seq
+            self.processed = max(self.processed, processed)
+            self.echo = timestamp
+            self.echo_received = now_ms()
+            self.rtt.add(echo, held)
+            self.states = self.states + 1
+            states.append(state)
+        return states
+
+    def report(self):
+        link = self.link
+        return "Network client: %d states received, %.2f KB/s to the host, %.2f KB/s from the host, %s" % (self.states, link.bytes_sent / 1024.0 / link.elapsed(), link.bytes_received / 1024.0 / link.elapsed(), self.rtt.report())
+
+    def close(self):
+        self.link.close()
@@ -0,0 +1,479 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Render backends for the game.
+
+Everything in the game is drawn by calling blit(), blits() or fill() on a
+'target', which is normally the display surface. A render backend provides the
+target for a frame, and presents the finished frame on screen.
+
+The game is drawn in two layers: the world (background, sprites and effects)
+is drawn onto 'target', and the HUD (overlay and text) onto 'hud'. All drawing
+uses the game's own 800x800 co-ordinates, whatever the size of the window.
+
+There are two backends:
+
+    SurfaceRenderer - the reference backend. The target is the display surface
+                      itself, and all drawing is done by pygame's blitters.
+                      Optionally, the world can be drawn into a smaller
+                      internal surface (the 'render scale') which is then
+                      scaled up to the window once per frame, with the HUD
+                      drawn on top at the window's own resolution.
+
+    TextureRenderer - uses the SDL2 Renderer/Texture API (pygame 2 only). Each
+                      image is uploaded as a texture the first time it is
+                      drawn, and frames cut from a film-strip share the texture
+                      of the strip, so that SDL can batch their draw calls. If
+                      no GPU is available, SDL's software renderer is used.
+                      SDL scales the frame to fit the window.
+
+Use create_renderer() to create the backend by name.
+
+A RecordingTarget can stand in for any of the targets. It records what is drawn
+on it, to be replayed onto a real target later, possibly on another thread
+(see the threaded mode in game.py).
+"""
+
+import os
+import weakref
+
+import pygame
+from pygame import Rect
+from pygame.locals import FULLSCREEN
+
+from assets import with_alpha
+
+try:
+    from pygame._sdl2 import video as sdl2_video
+except ImportError:
+    sdl2_video = None
+
+# The filters for scaling the world up to the window
+SCALE_FILTERS = ["integer", "smooth", "nearest"]
+
+class ScaledTarget(object):
+    """
+    Drawing target which takes images and positions in game co-ordinates, and
+    draws them scaled by a fixed factor onto a surface. The scaled copies of
+    the images are cached, and released when the image is no longer in use.
+    """
+
+    def __init__(self, surface, scale, scale_filter = "smooth"):
+        self.surface = surface
+        self.scale = scale
+        self.smooth = (scale_filter == "smooth")
+        self.images = weakref.WeakKeyDictionary()
+
+    def get_width(self):
+        return int(round(self.surface.get_width() / self.scale))
+
+    def get_height(self):
+        return int(round(self.surface.get_height() / self.scale))
+
+    def get_size(self):
+        return (self.get_width(), self.get_height())
+
+    def get_rect(self):
+        return Rect((0, 0), self.get_size())
+
+    def scaled_rect(self, rect):
+        scale = self.scale
+        left = int(round(rect[0] * scale))
+        top = int(round(rect[1] * scale))
+        return Rect(left, top, int(round((rect[0] + rect[2]) * scale)) - left, int(round((rect[1] + rect[3]) * scale)) - top)
+
+    def lookup(self, image):
+        """
+        Returns the scaled copy of the image, and the area of the copy which
+        holds it.
+        """
+        entry = self.images.get(image)
+        if entry is None:
+            # Sub-surfaces (such as animation frames) share the scaled copy of
+            # the image which they were cut from.
+            root = image.get_abs_parent()
+            if root is image:
+                width, height = image.get_size()
+                size = (max(1, int(round(width * self.scale))), max(1, int(round(height * self.scale))))
+                if self.smooth and image.get_bitsize() >= 24:
+                    entry = (pygame.transform.smoothscale(with_alpha(image), size), None)
+                else:
+                    entry = (pygame.transform.scale(image, size), None)
+            else:
+                entry = (self.lookup(root)[0], self.scaled_rect(Rect(image.get_abs_offset(), image.get_size())))
+            self.images[image] = entry
+        return entry
+
+    def blit(self, image, position, area = None, special_flags = 0):
+        scaled, source = self.lookup(image)
+        if area is not None:
+            area = self.scaled_rect(area)
+            if source is not None:
+                area.move_ip(source.topleft)
+            source = area
+        return self.surface.blit(scaled, (int(round(position[0] * self.scale)), int(round(position[1] * self.scale))), source, special_flags)
+
+    def blits(self, blit_sequence, doreturn = 1):
+        blit = self.blit
+        if doreturn:
+            return [blit(*item) for item in blit_sequence]
+        for item in blit_sequence:
+            blit(*item)
+
+    def fill(self, color, rect = None, special_flags = 0):
+        if rect is None:
+            return self.surface.fill(color, None, special_flags)
+        return self.surface.fill(color, self.scaled_rect(Rect(rect)), special_flags)
+
+class RecordingTarget(object):
+    """
+    Drawing target which records the blits and fills made on it, so that they
+    can be replayed onto another target with replay(). The positions and areas
+    are copied as they are recorded, so the sprites can carry on moving once
+    they have been drawn. The images are not copied, so they must not be
+    drawn on afterwards (none of the game's images are).
+    
+    Runs of blits are replayed with a single blits() call.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.ops = []
+        self.run = None
+
+    def get_width(self):
+        return self.size[0]
+
+    def get_height(self):
+        return self.size[1]
+
+    def get_size(self):
+        return self.size
+
+    def get_rect(self):
+        return Rect((0, 0), self.size)
+
+    def blit(self, image, position, area = None, special_flags = 0):
+        if self.run is None:
+            self.run = []
+            self.ops.append((self.run, None))
+        if area is not None:
+            area = Rect(area)
+        self.run.append((image, (position[0], position[1]), area, special_flags))
+        return Rect((position[0], position[1]), image.get_size())
+
+    def blits(self, blit_sequence, doreturn = 1):
+        blit = self.blit
+        if doreturn:
+            return [blit(*item) for item in blit_sequence]
+        for item in blit_sequence:
+            blit(*item)
+
+    def fill(self, color, rect = None, special_flags = 0):
+        if rect is not None:
+            rect = Rect(rect)
+        self.run = None
+        self.ops.append((None, (color, rect, special_flags)))
+        if rect is None:
+            return self.get_rect()
+        return rect
+
+    def replay(self, target):
+        """
+        Draws everything recorded onto the target, in the order it was drawn.
+        """
+        for run, fill in self.ops:
+            if run is not None:
+                target.blits(run, 0)
+            else:
+                target.fill(*fill)
+
+class SurfaceRenderer(object):
+    """
+    Render backend which draws directly onto the display surface.
+    
+    If a render scale other than 1 is given, or the window is not the same
+    size as the game, the world is drawn into an internal surface at
+    'render_scale' times the size of the game, and finish_world() scales it up
+    to fill as much of the window as possible (keeping the proportions) using
+    one of the SCALE_FILTERS:
+    
+        integer - the largest whole-number multiple which fits the window,
+                  without any smoothing
+        smooth  - pygame's smoothscale
+        nearest - nearest-neighbour scaling
+    """
+
+    # Images for this backend must be converted to the display format
+    convert_images = True
+    
+    # Images are finished with once they have been blitted, so they can be
+    # drawn on afterwards, unless they are drawn through a ScaledTarget, whose
+    # cached copies would go stale (set by set_render_scale())
+    retains_images = False
+
+    def __init__(self, size, caption, render_scale = 1.0, window_size = None, fullscreen = False, scale_filter = "smooth"):
+        if fullscreen:
+            # A size of (0, 0) uses the current desktop resolution
+            self.display = pygame.display.set_mode((0, 0), FULLSCREEN)
+        else:
+            self.display = pygame.display.set_mode(window_size or size)
+        pygame.display.set_caption(caption)
+        self.size = size
+        self.scale_filter = scale_filter
+        self.set_render_scale(render_scale)
+
+    def set_render_scale(self, render_scale):
+        """
+        Sets up the targets for drawing the world at the specified render
+        scale. This can be changed while the game is running, after which the
+        game must draw on the new 'target' and 'hud'.
+        """
+        size = self.size
+        scale_filter = self.scale_filter
+        self.render_scale = render_scale
+        self.name = "surface"
+        self.world = None
+
+        world_size = (int(round(size[0] * render_scale)), int(round(size[1] * render_scale)))
+        viewport = self.fit(world_size)
+        if render_scale == 1 and viewport.size == tuple(size):
+            # Nothing to scale, so draw straight onto the display (or the part
+            # of it which the game is shown in)
+            if viewport == self.display.get_rect():
+                self.view = self.display
+            else:
+                self.view = self.display.subsurface(viewport)
+            self.target = self.view
+            self.hud = self.view
+            self.retains_images = False
+            return
+
+        self.name = "surface (%gx, %s)" % (render_scale, scale_filter)
+        self.world = pygame.Surface(world_size).convert()
+        if render_scale == 1:
+            self.target = self.world
+        else:
+            self.target = ScaledTarget(self.world, render_scale, scale_filter)
+        self.view = self.display.subsurface(viewport)
+        if viewport.size == tuple(size):
+            self.hud = self.view
+        else:
+            self.hud = ScaledTarget(self.view, viewport.width / float(size[0]), scale_filter)
+        self.retains_images = isinstance(self.target, ScaledTarget) or isinstance(self.hud, ScaledTarget)
+
+    def fit(self, world_size):
+        """
+        Returns the area of the window which the game will be shown in,
+        centred in the window.
+        """
+        display_width, display_height = self.display.get_size()
+        if self.scale_filter == "integer":
+            factor = max(1, min(display_width // world_size[0], display_height // world_size[1]))
+            width = world_size[0] * factor
+            height = world_size[1] * factor
+        else:
+            factor = min(display_width / float(self.size[0]), display_height / float(self.size[1]))
+            width = int(self.size[0] * factor)
+            height = int(self.size[1] * factor)
+        return Rect((display_width - width) // 2, (display_height - height) // 2, width, height)
+
+    def world_surface(self):
+        """
+        Returns the surface which the world is drawn on, and the scale at
+        which it is drawn (for the screen effects, which work on it in place).
+        """
+        if self.world is None:
+            return (self.view, 1.0)
+        return (self.world, self.render_scale)
+
+    def finish_world(self):
+        """
+        Called once the world has been drawn, before the HUD is drawn. Scales
+        the world up to the window, if it was drawn into an internal surface.
+        """
+        if self.world is None:
+            return
+        if self.view.get_size() == self.world.get_size():
+            self.view.blit(self.world, (0, 0))
+        elif self.scale_filter == "smooth" and self.world.get_bitsize() >= 24:
+            pygame.transform.smoothscale(self.world, self.view.get_size(), self.view)
+        else:
+            pygame.transform.scale(self.world, self.view.get_size(), self.view)
+
+    def frame_surface(self):
+        """
+        Returns a surface holding the finished frame (for capturing it).
+        """
+        return self.display
+
+    def present(self):
+        """
+        Shows the finished frame.
+        """
+        pygame.display.update()
+
+class TextureTarget(object):
+    """
+    Drawing target for the TextureRenderer. This implements the parts of the
+    Surface interface which are used by the game, drawing the images as
+    textures instead.
+    """
+
+    def __init__(self, renderer, size):
+        self.renderer = renderer
+        self.size = size
+        # Textures are cached against the image which they were created from,
+        # and are released when the image is no longer in use.
+        self.textures = weakref.WeakKeyDictionary()
+        self.uploads = 0
+
+    def get_width(self):
+        return self.size[0]
+
+    def get_height(self):
+        return self.size[1]
+
+    def get_size(self):
+        return self.size
+
+    def get_rect(self):
+        return Rect((0, 0), self.size)
+
+    def lookup(self, image):
+        """
+        Returns the texture for the image and the area of the texture which
+        holds it.
+        """
+        entry = self.textures.get(image)
+        if entry is None:
+            # Sub-surfaces (such as animation frames) share the texture of the
+            # image which they were cut from.
+            root = image.get_abs_parent()
+            if root is image:
+                texture = sdl2_video.Texture.from_surface(self.renderer, image)
+                self.uploads = self.uploads + 1
+                entry = (texture, None)
+            else:
+                texture = self.lookup(root)[0]
+                entry = (texture, Rect(image.get_abs_offset(), image.get_size()))
+            self.textures[image] = entry
+        return entry
+
+    def blit(self, image, position, area = None, special_flags = 0):
+        texture, source = self.lookup(image)
+        if area is not None:
+            area = Rect(area)
+            if source is not None:
+                area.move_ip(source.topleft)
+            source = area
+        if source is None:
+            width, height = image.get_size()
+        else:
+            width, height = source.size
+        rect = Rect(position[0], position[1], width, height)
+        texture.draw(source, rect)
+        return rect
+
+    def blits(self, blit_sequence, doreturn = 1):
+        blit = self.blit
+        if doreturn:
+            return [blit(*item) for item in blit_sequence]
+        for item in blit_sequence:
+            blit(*item)
+
+    def fill(self, color, rect = None, special_flags = 0):
+        self.renderer.draw_color = color
+        if rect is None:
+            rect = self.get_rect()
+        else:
+            rect = Rect(rect)
+        self.renderer.fill_rect(rect)
+        return rect
+
+class TextureRenderer(object):
+    """
+    Render backend which uses the SDL2 Renderer and Texture API.
+    """
+
+    # Textures can be created from images in any format, and there is no
+    # display surface to convert them to.
+    convert_images = False
+    
+    # The textures are cached against the images, so an image which is drawn
+    # on after it has been blitted would show stale contents.
+    retains_images = True
+
+    def __init__(self, size, caption, render_scale = 1.0, window_size = None, fullscreen = False, scale_filter = "smooth"):
+        if sdl2_video is None:
+            raise RuntimeError("The texture renderer requires pygame 2")
+        # Ask SDL to batch the draw calls (this has to be set before the
+        # renderer is created).
+        os.environ.setdefault("SDL_RENDER_BATCHING", "1")
+        if scale_filter != "smooth":
+            os.environ.setdefault("SDL_RENDER_SCALE_QUALITY", "nearest")
+        self.window = sdl2_video.Window(caption, window_size or size, fullscreen_desktop = fullscreen)
+        try:
+            self.renderer = sdl2_video.Renderer(self.window, accelerated = 1)
+            self.name = "texture"
+        except Exception:
+            # No GPU available, so fall back on SDL's software renderer
+            self.renderer = sdl2_video.Renderer(self.window, accelerated = 0)
+            self.name = "texture (software)"
+        # The game is always drawn at its own size, and SDL scales it to fit
+        # the window. The render scale is not used, as the scaling is done by
+        # the renderer rather than by blitting.
+        self.renderer.logical_size = size
+        self.render_scale = 1.0
+        self.target = TextureTarget(self.renderer, size)
+        self.hud = self.target
+
+    def set_render_scale(self, render_scale):
+        """
+        Does nothing, as the render scale is not used by this backend.
+        """
+        pass
+
+    def world_surface(self):
+        """
+        Returns None, as the world is drawn by the renderer rather than onto
+        a surface (so the screen effects are not shown).
+        """
+        return None
+
+    def finish_world(self):
+        """
+        Called once the world has been drawn, before the HUD is drawn.
+        """
+        pass
+
+    def frame_surface(self):
+        """
+        Returns a surface holding the finished frame (for capturing it). This
+        has to read the frame back from the renderer, so it is not cheap.
+        """
+        return self.renderer.to_surface()
+
+    def present(self):
+        """
+        Shows the finished frame, and clears the renderer for the next one.
+        """
+        self.renderer.present()
+        self.renderer.draw_color = (0, 0, 0, 255)
+        self.renderer.clear()
+
+RENDERERS = {
+    "surface": SurfaceRenderer,
+    "texture": TextureRenderer,
+}
+
+def create_renderer(name, size, caption, **options):
+    """
+    Creates the named render backend. If the texture renderer is not available
+    (it requires pygame 2), this falls back on the surface renderer. See the
+    SurfaceRenderer for the options.
+    """
+    if name == "texture" and sdl2_video is None:
+        name = "surface"
+    return RENDERERS[name](size, caption, **options)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Screen effects, drawn over the finished world to show what is happening to
+the ship:
+
+    - a glow around a ship with shields, which pulses, and surges when the
+      shields are topped up
+    - a glow around each mining unit while it is mining
+    - a flash around the edges of the screen when the player's ship is hit
+      (red for the hull, blue for the shields), repaired (green) or given
+      another mining unit (amber)
+    - a shake of the world when the player's ship is hit
+
+The effects work on the surface which the world was drawn on, in place: the
+glows are blitted with BLEND_RGB_ADD, the flash is added with fills of
+sub-surfaces which look onto the edges (pygame 1.9 does not blend fills of
+the display surface itself correctly, but does blend fills of its
+sub-surfaces), and the shake scrolls the surface by a few pixels
+(Surface.scroll() moves the pixels within the surface, without a copy).
+Everything which varies from frame to frame is looked up in tables built in
+advance: the glow images at each strength, the colour of each band of the
+flash as it fades, and the offsets of the shake. Only the parts of the screen
+which an effect covers are touched, and nothing at all is done in a frame
+without any effects.
+
+The effects are drawn in two steps, so that the threaded mode can work out
+what to draw on the simulation thread and draw it on the main thread: frame()
+looks at the ships and returns a description of the effects for one frame,
+which apply() draws. The HUD is drawn afterwards, so it does not shake.
+"""
+
+import math
+import random
+
+import pygame
+from pygame.locals import BLEND_RGB_ADD
+
+# The effects are timed in steps of this many milliseconds
+STEP = 16
+
+# The number of strengths at which each glow is drawn (0 is not drawn)
+GLOW_LEVELS = 8
+
+# The glows: colour, and size in game co-ordinates
+GLOWS = {
+    "shield": ((40, 90, 255), (112, 88)),
+    "mining": ((255, 150, 20), (72, 72)),
+}
+
+# The number of concentric ellipses in each glow
+GLOW_RINGS = 12
+
+# The strength of the shield glow over a one-second cycle, relative to the
+# strength of the shields
+PULSE = [0.75 + 0.25 * math.sin(2 * math.pi * i / 64.0) for i in range(0, 64)]
+
+# The extra strength of the shield glow just after the shields are topped up
+SURGE = [1.0 - i / 30.0 for i in range(0, 30)]
+
+# The colours of the flashes, and how each fades
+FLASHES = {
+    "damage": (170, 12, 0),
+    "shield": (20, 50, 170),
+    "repair": (24, 170, 24),
+    "mining": (170, 100, 0),
+}
+FLASH_FADE = [(1.0 - i / 24.0) ** 2 for i in range(0, 24)]
+
+# The flash is drawn as bands around the edges of the visible part of the
+# world, fading towards the middle: the number of bands, and the width of
+# each (in game co-ordinates)
+FLASH_BANDS = 6
+FLASH_BAND_WIDTH = 8
+
+def make_shake(amplitude, steps, seed):
+    """
+    Returns the offsets of a shake, which dies away over the specified number
+    of steps.
+    """
+    rng = random.Random(seed)
+    offsets = []
+    for i in range(0, steps):
+        size = amplitude * (1.0 - float(i) / steps)
+        offsets.append((int(round(rng.uniform(-size, size))), int(round(rng.uniform(-size, size)))))
+    return offsets
+
+# The shakes for a hit on the hull and on the shields
+SHAKES = {
+    "damage": make_shake(6, 18, 1),
+    "shield": make_shake(2, 10, 2),
+}
+
+class ScreenEffects(object):
+    """
+    Works out and draws the screen effects.
+    """
+
+    def __init__(self, area):
+        """
+        Params:
+            area : the part of the world which is not covered by the HUD, in
+                   game co-ordinates
+        """
+        self.area = pygame.Rect(area)
+        self.surface = None
+        self.scale = None
+        self.glows = {}
+        self.bands = []
+        # The flash colours for each step of each flash, one for each band
+        # (None where the band has faded to nothing)
+        self.flash_colours = {}
+        for name, colour in FLASHES.items():
+            steps = []
+            for fade in FLASH_FADE:
+                bands = []
+                for band in range(0, FLASH_BANDS):
+                    band_colour = tuple([int(value * fade * (1.0 - float(band) / FLASH_BANDS)) for value in colour])
+                    bands.append(band_colour if max(band_colour) else None)
+                steps.append(bands)
+            self.flash_colours[name] = steps
+        self.clear()
+
+    def clear(self):
+        """
+        Forgets the state of the ship, and stops any flash or shake (for when
+        the game is reset or restored).
+        """
+        self.last = None
+        self.flash = None
+        self.flash_time = 0
+        self.shake = None
+        self.shake_time = 0
+        self.surge_time = None
+
+    def prepare(self, surface, scale):
+        """
+        Builds the glow images and the flash bands for the surface which the
+        world is drawn on, at the specified scale. This has to be done after
+        the display has been created.
+        """
+        self.surface = surface
+        self.scale = scale
+        self.glows = {}
+        for name, (colour, glow_size) in GLOWS.items():
+            width = max(2, int(round(glow_size[0] * scale)))
+            height = max(2, int(round(glow_size[1] * scale)))
+            levels = [None]
+            for level in range(1, GLOW_LEVELS):
+                strength = float(level) / (GLOW_LEVELS - 1)
+                image = pygame.Surface((width, height)).convert()
+                image.fill((0, 0, 0))
+                # Draw the rings from the outside in, each covering the middle
+                # of the one before
+                for ring in range(GLOW_RINGS, 0, -1):
+                    fraction = float(ring) / GLOW_RINGS
+                    if name == "shield":
+                        # Brightest just inside the rim, with a faint tint
+                        # over the ship
+                        intensity = max(0.15, 1.0 - abs(fraction - 0.8) / 0.35)
+                    else:
+                        intensity = (1.0 - fraction) ** 0.5
+                    rect = pygame.Rect(0, 0, max(1, int(width * fraction)), max(1, int(height * fraction)))
+                    rect.center = (width // 2, height // 2)
+                    pygame.draw.ellipse(image, [int(value * intensity * strength) for value in colour], rect)
+                levels.append(image)
+            self.glows[name] = levels
+
+        left = int(round(self.area.left * scale))
+        top = int(round(self.area.top * scale))
+        width = min(int(round(self.area.right * scale)), surface.get_width()) - left
+        height = min(int(round(self.area.bottom * scale)), surface.get_height()) - top
+        band_width = max(1, int(round(FLASH_BAND_WIDTH * scale)))
+        self.bands = []
+        for band in range(0, FLASH_BANDS):
+            outer = band * band_width
+            inner = outer + band_width
+            rects = [
+                pygame.Rect(left + outer, top + outer, width - 2 * outer, band_width),
+                pygame.Rect(left + outer, top + height - inner, width - 2 * outer, band_width),
+                pygame.Rect(left + outer, top + inner, band_width, height - 2 * inner),
+                pygame.Rect(left + width - inner, top + inner, band_width, height - 2 * inner)]
+            self.bands.append([surface.subsurface(rect) for rect in rects])
+
+    def close(self):
+        """
+        Lets go of the views of the surface, which must not outlive the
+        display (call this before pygame.quit()).
+        """
+        self.surface = None
+        self.scale = None
+        self.bands = []
+
+    def frame(self, ship, ships, mining, current_time):
+        """
+        Returns the effects for one frame, given the player's ship (whose
+        hits and powerups start the flashes and shakes), all the ships (which
+        glow while they have shields), the rects of the mining units which are
+        mining, and the time in milliseconds. Returns None if there are none.
+        """
+        state = (ship.hull, ship.shield, ship.total_mining_units)
+        if self.last is not None and state != self.last:
+            hull, shield, mining_units = self.last
+            if ship.hull < hull:
+                self.start(current_time, "damage", "damage")
+            elif ship.shield < shield:
+                self.start(current_time, "shield", "shield")
+            elif ship.hull > hull:
+                self.start(current_time, "repair")
+            elif ship.total_mining_units > mining_units:
+                self.start(current_time, "mining")
+            if ship.shield > shield:
+                self.surge_time = current_time
+        self.last = state
+
+        step = current_time // STEP
+        glows = []
+        surge = 0.0
+        if self.surge_time is not None:
+            surge_step = (current_time - self.surge_time) // STEP
+            if surge_step < len(SURGE):
+                surge = SURGE[surge_step]
+            else:
+                self.surge_time = None
+        for other in ships:
+            if other.visible and other.shield > 0:
+                strength = min(1.0, other.shield / 100.0 * PULSE[step % len(PULSE)] + surge)
+                level = int(strength * (GLOW_LEVELS - 1) + 0.5)
+                if level:
+                    glows.append(("shield", level, other.rect.center))
+        if mining:
+            level = int(PULSE[(step * 3) % len(PULSE)] * (GLOW_LEVELS - 1) + 0.5)
+            for rect in mining:
+                glows.append(("mining", level, rect.center))
+
+        flash = None
+        if self.flash is not None:
+            flash_step = (current_time - self.flash_time) // STEP
+            if flash_step < len(FLASH_FADE):
+                flash = (self.flash, flash_step)
+            else:
+                self.flash = None
+        shake = None
+        if self.shake is not None:
+            shake_step = (current_time - self.shake_time) // STEP
+            if shake_step < len(SHAKES[self.shake]):
+                shake = SHAKES[self.shake][shake_step]
+            else:
+                self.shake = None
+
+        if not glows and flash is None and shake is None:
+            return None
+        return (glows, flash, shake)
+
+    def start(self, current_time, flash, shake = None):
+        """
+        Starts a flash (one of the FLASHES) and, optionally, a shake (one of
+        the SHAKES).
+        """
+        self.flash = flash
+        self.flash_time = current_time
+        if shake is not None:
+            self.shake = shake
+            self.shake_time = current_time
+
+    def apply(self, surface, scale, effects):
+        """
+        Draws the effects returned by frame() onto the surface which the world
+        was drawn on, at the specified scale.
+        """
+        if effects is None:
+            return
+        if surface is not self.surface or scale != self.scale:
+            self.prepare(surface, scale)
+        glows, flash, shake = effects
+        for name, level, centre in glows:
+            image = self.glows[name][level]
+            width, height = image.get_size()
+            surface.blit(image, (int(centre[0] * scale) - width // 2, int(centre[1] * scale) - height // 2), None, BLEND_RGB_ADD)
+        if shake is not None:
+            surface.scroll(int(round(shake[0] * scale)), int(round(shake[1] * scale)))
+        if flash is not None:
+            name, step = flash
+            for colour, views in zip(self.flash_colours[name][step], self.bands):
+                if colour is not None:
+                    for view in views:
+                        view.fill(colour, None, BLEND_RGB_ADD)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Storage for game-state snapshots.
+
+The SnapshotRing holds a history of snapshots (byte strings, as produced by
+Game.take_snapshot()) in a fixed amount of memory. Most snapshots differ only
+slightly from the one before, so only every 'keyframe_interval'th snapshot is
+stored in full. The others are stored as the difference (XOR) from the
+previous snapshot, which is mostly zero bytes and compresses very well.
+
+When the memory is full, the oldest snapshots are discarded, along with any
+differences which can no longer be decoded because their keyframe has gone.
+"""
+
+import binascii
+import zlib
+from collections import deque
+
+def xor_bytes(first, second):
+    """
+    Returns the XOR of two byte strings of the same length.
+    """
+    if not first:
+        return b""
+    # Working on the strings as (long) integers keeps the loop in C
+    value = long(binascii.hexlify(first), 16) ^ long(binascii.hexlify(second), 16)
+    return binascii.unhexlify("%0*x" % (len(first) * 2, value))
+
+def pad(data, length):
+    return data + (b"\x00" * (length - len(data)))
+
+class SnapshotRing(object):
+    """
+    A fixed-size ring of delta-encoded snapshots.
+    """
+
+    def __init__(self, capacity = 1024 * 1024, keyframe_interval = 8):
+        self.capacity = capacity
+        self.keyframe_interval = keyframe_interval
+        self.memory = bytearray(capacity)
+        self.clear()
+
+    def clear(self):
+        """
+        Discards all the snapshots.
+        """
+        # Each entry is a tuple of (offset, stored length, snapshot length,
+        # is keyframe), oldest first.
+        self.entries = deque()
+        self.head = 0
+        self.previous = None
+        self.since_keyframe = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.pushed = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def push(self, snapshot):
+        """
+        Adds a snapshot to the ring, discarding the oldest ones if necessary.
+        """
+        keyframe = (self.previous is None) or (self.since_keyframe >= self.keyframe_interval - 1)
+        if keyframe:
+            data = zlib.compress(snapshot, 1)
+            self.since_keyframe = 0
+        else:
+            length = max(len(snapshot), len(self.previous))
+            data = zlib.compress(xor_bytes(pad(snapshot, length), pad(self.previous, length)), 1)
+            self.since_keyframe = self.since_keyframe + 1
+        if len(data) > self.capacity:
+            raise ValueError("Snapshot is larger than the ring")
+
+        # Find room for the new entry, wrapping round to the start if it will
+        # not fit at the end. Everything after the head is older than
+        # everything before it, so the entries in the unused space at the end
+        # are discarded first.
+        if self.head + len(data) > self.capacity:
+            while self.entries and self.entries[0][0] >= self.head:
+                self.entries.popleft()
+            self.head = 0
+        end = self.head + len(data)
+        while self.entries and self.entries[0][0] < end and self.entries[0][0] + self.entries[0][1] > self.head:
+            self.entries.popleft()
+        # Differences are useless without their keyframe
+        while self.entries and not self.entries[0][3]:
+            self.entries.popleft()
+
+        self.memory[self.head:end] = data
+        self.entries.append((self.head, len(data), len(snapshot), keyframe))
+        self.head = end
+        self.previous = snapshot
+        self.pushed = self.pushed + 1
+        self.raw_bytes = self.raw_bytes + len(snapshot)
+        self.stored_bytes = self.stored_bytes + len(data)
+
+    def get(self, index):
+        """
+        Returns the snapshot at the specified index (0 is the oldest, and -1
+        the newest).
+        """
+        if index < 0:
+            index = len(self.entries) + index
+        if index < 0 or index >= len(self.entries):
+            raise IndexError("No such snapshot")
+        # Find the keyframe, and apply the differences from there
+        start = index
+        while not self.entries[start][3]:
+            start = start - 1
+        snapshot = None
+        for position in range(start, index + 1):
+            offset, stored, length, keyframe = self.entries[position]
+            data = zlib.decompress(bytes(self.memory[offset:offset + stored]))
+            if keyframe:
+                snapshot = data
+            else:
+                snapshot = xor_bytes(data, pad(snapshot, len(data)))[:length]
+        return snapshot
+
+    def truncate(self, index):
+        """
+        Discards all the snapshots after the specified index, so that the next
+        push() follows on from it (used when rewinding).
+        """
+        if index < 0:
+            index = len(self.entries) + index
+        snapshot = self.get(index)
+        while len(self.entries) > index + 1:
+            self.entries.pop()
+        offset, stored, length, keyframe = self.entries[-1]
+        self.head = offset + stored
+        self.previous = snapshot
+        # Count back to the last keyframe, so that the keyframes stay evenly
+        # spaced
+        self.since_keyframe = 0
+        position = len(self.entries) - 1
+        while not self.entries[position][3]:
+            self.since_keyframe = self.since_keyframe + 1
+            position = position - 1
+        return snapshot
+
+    def report(self):
+        """
+        Returns a summary of the memory used.
+        """
+        if self.pushed == 0:
+            return "Snapshots: none taken"
+        return "Snapshots: %d taken, %d held; %.0f bytes per snapshot (%.0f stored)" % (self.pushed, len(self.entries), float(self.raw_bytes) / self.pushed, float(self.stored_bytes) / self.pushed)